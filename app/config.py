@@ -1,3 +1,5 @@
+from typing import Literal
+
 from dotenv import load_dotenv
 from pydantic_settings import BaseSettings
 
@@ -9,9 +11,52 @@ LIMIT_PERIOD: str = "15/minute"
 class Settings(BaseSettings):
     firebase_config_file: str = ""
     firebase_bucket: str = ""
+    # Every upload makes its blob public with an ACL. Turn it off once the whole bucket is
+    # public through IAM (scripts/make_bucket_public.py), it must be off with uniform access
+    firebase_public_acl: bool = True
+    # jpeg or webp with storage_image_quality (0-100), png is lossless and about 8x bigger
+    storage_image_format: Literal["jpeg", "webp", "png"] = "jpeg"
+    storage_image_quality: int = 85
+    # Longest side of the thumbnails saved next to every image, the image itself is MAX_SIZE
+    storage_thumbnail_sizes: list[int] = [64, 128]
 
     pinecone_api_key: str = ""
     pinecone_env: str = ""
+    pinecone_query_concurrency: int = 16
+
+    # pinecone: the remote index, local: the in-process index in local_vector_store_path
+    vector_store: Literal["pinecone", "local"] = "pinecone"
+    local_vector_store_path: str = "./vector_store"
+    local_index_nlist: int = 0  # 0 picks sqrt(number of vectors)
+    local_index_nprobe: int = 8
+    local_index_exact_threshold: int = 20000
+    # The changes are written to disk this long after the first one, 0 writes after every one
+    local_vector_store_persist_delay_seconds: float = 1.0
+
+    # live: the real services, fake: in-process stand-ins (app/services/fake_backends.py) to
+    # run the app and load tests without credentials
+    pinecone_backend: Literal["live", "fake"] = "live"
+    firebase_backend: Literal["live", "fake"] = "live"
+    fake_latency_ms: float = 0.0
+    fake_latency_jitter_ms: float = 0.0
+    fake_error_rate: float = 0.0
+    fake_seed: int | None = None
+
+    user_cache_enabled: bool = True
+    user_cache_max_bytes: int = 256 * 1024 * 1024
+    user_cache_ttl_seconds: float = 600.0
+    # A photo within this Hamming distance of the dHash of a saved cap skips the model
+    near_duplicate_enabled: bool = True
+    near_duplicate_max_distance: int = 4
+
+    result_cache_enabled: bool = True
+    result_cache_max_entries: int = 1024
+    result_cache_ttl_seconds: float = 24 * 60 * 60
+    # Shared by the workers, empty keeps the detections in memory and doesn't cache identify
+    result_cache_dir: str = ""
+    # The entries on disk past the TTL, then the oldest past the size, are removed this often
+    result_cache_max_disk_bytes: int = 512 * 1024 * 1024
+    result_cache_sweep_seconds: float = 10 * 60
 
     profiling_time: bool = False
 
@@ -20,10 +65,50 @@ class Settings(BaseSettings):
     port: int = 8080
     prefix_url: str = "http://"
     torch_home: str = "./model"
+    # The bundled weights of MobileNet, written by `make export-vectorizer`
+    vectorizer_weights_path: str = "./model/mobilenet_v3_small.pth"
+    warm_up_on_startup: bool = True
 
     api_key: str = "dumb_key"
+    rate_limit_enabled: bool = True
 
     sentry_dsn: str = "dumb_dsn"
     is_sentry: bool = True
 
     initialize_model: bool = True
+    # eager, torchscript, compile (torch.compile), onnx or int8 (ONNX Runtime, int8 weights)
+    vectorizer_backend: Literal["eager", "torchscript", "compile", "onnx", "int8"] = "eager"
+    vectorizer_artifacts_dir: str = "./model/vectorizer"
+
+    embedding_batch_max_size: int = 32
+    embedding_batch_max_wait_ms: float = 5.0
+
+    # /saver/bulk: decoded images waiting between two stages, parallel Firebase uploads and
+    # vectors sent in every upsert to the vector store
+    bulk_save_queue_size: int = 16
+    bulk_save_upload_concurrency: int = 8
+    bulk_save_upsert_batch_size: int = 100
+    bulk_save_upsert_max_wait_ms: float = 50.0
+    bulk_delete_max_names: int = 1000
+    # /identify/bulk: files identified at the same time, the embeddings are batched together
+    bulk_identify_concurrency: int = 32
+    bulk_identify_max_files: int = 200
+
+    # exact: k-means over every pixel, fast: k-means over a subsample and a nearest-center pass
+    quantization_mode: Literal["exact", "fast"] = "exact"
+    quantization_sampling: Literal["random", "strided"] = "random"
+    quantization_sample_size: int = 20000
+    quantization_attempts: int = 3
+    quantization_seed: int = 0
+
+    # compat: the blobs are suppressed in the order of the detector, size: the biggest first
+    nms_mode: Literal["compat", "size"] = "compat"
+
+    # process: the detection (OpenCV/k-means) in a process pool, thread: in a thread pool,
+    # inline: in the event loop. The other CPU work always runs in the thread executor
+    detect_executor: Literal["process", "thread", "inline"] = "process"
+    detect_workers: int = 2
+    cpu_thread_workers: int = 4
+    io_workers: int = 16
+    # Threads of the Firebase calls, also the size of the pool of HTTP connections
+    storage_workers: int = 16
@@ -1,17 +1,25 @@
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
 from typing import Any
 
 import uvicorn
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from pyinstrument import Profiler
 from starlette import status
 from starlette.requests import Request
+from starlette.responses import Response
 
 from app.config import LIMIT_PERIOD, Settings
 from app.services.detect.router import detect_router
+from app.services.identify.batcher import EmbeddingBatcher
 from app.services.identify.router import identify_router
 from app.services.limiter import request_limiter
 from app.services.saver.router import saver_router
+from app.services.vector_store import close_vector_store
+from app.services.warm_up import WarmUp
+from app.shared.executors import shutdown_executors
+from app.shared.metrics import render_metrics
 
 settings = Settings()
 
@@ -27,7 +35,18 @@ if settings.is_sentry:
     )
 
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(_: FastAPI) -> AsyncIterator[None]:
+    """Warm up the worker in the background, release the pools and persist the vectors on exit."""
+    WarmUp().start()
+    yield
+    await WarmUp().close()
+    await EmbeddingBatcher().close()
+    shutdown_executors()
+    close_vector_store()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # Add routers
 app.include_router(detect_router)
@@ -70,5 +89,25 @@ def health_check(request: Request):
     return status.HTTP_200_OK
 
 
+# Not rate limited, the load balancer probes it on every worker
+@app.get("/ready")
+def ready_check():
+    """Readiness, 503 until the warm-up has loaded the model and opened the connections."""
+    warm_up = WarmUp()
+    if not warm_up.ready:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=warm_up.get_status()
+        )
+    return warm_up.get_status()
+
+
+# Not rate limited nor authenticated, like /ready it is scraped on every worker
+@app.get("/metrics")
+def metrics():
+    """Latency of every stage of the pipeline and of the external calls, for Prometheus."""
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+
 if __name__ == "__main__":
     uvicorn.run(app, host="127.0.0.1", port=8080)
@@ -4,6 +4,8 @@ from loguru import logger
 from numpy import ndarray
 
 from app.config import Settings
+from app.services.detect.nms import nms_boxes
+from app.shared.metrics import time_stage
 from app.shared.save_img_decorator import save_img
 
 DEBUG_BLOB = 1
@@ -16,14 +18,16 @@ percent_max_area_of_original = 0.99
 settings = Settings()
 
 
+@time_stage("reduce_colors_images")
 @save_img(output_path="./animations/pp_1.png")
-def reduce_colors_images(image: ndarray, n_colors: int) -> ndarray:
+def reduce_colors_images(image: ndarray, n_colors: int, mode: str | None = None) -> ndarray:
     """Reduce the number of colors to a specific number.
 
     Args:
     ----
         image: The image we are going to reduce.
         n_colors (int): The number of colors to reduce.
+        mode: exact or fast, `quantization_mode` by default.
 
     Returns:
     -------
@@ -32,16 +36,91 @@ def reduce_colors_images(image: ndarray, n_colors: int) -> ndarray:
     """
     pixels = image.reshape((-1, 3)).astype(np.float32)
 
-    # Perform k-means clustering
-    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 10, 1.0)
-    flags: int = cv2.KMEANS_RANDOM_CENTERS
-    compactness, labels, centers = cv2.kmeans(pixels, n_colors, None, criteria, 10, flags)
+    if (mode or settings.quantization_mode) == "fast":
+        labels, centers = _quantize_subsample(pixels, n_colors)
+    else:
+        # Perform k-means clustering
+        criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 10, 1.0)
+        flags: int = cv2.KMEANS_RANDOM_CENTERS
+        compactness, labels, centers = cv2.kmeans(pixels, n_colors, None, criteria, 10, flags)
 
     # Convert the labels back to an image
     quantized = centers[labels]
     return quantized.reshape(image.shape).astype(np.uint8)
 
 
+def _quantize_subsample(pixels: ndarray, n_colors: int) -> tuple[ndarray, ndarray]:
+    """Fit the centers on a subsample of the pixels and assign every pixel to the nearest one.
+
+    Args:
+    ----
+        pixels: The float32 pixels, shape (N, 3).
+        n_colors: The number of centers.
+
+    Returns:
+    -------
+        The label of every pixel and the centers.
+
+    """
+    # A local generator, seeding the global RNG of OpenCV would change every other user of it
+    rng = np.random.default_rng(settings.quantization_seed)
+    sample_size = settings.quantization_sample_size
+    if len(pixels) <= sample_size:
+        sample = pixels
+    elif settings.quantization_sampling == "strided":
+        sample = pixels[:: len(pixels) // sample_size]
+    else:
+        sample = pixels[rng.choice(len(pixels), sample_size, replace=False)]
+    sample = np.ascontiguousarray(sample)
+
+    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 10, 1.0)
+    best_compactness, centers = np.inf, None
+    for _ in range(settings.quantization_attempts):
+        compactness, _, attempt_centers = cv2.kmeans(
+            sample,
+            n_colors,
+            _kmeans_pp_labels(sample, n_colors, rng),
+            criteria,
+            1,
+            cv2.KMEANS_USE_INITIAL_LABELS,
+        )
+        if compactness < best_compactness:
+            best_compactness, centers = compactness, attempt_centers
+
+    # argmin of |p - c|^2 = |p|^2 - 2 p.c + |c|^2, |p|^2 is the same for all the centers
+    distances = np.sum(centers**2, axis=1) - 2 * (pixels @ centers.T)
+    return np.argmin(distances, axis=1), centers
+
+
+def _kmeans_pp_labels(sample: ndarray, n_colors: int, rng: np.random.Generator) -> ndarray:
+    """Pick the initial centers with k-means++ and label every pixel with the nearest one.
+
+    Args:
+    ----
+        sample: The float32 pixels, shape (N, 3).
+        n_colors: The number of centers.
+        rng: The generator of the choices.
+
+    Returns:
+    -------
+        The int32 labels, shape (N, 1), as `cv2.kmeans` takes them.
+
+    """
+    centers = [sample[rng.integers(len(sample))]]
+    distances = np.sum((sample - centers[0]) ** 2, axis=1, dtype=np.float64)
+    for _ in range(1, n_colors):
+        total = distances.sum()
+        # Fewer distinct colors than centers, any pixel will do
+        index = (
+            rng.choice(len(sample), p=distances / total) if total > 0 else rng.integers(len(sample))
+        )
+        centers.append(sample[index])
+        distances = np.minimum(distances, np.sum((sample - sample[index]) ** 2, axis=1))
+
+    center_distances = ((sample[:, None, :] - np.array(centers)[None, :, :]) ** 2).sum(axis=2)
+    return np.argmin(center_distances, axis=1).astype(np.int32).reshape(-1, 1)
+
+
 @save_img(output_path="./animations/pp_2.png")
 def preprocess_image_blobs(image: ndarray) -> ndarray:
     """Preprocess the image to make the detection of the blobs easier.
@@ -86,9 +165,10 @@ def get_avg_size_all_blobs(img: ndarray) -> int:
     params.filterByCircularity = False
     params.filterByConvexity = False
 
-    detector = cv2.SimpleBlobDetector_create(params)
-    keypoints = detector.detect(img)
-    keypoints = _remove_overlapping_blobs(keypoints=keypoints)
+    with time_stage("blob_detection"):
+        detector = cv2.SimpleBlobDetector_create(params)
+        keypoints = detector.detect(img)
+        keypoints = _remove_overlapping_blobs(keypoints=keypoints)
 
     if len(keypoints) == 0:
         return 0
@@ -131,23 +211,9 @@ def _remove_overlapping_blobs(keypoints: list):
         box = (x - r, y - r, x + r, y + r)
         boxes.append(box)
 
-    # Iterate over the blobs and mark overlapping ones
-    overlapping = [False] * len(keypoints)
-    for i, box in enumerate(boxes):
-        if overlapping[i]:
-            continue
-        for j, other_box in enumerate(boxes[i + 1 :]):
-            if (
-                box[0] < other_box[2]
-                and box[2] > other_box[0]
-                and box[1] < other_box[3]
-                and box[3] > other_box[1]
-            ):
-                overlapping[i + j + 1] = True
-
-    # Keep only the non-overlapping blobs
-    filtered_keypoints = []
-    for i, kp in enumerate(keypoints):
-        if not overlapping[i]:
-            filtered_keypoints.append(kp)
-    return filtered_keypoints
+    # compat visits the blobs in the order of the detector, size keeps the biggest ones first
+    scores = [kp.size for kp in keypoints] if settings.nms_mode == "size" else None
+    keep = nms_boxes(np.array(boxes), scores)
+
+    # Keep only the non-overlapping blobs, in their original order
+    return [keypoints[i] for i in sorted(keep)]
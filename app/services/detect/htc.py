@@ -5,6 +5,9 @@ import numpy as np
 from loguru import logger
 from numpy import ndarray, uint16
 
+from app.services.detect.nms import nms_circles
+from app.shared.metrics import time_stage
+
 multiplier_left_max_radius = 0.8
 multiplier_right_max_radius = 1
 
@@ -22,18 +25,13 @@ def combine_overlapping_circles(circles: uint16) -> list[tuple[int, int, int]]:
 
     """
     circles = np.round(circles[0, :]).astype("int")
-    combined_circles = []
-    for x, y, r in circles:
-        found_overlap = False
-        for cx, cy, cr in combined_circles:
-            if (x - cx) ** 2 + (y - cy) ** 2 < (r + cr) ** 2:
-                found_overlap = True
-                break
-        if not found_overlap:
-            combined_circles.append((x, y, r))
-    return combined_circles
+    # HoughCircles sorts the circles by the votes of the accumulator, the input order is already
+    # the order of their strength
+    keep = nms_circles(circles)
+    return [(int(x), int(y), int(r)) for x, y, r in circles[keep]]
 
 
+@time_stage("hough_transform_circle")
 def hough_transform_circle(original_img: np.ndarray, max_radius: int) -> list[tuple[int, int, int]]:
     """Return the final circles after HTC transformation.
 
@@ -61,6 +59,8 @@ def hough_transform_circle(original_img: np.ndarray, max_radius: int) -> list[tu
         minRadius=int(max_radius * multiplier_left_max_radius),
         maxRadius=int(max_radius * multiplier_right_max_radius),
     )
+    if circles is None:
+        return []
     circles: uint16 = np.uint16(np.around(circles))
 
     return combine_overlapping_circles(circles)
@@ -3,6 +3,9 @@ from numpy import ndarray
 
 from app.services.detect.blobs import get_avg_size_all_blobs
 from app.services.detect.htc import hough_transform_circle
+from app.shared.decoded_image import DecodedImage
+from app.shared.executors import run_in_thread, run_on_image
+from app.shared.metrics import CAPS_PER_IMAGE, time_stage
 from app.shared.save_img_decorator import save_img
 
 MAX_WIDTH_IMAGE = 1000
@@ -24,7 +27,7 @@ def resize_image(src: ndarray, factor: float) -> ndarray:
     """
     height, width = src.shape[:2]
     new_size = (int(width * factor), int(height * factor))
-    return cv2.resize(src, new_size)
+    return cv2.resize(src, new_size, interpolation=cv2.INTER_AREA)
 
 
 def crop_image_into_rectangles(photo_image: ndarray, rectangles: list) -> list[tuple]:
@@ -72,9 +75,26 @@ def get_rectangles(circles: list) -> list[tuple]:
     return rectangles
 
 
+def scale_rectangles(rectangles: list[tuple], factor: float) -> list[tuple]:
+    """Scale the rectangles found in the analysis image to the coordinates of the original.
+
+    Args:
+    ----
+        rectangles: The (x, y, w, h) rectangles.
+        factor: The size of the original image divided by the size of the analysis image.
+
+    Returns:
+    -------
+        The rectangles in the coordinates of the original image.
+
+    """
+    return [tuple(round(v * factor) for v in rectangle) for rectangle in rectangles]
+
+
+@time_stage("preprocess_image_size")
 @save_img(output_path="./animations/pp_0.png")
 def preprocess_image_size(img: ndarray) -> ndarray:
-    """Resize the image to a specific maximum.
+    """Resize the image to a specific maximum with a single resize.
 
     Args:
     ----
@@ -82,37 +102,102 @@ def preprocess_image_size(img: ndarray) -> ndarray:
 
     Returns:
     -------
-        The resulting resized image.
+        The resulting resized image, the image itself when it's already small enough.
 
     """
     height, width = img.shape[:2]
-    size = height * width
     max_size_img = MAX_WIDTH_IMAGE * MAX_HEIGHT_IMAGE
-    resized = img
-    while size > max_size_img:
-        resized = resize_image(resized, 2 / 3)
-        height, width = resized.shape[:2]
-        size = height * width
-    return resized
+    if height * width <= max_size_img:
+        return img
+    return resize_image(img, (max_size_img / (height * width)) ** 0.5)
+
+
+def detect_rectangles(img: ndarray) -> list[tuple]:
+    """Find the rectangles of the caps in the analysis image.
+
+    Args:
+    ----
+        img: The analysis image, the output of `preprocess_image_size`.
+
+    Returns:
+    -------
+        A list with the rectangles of the caps.
+
+    """
+    avg_size: int = get_avg_size_all_blobs(img)
+    if not avg_size:
+        return []
+    circles: list[tuple] = hough_transform_circle(img, avg_size)
+    return [tuple(int(v) for v in rct) for rct in get_rectangles(circles)]
+
+
+def detect_original_rectangles(img: ndarray) -> list[tuple]:
+    """Find the rectangles of the caps in a small analysis image of the original one.
+
+    Args:
+    ----
+        img: The original image.
+
+    Returns:
+    -------
+        A list with the rectangles of the caps, in the coordinates of the original image.
+
+    """
+    analysis_img: ndarray = preprocess_image_size(img)
+    rectangles = detect_rectangles(analysis_img)
+    return scale_rectangles(rectangles, img.shape[1] / analysis_img.shape[1])
 
 
 def detect_caps(img: ndarray) -> list[tuple]:
     """Detect the caps in the image.
 
+    The caps are found in a small analysis image and cropped from the original one.
+
     Args:
     ----
         img: The original image.
 
     Returns:
     -------
-        A list with the detected caps.
+        A list with the detected caps, their positions are in the original image.
 
     """
-    img: ndarray = preprocess_image_size(img)
-    avg_size: int = get_avg_size_all_blobs(img)
-    cropped_images = []
-    if avg_size:
-        circles: list[tuple] = hough_transform_circle(img, avg_size)
-        rectangles: list[tuple] = get_rectangles(circles)
-        cropped_images: list[tuple] = crop_image_into_rectangles(img, rectangles)
+    return crop_image_into_rectangles(img, detect_original_rectangles(img))
+
+
+async def detect_caps_async(img: ndarray) -> list[tuple]:
+    """Detect the caps in the image without blocking the event loop.
+
+    The resize and the detection run in the process executor, only the rectangles come back
+    and the crops are cut here from the original image, at full resolution.
+
+    Args:
+    ----
+        img: The original image.
+
+    Returns:
+    -------
+        A list with the detected caps, their positions are in the original image.
+
+    """
+    rectangles: list[tuple] = await run_on_image(detect_original_rectangles, img)
+    cropped_images = crop_image_into_rectangles(img, rectangles)
+    CAPS_PER_IMAGE.observe(len(cropped_images))
     return cropped_images
+
+
+async def post_detect(file_contents: bytes) -> list[tuple]:
+    """Detect the caps of an uploaded image.
+
+    Args:
+    ----
+        file_contents: The raw content.
+
+    Returns:
+    -------
+        The list of positions were the caps where detected.
+
+    """
+    image = await run_in_thread(DecodedImage(file_contents).decoded)
+    cropped_images = await detect_caps_async(image)
+    return [tuple(int(v) for v in rct) for (img, rct) in cropped_images]
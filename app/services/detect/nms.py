@@ -0,0 +1,125 @@
+from collections.abc import Callable
+
+import numpy as np
+from numpy import ndarray
+
+# Above this number of candidates the pairwise matrix is replaced by a uniform grid
+GRID_MIN_CANDIDATES: int = 1024
+
+
+def _processing_order(n: int, scores: ndarray | None) -> ndarray:
+    """Input order in compatibility mode (no scores), otherwise the highest scores first."""
+    if scores is None:
+        return np.arange(n)
+    return np.argsort(-np.asarray(scores, dtype=np.float64), kind="stable")
+
+
+def _greedy_matrix(overlap: ndarray, order: ndarray) -> list[int]:
+    suppressed = np.zeros(len(overlap), dtype=bool)
+    keep = []
+    for i in order:
+        if suppressed[i]:
+            continue
+        keep.append(int(i))
+        suppressed |= overlap[i]
+    return keep
+
+
+def _greedy_grid(
+    centers: ndarray,
+    cell_size: float,
+    overlaps: Callable[[int, ndarray], ndarray],
+    order: ndarray,
+) -> list[int]:
+    """Greedy suppression that only compares a candidate with the kept ones in the 3x3 cells.
+
+    Two candidates can only overlap when their centers are closer than `cell_size` on both
+    axes, so the neighbouring cells contain all the kept candidates that can suppress it.
+    """
+    cells = np.floor(centers / max(cell_size, 1.0)).astype(np.int64)
+    grid: dict[tuple[int, int], list[int]] = {}
+    keep = []
+    for i in order:
+        cx, cy = int(cells[i, 0]), int(cells[i, 1])
+        neighbours = [
+            j for dx in (-1, 0, 1) for dy in (-1, 0, 1) for j in grid.get((cx + dx, cy + dy), ())
+        ]
+        if neighbours and overlaps(int(i), np.asarray(neighbours)).any():
+            continue
+        keep.append(int(i))
+        grid.setdefault((cx, cy), []).append(int(i))
+    return keep
+
+
+def nms_circles(circles: ndarray, scores: ndarray | None = None) -> list[int]:
+    """Keep the circles that don't overlap a circle kept before them.
+
+    Two circles overlap when the distance between their centers is smaller than the sum of
+    their radii. Without scores (compatibility mode) the circles are visited in their order,
+    the greedy suppression the Hough transform always used.
+
+    Args:
+    ----
+        circles: An (n, 3) array of (x, y, r).
+        scores: The strength of every circle, the strongest are kept first.
+
+    Returns:
+    -------
+        The indices of the kept circles, in the order they were kept.
+
+    """
+    circles = np.asarray(circles, dtype=np.int64).reshape(-1, 3)
+    x, y, r = circles[:, 0], circles[:, 1], circles[:, 2]
+    order = _processing_order(len(circles), scores)
+
+    def overlaps(i: int, others: ndarray) -> ndarray:
+        distance = (x[others] - x[i]) ** 2 + (y[others] - y[i]) ** 2
+        return distance < (r[others] + r[i]) ** 2
+
+    if len(circles) > GRID_MIN_CANDIDATES:
+        return _greedy_grid(circles[:, :2], 2 * float(r.max()), overlaps, order)
+
+    distance = (x[:, None] - x[None, :]) ** 2 + (y[:, None] - y[None, :]) ** 2
+    return _greedy_matrix(distance < (r[:, None] + r[None, :]) ** 2, order)
+
+
+def nms_boxes(boxes: ndarray, scores: ndarray | None = None) -> list[int]:
+    """Keep the boxes that don't intersect a box kept before them.
+
+    Boxes that only touch on an edge don't intersect. Without scores (compatibility mode) the
+    boxes are visited in their order, the greedy suppression the blobs always used.
+
+    Args:
+    ----
+        boxes: An (n, 4) array of (x1, y1, x2, y2).
+        scores: The score of every box, the highest are kept first.
+
+    Returns:
+    -------
+        The indices of the kept boxes, in the order they were kept.
+
+    """
+    boxes = np.asarray(boxes, dtype=np.int64).reshape(-1, 4)
+    x1, y1, x2, y2 = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+    order = _processing_order(len(boxes), scores)
+
+    def overlaps(i: int, others: ndarray) -> ndarray:
+        return (
+            (x1[i] < x2[others])
+            & (x2[i] > x1[others])
+            & (y1[i] < y2[others])
+            & (y2[i] > y1[others])
+        )
+
+    if len(boxes) > GRID_MIN_CANDIDATES:
+        centers = np.stack(((x1 + x2) / 2, (y1 + y2) / 2), axis=1)
+        cell_size = float(max((x2 - x1).max(), (y2 - y1).max()))
+        return _greedy_grid(centers, cell_size, overlaps, order)
+
+    overlap = (
+        (x1[:, None] < x2[None, :])
+        & (x2[:, None] > x1[None, :])
+        & (y1[:, None] < y2[None, :])
+        & (y2[:, None] > y1[None, :])
+    )
+    return _greedy_matrix(overlap, order)
@@ -1,13 +1,11 @@
-import cv2
-import numpy as np
 from fastapi import APIRouter, Depends, UploadFile
 from starlette.requests import Request
 
 from app.config import LIMIT_PERIOD
 from app.services.auth import validate_api_key
-from app.services.detect.manager import detect_caps
+from app.services.detect.manager import post_detect
 from app.services.limiter import request_limiter
-from app.shared.utils import img_to_numpy
+from app.services.result_cache import ResultCache
 
 detect_router: APIRouter = APIRouter(dependencies=[Depends(validate_api_key)], tags=["Detect"])
 
@@ -27,7 +25,7 @@ async def detect(file: UploadFile, request: Request) -> list:
         The list of positions were the caps where detected.
 
     """
-    image = cv2.imdecode(np.frombuffer(await file.read(), np.uint8), cv2.IMREAD_COLOR)
-    image = img_to_numpy(image)
-    cropped_images = detect_caps(image)
-    return [tuple(int(v) for v in rct) for (img, rct) in cropped_images]
+    file_contents: bytes = await file.read()
+    return await ResultCache().get_or_compute(
+        "detect", file_contents, lambda: post_detect(file_contents)
+    )
@@ -0,0 +1,230 @@
+import random
+import sys
+import threading
+import time
+from collections.abc import Iterator
+from dataclasses import dataclass, field
+from typing import IO
+
+import numpy as np
+from google.api_core.exceptions import NotFound, PreconditionFailed
+
+from app.config import Settings
+from app.services.local_vector_store import LocalIndex
+from app.services.vector_store import TOP_K, VECTOR_SIZE
+
+settings = Settings()
+
+LIST_PAGE_SIZE: int = 100
+
+
+class InjectedFaultError(ConnectionError):
+    """Raised by the fake backends to simulate a failing call to the remote service."""
+
+
+class FaultInjector:
+    """Delay every call to a fake backend and make a fraction of them fail.
+
+    Args:
+    ----
+        latency_ms: The latency added to every call.
+        jitter_ms: A random latency between 0 and jitter_ms added on top.
+        error_rate: The probability, between 0 and 1, that a call raises InjectedFaultError.
+        seed: The seed of the jitter and the errors, so a load test can be replayed.
+
+    """
+
+    def __init__(
+        self,
+        latency_ms: float = 0.0,
+        jitter_ms: float = 0.0,
+        error_rate: float = 0.0,
+        seed: int | None = None,
+    ):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self._random = random.Random(seed)  # noqa: S311
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls) -> "FaultInjector":
+        return cls(
+            latency_ms=settings.fake_latency_ms,
+            jitter_ms=settings.fake_latency_jitter_ms,
+            error_rate=settings.fake_error_rate,
+            seed=settings.fake_seed,
+        )
+
+    def __call__(self, operation: str) -> None:
+        with self._lock:
+            jitter = self._random.uniform(0, self.jitter_ms) if self.jitter_ms else 0.0
+            fails = self._random.random() < self.error_rate
+        delay = (self.latency_ms + jitter) / 1000
+        if delay > 0:
+            time.sleep(delay)
+        if fails:
+            raise InjectedFaultError(f"Injected failure of {operation}")
+
+
+@dataclass
+class FakeVector:
+    """A fetched vector, read with attributes like the Pinecone client or with keys."""
+
+    id: str
+    values: list[float]
+    metadata: dict = field(default_factory=dict)
+
+    def __getitem__(self, key: str):
+        return getattr(self, key)
+
+
+@dataclass
+class FakeFetchResponse:
+    vectors: dict[str, FakeVector]
+    namespace: str = ""
+
+
+class FakePineconeIndex:
+    """In-process stand-in for a Pinecone index, with one LocalIndex per namespace.
+
+    It implements the calls PineconeContainer makes: query, upsert, delete, list and fetch.
+    The searches are exact and the fetched values are normalized, the index uses the cosine.
+    """
+
+    def __init__(self, faults: FaultInjector | None = None, dimension: int = VECTOR_SIZE):
+        self.faults = faults or FaultInjector()
+        self.dimension = dimension
+        self._namespaces: dict[str, LocalIndex] = {}
+        self._lock = threading.Lock()
+
+    def _namespace(self, namespace: str) -> LocalIndex:
+        with self._lock:
+            if namespace not in self._namespaces:
+                self._namespaces[namespace] = LocalIndex(
+                    dimension=self.dimension, exact_threshold=sys.maxsize
+                )
+            return self._namespaces[namespace]
+
+    def query(
+        self,
+        vector: list,
+        top_k: int = TOP_K,
+        filter: dict | None = None,  # noqa: A002
+        include_metadata: bool = False,  # noqa: FBT002
+        namespace: str = "",
+    ) -> dict:
+        self.faults("query")
+        # query_database sends the vector wrapped in a list, the filtered queries don't
+        query = np.asarray(vector, dtype=np.float32).reshape(-1, self.dimension)[:1]
+        matches = self._namespace(namespace).query(query, top_k=top_k, metadata_filter=filter)[0]
+        if not include_metadata:
+            matches = [{"id": match["id"], "score": match["score"]} for match in matches]
+        return {"matches": matches, "namespace": namespace}
+
+    def upsert(self, vectors: list[dict], namespace: str = "") -> dict:
+        self.faults("upsert")
+        if vectors:
+            self._namespace(namespace).upsert(
+                ids=[vector["id"] for vector in vectors],
+                vectors=np.asarray([vector["values"] for vector in vectors], dtype=np.float32),
+                metadata=[vector.get("metadata") or {} for vector in vectors],
+            )
+        return {"upserted_count": len(vectors)}
+
+    def delete(
+        self,
+        ids: list[str] | None = None,
+        delete_all: bool = False,  # noqa: FBT002
+        namespace: str = "",
+    ) -> dict:
+        self.faults("delete")
+        if delete_all:
+            self._namespace(namespace).clear()
+        elif ids:
+            self._namespace(namespace).delete(ids)
+        return {}
+
+    def fetch(self, ids: list[str], namespace: str = "") -> FakeFetchResponse:
+        self.faults("fetch")
+        found, metadata, values = self._namespace(namespace).get(ids)
+        vectors = {
+            vector_id: FakeVector(vector_id, vector.tolist(), meta)
+            for vector_id, meta, vector in zip(found, metadata, values, strict=True)
+        }
+        return FakeFetchResponse(vectors=vectors, namespace=namespace)
+
+    # Last method of the class, the annotations above still see the builtin list
+    def list(self, prefix: str = "", namespace: str = "") -> Iterator[list[str]]:
+        self.faults("list")
+        ids = [i for i in self._namespace(namespace).find_ids({}) if i.startswith(prefix)]
+        for start in range(0, len(ids), LIST_PAGE_SIZE):
+            yield ids[start : start + LIST_PAGE_SIZE]
+
+
+class FakeBlob:
+    """A blob of FakeBucket, with the methods of google.cloud.storage.Blob that are used."""
+
+    def __init__(self, bucket: "FakeBucket", name: str):
+        self.bucket = bucket
+        self.name = name
+
+    @property
+    def public_url(self) -> str:
+        return f"https://storage.googleapis.com/{self.bucket.name}/{self.name}"
+
+    def exists(self) -> bool:
+        self.bucket.faults("exists")
+        return self.name in self.bucket.objects
+
+    def upload_from_string(
+        self,
+        data: bytes | str,
+        content_type: str | None = None,
+        if_generation_match: int | None = None,
+    ) -> None:
+        self.bucket.faults("upload")
+        if isinstance(data, str):
+            data = data.encode()
+        with self.bucket.lock:
+            # Generation 0 is the precondition "the object doesn't exist yet"
+            if if_generation_match == 0 and self.name in self.bucket.objects:
+                raise PreconditionFailed(f"{self.name} already exists")
+            self.bucket.objects[self.name] = (data, content_type)
+
+    def upload_from_file(
+        self,
+        file_obj: IO[bytes],
+        content_type: str | None = None,
+        if_generation_match: int | None = None,
+    ) -> None:
+        self.upload_from_string(file_obj.read(), content_type, if_generation_match)
+
+    def download_as_bytes(self) -> bytes:
+        self.bucket.faults("download")
+        try:
+            return self.bucket.objects[self.name][0]
+        except KeyError as e:
+            raise NotFound(f"{self.name} not found") from e
+
+    def make_public(self) -> None:
+        self.bucket.faults("make_public")
+
+    def delete(self) -> None:
+        self.bucket.faults("delete")
+        with self.bucket.lock:
+            if self.bucket.objects.pop(self.name, None) is None:
+                raise NotFound(f"{self.name} not found")
+
+
+class FakeBucket:
+    """In-memory stand-in for the Firebase storage bucket."""
+
+    def __init__(self, name: str = "fake-bucket", faults: FaultInjector | None = None):
+        self.name = name
+        self.faults = faults or FaultInjector()
+        self.objects: dict[str, tuple[bytes, str | None]] = {}
+        self.lock = threading.Lock()
+
+    def blob(self, name: str) -> FakeBlob:
+        return FakeBlob(self, name)
@@ -1,19 +1,25 @@
-import io
 import json
 
-import cv2
-import firebase_admin
 import numpy as np
 import starlette.status
 from fastapi import HTTPException
-from firebase_admin import credentials, storage
 
 from app.config import Settings
+from app.shared.metrics import UPLOAD_BYTES, time_call
+from app.shared.utils import encode_image
 
 settings = Settings()
 
 
 class FirebaseContainer:
+    """The images of the caps in the Firebase storage bucket.
+
+    The upload has the precondition "the object doesn't exist" instead of checking it before,
+    and the blob is made public after it, unless `firebase_public_acl` is off because the
+    bucket is public through IAM. The thumbnails are uploaded after the image, so a conflict
+    never overwrites them. The methods block, call them with `run_storage`.
+    """
+
     _instance = None
 
     def __new__(cls):
@@ -23,44 +29,107 @@ class FirebaseContainer:
         return cls._instance
 
     def _initialize(self):
+        if settings.firebase_backend == "fake":
+            from app.services.fake_backends import FakeBucket, FaultInjector
+
+            self.bucket = FakeBucket(
+                settings.firebase_bucket or "fake-bucket", FaultInjector.from_settings()
+            )
+            return
+
+        from firebase_admin import credentials
+        from google.auth.transport.requests import AuthorizedSession
+        from google.cloud import storage
+        from requests.adapters import HTTPAdapter
+
         self.cred = credentials.Certificate(self.get_firebase_credentials())
-        self.app = firebase_admin.initialize_app(
-            self.cred, {"storageBucket": settings.firebase_bucket}
+        credential = self.cred.get_credential()
+        # One pool with a connection per storage thread, the default pool keeps only 10
+        session = AuthorizedSession(credential)
+        session.mount("https://", HTTPAdapter(pool_maxsize=settings.storage_workers))
+        self.client = storage.Client(
+            project=self.cred.project_id, credentials=credential, _http=session
         )
-        self.bucket = storage.bucket()
+        self.bucket = self.client.bucket(settings.firebase_bucket)
 
     def add_image_to_container(self, image: np.ndarray, name: str, user_id: str) -> str:
-        success, image_encoded = cv2.imencode(".png", image)
-        if not success:
-            raise HTTPException(
-                status_code=starlette.status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="Failed to encode image.",
-            )
-
-        image_bytes = io.BytesIO(image_encoded.tobytes())
+        from google.api_core.exceptions import PreconditionFailed
 
         blob_path = self.build_blob_path(user_id, name)
-        blob = self.bucket.blob(blob_path)
-
-        if blob.exists():
+        try:
+            # Generation 0 only matches when the object doesn't exist yet
+            blob = self._upload(blob_path, image, "upload", if_generation_match=0)
+        except PreconditionFailed as e:
             raise HTTPException(
                 status_code=starlette.status.HTTP_409_CONFLICT, detail="Image already exists."
-            )
-
-        blob.upload_from_file(image_bytes, content_type="image/png")
-        blob.make_public()
+            ) from e
+        return blob.public_url
 
+    def add_thumbnail_to_container(
+        self, thumbnail: np.ndarray, size: int, name: str, user_id: str
+    ) -> str:
+        """Upload a thumbnail, after the image it belongs to, overwriting an old one."""
+        blob = self._upload(self.build_thumbnail_path(user_id, name, size), thumbnail, "thumbnail")
         return blob.public_url
 
+    def _upload(self, blob_path: str, image: np.ndarray, operation: str, **preconditions):
+        try:
+            data, content_type = encode_image(
+                image, settings.storage_image_format, settings.storage_image_quality
+            )
+        except ValueError as e:
+            raise HTTPException(
+                status_code=starlette.status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Failed to encode image.",
+            ) from e
+
+        UPLOAD_BYTES.labels(operation).observe(len(data))
+        blob = self.bucket.blob(blob_path)
+        with time_call("firebase", operation):
+            blob.upload_from_string(data, content_type=content_type, **preconditions)
+        if settings.firebase_public_acl:
+            with time_call("firebase", "make_public"):
+                blob.make_public()
+        return blob
+
+    def get_image(self, name: str, user_id: str) -> bytes:
+        """Download a stored image, 404 if it doesn't exist."""
+        from google.api_core.exceptions import NotFound
+
+        blob = self.bucket.blob(self.build_blob_path(user_id, name))
+        try:
+            with time_call("firebase", "download"):
+                return blob.download_as_bytes()
+        except NotFound as e:
+            raise HTTPException(
+                status_code=starlette.status.HTTP_404_NOT_FOUND, detail="Image does not exist."
+            ) from e
+
     def remove_image(self, name: str, user_id: str) -> bool:
         """Remove an image from Firebase."""
+        from google.api_core.exceptions import NotFound
+
         blob_path = self.build_blob_path(user_id, name)
         blob = self.bucket.blob(blob_path)
-        if not blob.exists():
+        try:
+            with time_call("firebase", "delete"):
+                blob.delete()
+        except NotFound as e:
             raise HTTPException(
                 status_code=starlette.status.HTTP_404_NOT_FOUND, detail="Image does not exist."
-            )
-        blob.delete()
+            ) from e
+        return True
+
+    def remove_thumbnail(self, size: int, name: str, user_id: str) -> bool:
+        """Remove a thumbnail, return False if it doesn't exist (saved before the thumbnails)."""
+        from google.api_core.exceptions import NotFound
+
+        blob = self.bucket.blob(self.build_thumbnail_path(user_id, name, size))
+        try:
+            with time_call("firebase", "delete_thumbnail"):
+                blob.delete()
+        except NotFound:
+            return False
         return True
 
     @staticmethod
@@ -74,3 +143,7 @@ class FirebaseContainer:
     @staticmethod
     def build_blob_path(user_id: str, name: str) -> str:
         return f"users/{user_id}/collection/{name}"
+
+    @staticmethod
+    def build_thumbnail_path(user_id: str, name: str, size: int) -> str:
+        return f"users/{user_id}/thumbnails/{size}/{name}"
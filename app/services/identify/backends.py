@@ -0,0 +1,183 @@
+from abc import ABC, abstractmethod
+from pathlib import Path
+
+import numpy as np
+import torch
+from loguru import logger
+from torchvision.models import mobilenet_v3_small
+
+from app.config import Settings
+from app.services.identify.preprocess import INPUT_SIZE
+
+settings = Settings()
+
+ARTIFACTS: dict[str, str] = {
+    "torchscript": "vectorizer.ts",
+    "onnx": "vectorizer.onnx",
+    "int8": "vectorizer.int8.onnx",
+}
+
+
+class VectorizerBackend(ABC):
+    """Runs the MobileNet feature extractor over a preprocessed batch."""
+
+    name: str
+
+    @abstractmethod
+    def __call__(self, batch: np.ndarray) -> np.ndarray:
+        """Transform the batch into vectors.
+
+        Args:
+        ----
+            batch: A float32 array of shape (N, 3, INPUT_SIZE, INPUT_SIZE).
+
+        Returns:
+        -------
+            A float32 array of shape (N, VECTOR_SIZE).
+
+        """
+
+
+class TorchBackend(VectorizerBackend):
+    def __init__(self, name: str, model):
+        self.name = name
+        self.model = model
+
+    def __call__(self, batch: np.ndarray) -> np.ndarray:
+        with torch.inference_mode():
+            vectors = self.model(torch.from_numpy(batch))
+        return vectors.flatten(start_dim=1).numpy()
+
+
+class OnnxBackend(VectorizerBackend):
+    def __init__(self, name: str, path: Path):
+        import onnxruntime
+
+        self.name = name
+        self.session = onnxruntime.InferenceSession(str(path), providers=["CPUExecutionProvider"])
+        self.input_name: str = self.session.get_inputs()[0].name
+
+    def __call__(self, batch: np.ndarray) -> np.ndarray:
+        vectors = self.session.run(None, {self.input_name: batch})[0]
+        return vectors.reshape(len(batch), -1)
+
+
+def load_mobilenet() -> torch.nn.Module:
+    """Load MobileNetV3 small from the bundled weights, downloading them if they are missing."""
+    weights_path = Path(settings.vectorizer_weights_path)
+    if weights_path.exists():
+        model = mobilenet_v3_small(weights=None)
+        model.load_state_dict(torch.load(weights_path, map_location="cpu", weights_only=True))
+        return model
+
+    logger.warning(f"{weights_path} not found, downloading the weights into torch_home.")
+    torch.hub.set_dir(str(Path(settings.torch_home) / "hub"))
+    return mobilenet_v3_small(weights="IMAGENET1K_V1")
+
+
+def bundle_weights(path: str | None = None) -> Path:
+    """Save the weights of MobileNet as a local artifact, so no container downloads them."""
+    weights_path = Path(path or settings.vectorizer_weights_path)
+    weights_path.parent.mkdir(parents=True, exist_ok=True)
+    torch.save(load_mobilenet().state_dict(), weights_path)
+    return weights_path
+
+
+def build_eager_model() -> torch.nn.Module:
+    """MobileNetV3 small without the classifier, the model that produced the stored vectors."""
+    model = torch.nn.Sequential(*list(load_mobilenet().children())[:-1])
+    return model.eval()
+
+
+def artifact_path(backend: str, directory: str | None = None) -> Path:
+    """Path of the exported artifact of a backend."""
+    return Path(directory or settings.vectorizer_artifacts_dir) / ARTIFACTS[backend]
+
+
+def trace_model(model: torch.nn.Module):
+    """Trace and freeze the model into an optimized TorchScript module."""
+    example = torch.zeros((1, 3, INPUT_SIZE, INPUT_SIZE))
+    with torch.inference_mode():
+        traced = torch.jit.trace(model, example)
+    return torch.jit.optimize_for_inference(torch.jit.freeze(traced))
+
+
+def load_backend(backend: str, directory: str | None = None) -> VectorizerBackend:
+    """Load one of the inference backends of the vectorizer.
+
+    The torchscript, onnx and int8 backends use the artifacts of `scripts.export_vectorizer`.
+    TorchScript is traced in memory when its artifact is missing, the ONNX ones can't be.
+
+    Args:
+    ----
+        backend: eager, torchscript, compile, onnx or int8.
+        directory: The folder with the artifacts, `vectorizer_artifacts_dir` by default.
+
+    Returns:
+    -------
+        The backend, ready to be called with a preprocessed batch.
+
+    """
+    if backend == "eager":
+        return TorchBackend(backend, build_eager_model())
+    if backend == "compile":
+        return TorchBackend(backend, torch.compile(build_eager_model(), dynamic=True))
+    if backend == "torchscript":
+        path = artifact_path(backend, directory)
+        if path.exists():
+            return TorchBackend(backend, torch.jit.load(str(path)).eval())
+        logger.warning(f"{path} not found, tracing the TorchScript model in memory.")
+        return TorchBackend(backend, trace_model(build_eager_model()))
+    if backend in ("onnx", "int8"):
+        path = artifact_path(backend, directory)
+        if not path.exists():
+            raise FileNotFoundError(f"{path} not found, run `make export-vectorizer` first.")
+        return OnnxBackend(backend, path)
+    raise ValueError(f"Unknown vectorizer backend: {backend}")
+
+
+def export_artifacts(directory: str | None = None) -> dict[str, Path]:
+    """Write the TorchScript, ONNX and int8 ONNX artifacts of the eager model.
+
+    PyTorch's dynamic quantization only covers the Linear layers and the feature extractor has
+    none, so the int8 model is the ONNX graph with its convolutions quantized by ONNX Runtime.
+
+    Args:
+    ----
+        directory: The folder of the artifacts, `vectorizer_artifacts_dir` by default.
+
+    Returns:
+    -------
+        The path of every artifact by backend.
+
+    """
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    paths = {backend: artifact_path(backend, directory) for backend in ARTIFACTS}
+    paths["onnx"].parent.mkdir(parents=True, exist_ok=True)
+    model = build_eager_model()
+
+    torch.jit.save(trace_model(model), str(paths["torchscript"]))
+
+    example = torch.zeros((1, 3, INPUT_SIZE, INPUT_SIZE))
+    torch.onnx.export(
+        model,
+        example,
+        str(paths["onnx"]),
+        input_names=["input"],
+        output_names=["output"],
+        dynamic_axes={"input": {0: "batch"}, "output": {0: "batch"}},
+        opset_version=17,
+    )
+    # The CPU kernel of ConvInteger only supports unsigned weights
+    quantize_dynamic(str(paths["onnx"]), str(paths["int8"]), weight_type=QuantType.QUInt8)
+    return paths
+
+
+def compare_vectors(reference: np.ndarray, candidate: np.ndarray) -> tuple[float, float]:
+    """Return the minimum cosine similarity and the maximum absolute difference of the rows."""
+    reference = reference.astype(np.float64)
+    candidate = candidate.astype(np.float64)
+    norms = np.linalg.norm(reference, axis=1) * np.linalg.norm(candidate, axis=1)
+    cosine = np.sum(reference * candidate, axis=1) / np.maximum(norms, np.finfo(np.float64).eps)
+    return float(cosine.min()), float(np.abs(reference - candidate).max())
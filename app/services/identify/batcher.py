@@ -0,0 +1,198 @@
+import asyncio
+import contextlib
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+
+import numpy as np
+from loguru import logger
+
+from app.config import Settings
+from app.services.identify.image_vectorizer import ImageVectorizer
+from app.services.vector_store import VECTOR_SIZE
+from app.shared.executors import run_in_thread
+
+settings = Settings()
+
+
+@dataclass
+class BatcherStats:
+    total_batches: int = 0
+    total_items: int = 0
+    last_batch_size: int = 0
+    max_batch_size: int = 0
+    total_wait_seconds: float = 0.0
+    total_inference_seconds: float = 0.0
+    batch_sizes: Counter = field(default_factory=Counter)
+
+    def record(self, size: int, wait_seconds: float, inference_seconds: float) -> None:
+        self.total_batches += 1
+        self.total_items += size
+        self.last_batch_size = size
+        self.max_batch_size = max(self.max_batch_size, size)
+        self.total_wait_seconds += wait_seconds
+        self.total_inference_seconds += inference_seconds
+        self.batch_sizes[size] += 1
+
+    def to_dict(self, queue_depth: int) -> dict:
+        batches = max(self.total_batches, 1)
+        return {
+            "queue_depth": queue_depth,
+            "total_batches": self.total_batches,
+            "total_items": self.total_items,
+            "last_batch_size": self.last_batch_size,
+            "max_batch_size": self.max_batch_size,
+            "avg_batch_size": self.total_items / batches,
+            "avg_wait_ms": 1000 * self.total_wait_seconds / batches,
+            "avg_inference_ms": 1000 * self.total_inference_seconds / batches,
+            "batch_sizes": {str(size): count for size, count in sorted(self.batch_sizes.items())},
+        }
+
+
+@dataclass
+class _PendingCrop:
+    img: np.ndarray
+    future: asyncio.Future
+    enqueued_at: float
+
+
+class EmbeddingBatcher:
+    """Collect the crops of all the in-flight requests and embed them together.
+
+    The crops are queued and a single worker takes up to `embedding_batch_max_size` of them,
+    waiting at most `embedding_batch_max_wait_ms` for the batch to fill, before running one
+    forward pass outside the event loop. If the worker dies its batch fails and a new worker
+    takes the crops that are still queued.
+    """
+
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+            cls._instance._initialize()
+        return cls._instance
+
+    def _initialize(self):
+        self.max_batch_size: int = settings.embedding_batch_max_size
+        self.max_wait: float = settings.embedding_batch_max_wait_ms / 1000
+        self.stats = BatcherStats()
+        self._queue: asyncio.Queue[_PendingCrop] | None = None
+        self._worker: asyncio.Task | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    async def embed(self, img: np.ndarray) -> list[float]:
+        """Embed a single BGR image, sharing the forward pass with other requests."""
+        vectors = await self.embed_many([img])
+        return vectors[0].tolist()
+
+    async def embed_many(self, imgs: list[np.ndarray]) -> np.ndarray:
+        """Embed multiple BGR images, returning a (len(imgs), VECTOR_SIZE) array."""
+        if not imgs:
+            return np.empty((0, VECTOR_SIZE), dtype=np.float32)
+        queue = self._ensure_worker()
+        loop = asyncio.get_running_loop()
+        futures = []
+        for img in imgs:
+            future = loop.create_future()
+            queue.put_nowait(_PendingCrop(img=img, future=future, enqueued_at=time.perf_counter()))
+            futures.append(future)
+        return np.stack(await asyncio.gather(*futures))
+
+    def get_stats(self) -> dict:
+        queue_depth = self._queue.qsize() if self._queue is not None else 0
+        return self.stats.to_dict(queue_depth=queue_depth)
+
+    async def close(self) -> None:
+        """Stop the worker, pending crops are cancelled."""
+        if self._worker is not None:
+            self._worker.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._worker
+        if self._queue is not None:
+            while not self._queue.empty():
+                self._queue.get_nowait().future.cancel()
+        self._worker = None
+        self._queue = None
+        self._loop = None
+
+    def _ensure_worker(self) -> asyncio.Queue:
+        loop = asyncio.get_running_loop()
+        if self._queue is None or self._loop is not loop:
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._start_worker()
+        elif self._worker is None or self._worker.done():
+            self._start_worker()
+        return self._queue
+
+    def _start_worker(self) -> None:
+        self._worker = self._loop.create_task(self._run(self._queue))
+        self._worker.add_done_callback(self._on_worker_done)
+
+    def _on_worker_done(self, worker: asyncio.Task) -> None:
+        # Stopped by close, or replaced by the worker of another loop
+        if worker.cancelled() or worker is not self._worker or self._loop.is_closed():
+            return
+        logger.error(f"Embedding worker died, starting a new one: {worker.exception()!r}")
+        self._start_worker()
+
+    async def _run(self, queue: asyncio.Queue) -> None:
+        while True:
+            batch = await self._collect_batch(queue)
+            try:
+                await self._process_batch(batch)
+            except BaseException as e:
+                # The requests of the batch would wait forever for the worker
+                for pending in batch:
+                    if pending.future.done():
+                        continue
+                    if isinstance(e, asyncio.CancelledError):
+                        pending.future.cancel()
+                    else:
+                        pending.future.set_exception(e)
+                raise
+
+    async def _collect_batch(self, queue: asyncio.Queue) -> list[_PendingCrop]:
+        batch: list[_PendingCrop] = [await queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            # Take everything that is already waiting without yielding
+            while not queue.empty() and len(batch) < self.max_batch_size:
+                batch.append(queue.get_nowait())
+            remaining = deadline - time.perf_counter()
+            if len(batch) >= self.max_batch_size or remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(queue.get(), timeout=remaining))
+            except TimeoutError:
+                break
+        return batch
+
+    async def _process_batch(self, batch: list[_PendingCrop]) -> None:
+        started = time.perf_counter()
+        wait_seconds = started - min(pending.enqueued_at for pending in batch)
+        try:
+            vectors = await run_in_thread(
+                ImageVectorizer().numpy_to_vectors, [pending.img for pending in batch]
+            )
+        except Exception as e:  # noqa: BLE001
+            logger.error(f"Embedding batch of {len(batch)} failed: {e!s}")
+            if len(batch) > 1:
+                # Retry one by one so a single broken crop doesn't fail the other requests
+                for pending in batch:
+                    await self._process_batch([pending])
+                return
+            for pending in batch:
+                if not pending.future.done():
+                    pending.future.set_exception(e)
+            return
+
+        self.stats.record(
+            size=len(batch),
+            wait_seconds=wait_seconds,
+            inference_seconds=time.perf_counter() - started,
+        )
+        for pending, vector in zip(batch, vectors, strict=True):
+            if not pending.future.done():
+                pending.future.set_result(vector)
@@ -1,10 +1,10 @@
 import cv2
 import numpy as np
-import torch
-from torchvision import transforms
-from torchvision.models import mobilenet_v3_small
 
 from app.config import Settings
+from app.services.identify.preprocess import preprocess_batch
+from app.services.vector_store import VECTOR_SIZE
+from app.shared.metrics import time_stage
 from app.shared.utils import apply_mask
 
 settings = Settings()
@@ -23,19 +23,10 @@ class ImageVectorizer:
         return cls._instance
 
     def _initialize(self):
-        self.model = mobilenet_v3_small(weights="IMAGENET1K_V1")
-        self.model = torch.nn.Sequential(*list(self.model.children())[:-1])
-        self.model.eval()
-
-        self.preprocess = transforms.Compose(
-            [
-                transforms.ToPILImage(),
-                transforms.Resize(256),
-                transforms.CenterCrop(224),
-                transforms.ToTensor(),
-                transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
-            ]
-        )
+        # torch is only imported when the model is loaded
+        from app.services.identify.backends import load_backend
+
+        self.backend = load_backend(settings.vectorizer_backend)
 
     async def image_to_vector(self, file: bytes) -> list:
         image = cv2.imdecode(np.frombuffer(file, np.uint8), cv2.IMREAD_COLOR)
@@ -44,9 +35,22 @@ class ImageVectorizer:
         return self.numpy_to_vector(img=img)
 
     def numpy_to_vector(self, img: np.ndarray) -> list[float]:
-        img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-        img_tensor = self.preprocess(img_rgb).unsqueeze(0)
+        return self.numpy_to_vectors([img])[0].tolist()
+
+    @time_stage("numpy_to_vectors")
+    def numpy_to_vectors(self, imgs: list[np.ndarray]) -> np.ndarray:
+        """Transform a batch of BGR images into vectors with a single forward pass.
+
+        Args:
+        ----
+            imgs: The BGR images, they can have different sizes.
+
+        Returns:
+        -------
+            A float32 array of shape (len(imgs), VECTOR_SIZE).
+
+        """
+        if not imgs:
+            return np.empty((0, VECTOR_SIZE), dtype=np.float32)
 
-        with torch.no_grad():
-            vector = self.model(img_tensor)
-        return vector.flatten().tolist()
+        return self.backend(preprocess_batch(imgs))
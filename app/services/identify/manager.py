@@ -1,19 +1,27 @@
+import asyncio
+from collections.abc import AsyncIterator
 from pathlib import Path
+from typing import IO
 
-import cv2
-import numpy as np
 from numpy import ndarray
 
-from app.services.detect.manager import detect_caps
-from app.services.identify.image_vectorizer import ImageVectorizer
-from app.services.pinecone_container import PineconeContainer
-from app.shared.utils import apply_mask, img_to_numpy, resize_image_max_size
+from app.config import Settings
+from app.services.detect.manager import detect_caps_async
+from app.services.identify.batcher import EmbeddingBatcher
+from app.services.result_cache import ResultCache
+from app.services.user_vector_cache import UserVectorCache
+from app.shared.decoded_image import DecodedImage
+from app.shared.executors import run_in_thread, run_io
+from app.shared.perceptual_hash import dhash
+from app.shared.utils import apply_mask
+
+settings = Settings()
 
 PROJECT_PATH = Path.cwd()
 
 
-def identify_cap(cap: ndarray, user_id: str) -> list[dict]:
-    """Identify a cap from the Pinecone database.
+async def identify_cap(cap: ndarray, user_id: str) -> list[dict]:
+    """Identify a cap from the collection of the user.
 
     Args:
     ----
@@ -25,15 +33,125 @@ def identify_cap(cap: ndarray, user_id: str) -> list[dict]:
         The cap model with all the information.
 
     """
-    pinecone_container: PineconeContainer = PineconeContainer()
-    image_vectorizer: ImageVectorizer = ImageVectorizer()
-    img = apply_mask(cap)
-    vector = image_vectorizer.numpy_to_vector(img=img)
-    result = pinecone_container.query_with_metadata(vector=vector, metadata={"user_id": user_id})
+    return await _identify_masked(apply_mask(cap), user_id)
+
+
+async def _identify_masked(img: ndarray, user_id: str) -> list[dict]:
+    return (await _identify_many_masked([img], user_id))[0]
+
+
+async def identify_caps(caps: list[ndarray], user_id: str) -> list[list[dict]]:
+    """Identify multiple caps embedding all of them in a single batch.
+
+    Args:
+    ----
+        caps: The caps.
+        user_id: The user_id of the person
+
+    Returns:
+    -------
+        For each cap, in the same order, the matches found.
+
+    """
+    if not caps:
+        return []
+    return await _identify_many_masked([apply_mask(cap) for cap in caps], user_id)
+
+
+async def _identify_many_masked(imgs: list[ndarray], user_id: str) -> list[list[dict]]:
+    results: list[list | None] = [None] * len(imgs)
+    if settings.near_duplicate_enabled:
+        # Other photos of saved caps are found by their hash and searched with the stored vector
+        hashes = await run_in_thread(lambda: [dhash(img) for img in imgs])
+        results = await run_io(UserVectorCache().find_near_duplicates, user_id, hashes)
+    missing = [i for i, result in enumerate(results) if result is None]
+    if missing:
+        vectors = await EmbeddingBatcher().embed_many([imgs[i] for i in missing])
+        queried = await run_io(
+            UserVectorCache().query_many, user_id=user_id, vectors=vectors.tolist()
+        )
+        for i, result in zip(missing, queried, strict=True):
+            results[i] = result
+    return [_parse_matches(result) for result in results]
+
+
+def _parse_matches(result: list) -> list[dict]:
     return [{"name": cap["metadata"]["name"], "score": cap["score"]} for cap in result]
 
 
-def post_detect_and_identify(file_contents: bytes, user_id: str) -> dict:
+async def post_identify(file_contents: bytes, user_id: str) -> list[dict]:
+    """Identify the bottle cap of an uploaded image.
+
+    Args:
+    ----
+        file_contents: The raw content.
+        user_id: The user_id of the person.
+
+    Returns:
+    -------
+        The matches of the cap.
+
+    """
+    image = DecodedImage(file_contents)
+    return await _identify_masked(await run_in_thread(image.masked), user_id=user_id)
+
+
+async def identify_many(files: list[tuple[str, IO[bytes]]], user_id: str) -> AsyncIterator[dict]:
+    """Identify many single-cap images, yielding every result as soon as it is ready.
+
+    Up to `bulk_identify_concurrency` files are read, decoded and identified at the same time,
+    so the embedding batcher groups their crops in batches and the queries run concurrently.
+    Every file goes through the cache of `/identify`, a file identified before is free.
+
+    Args:
+    ----
+        files: The (filename, file) of every image, the files are closed once read.
+        user_id: The user_id of the person.
+
+    Returns:
+    -------
+        For every file, in the order they finish, its index, filename and matches or error.
+
+    """
+    semaphore = asyncio.Semaphore(settings.bulk_identify_concurrency)
+
+    async def identify_file(index: int, filename: str, file: IO[bytes]) -> dict:
+        async with semaphore:
+            try:
+                file_contents = await run_in_thread(_read_and_close, file)
+                matches = await ResultCache().get_or_compute(
+                    "identify",
+                    file_contents,
+                    lambda: post_identify(file_contents, user_id=user_id),
+                    user_id=user_id,
+                )
+            except Exception as e:  # noqa: BLE001
+                return {"index": index, "filename": filename, "error": f"{type(e).__name__}: {e!s}"}
+            return {"index": index, "filename": filename, "matches": matches}
+
+    tasks = [
+        asyncio.create_task(identify_file(index, filename, file))
+        for index, (filename, file) in enumerate(files)
+    ]
+    try:
+        for next_result in asyncio.as_completed(tasks):
+            yield await next_result
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for _, file in files:
+            file.close()
+
+
+def _read_and_close(file: IO[bytes]) -> bytes:
+    try:
+        return file.read()
+    finally:
+        file.close()
+
+
+async def post_detect_and_identify(file_contents: bytes, user_id: str) -> dict:
     """Detect and indentify a bottle cap.
 
     Args:
@@ -46,13 +164,9 @@ def post_detect_and_identify(file_contents: bytes, user_id: str) -> dict:
         A dictionary containing all the necessary information.
 
     """
-    image = cv2.imdecode(np.frombuffer(file_contents, np.uint8), cv2.IMREAD_COLOR)
-    image = resize_image_max_size(image)
-    image = img_to_numpy(image)
-    cropped_images = detect_caps(image)
-    caps_identified = [
-        identify_cap(cap=np.array(cap[0]), user_id=user_id) for cap in cropped_images
-    ]
+    image = await run_in_thread(DecodedImage(file_contents).decoded)
+    cropped_images = await detect_caps_async(image)
+    caps_identified = await identify_caps(caps=[cap[0] for cap in cropped_images], user_id=user_id)
 
     positions = [tuple(int(v) for v in rct) for (img, rct) in cropped_images]
 
@@ -0,0 +1,113 @@
+import threading
+
+import cv2
+import numpy as np
+
+RESIZE_SIZE: int = 256
+INPUT_SIZE: int = 224
+# ImageNet statistics in RGB order, folded into a single multiply-add per channel
+MEAN: np.ndarray = np.array([0.485, 0.456, 0.406], dtype=np.float32)
+STD: np.ndarray = np.array([0.229, 0.224, 0.225], dtype=np.float32)
+SCALE: np.ndarray = 1 / (255 * STD)
+SHIFT: np.ndarray = MEAN / STD
+
+
+class PreprocessBuffer:
+    """Reusable NCHW batch and resize scratch, grown when a bigger batch arrives."""
+
+    def __init__(self, capacity: int = 0):
+        self.batch = np.empty((capacity, 3, INPUT_SIZE, INPUT_SIZE), dtype=np.float32)
+        self.resized = np.empty((INPUT_SIZE, INPUT_SIZE, 3), dtype=np.uint8)
+
+    def get(self, n: int) -> np.ndarray:
+        if len(self.batch) < n:
+            self.batch = np.empty((n, 3, INPUT_SIZE, INPUT_SIZE), dtype=np.float32)
+        return self.batch[:n]
+
+
+_local = threading.local()
+
+
+def _thread_buffer() -> PreprocessBuffer:
+    buffer = getattr(_local, "buffer", None)
+    if buffer is None:
+        buffer = PreprocessBuffer()
+        _local.buffer = buffer
+    return buffer
+
+
+def resized_shape(height: int, width: int) -> tuple[int, int]:
+    """Shape of the image after the resize of its shorter side to RESIZE_SIZE."""
+    if height > width:
+        return int(RESIZE_SIZE * height / width), RESIZE_SIZE
+    if width > height:
+        return RESIZE_SIZE, int(RESIZE_SIZE * width / height)
+    return RESIZE_SIZE, RESIZE_SIZE
+
+
+def preprocess_into(img: np.ndarray, out: np.ndarray, resized: np.ndarray | None = None) -> None:
+    """Write the normalized RGB CHW tensor of a BGR uint8 image into `out`.
+
+    It is the resize of the shorter side to 256 and the 224 center crop in a single step.
+    Upscaled images are sampled with one affine warp straight into the 224x224 scratch.
+    Downscaled ones need the area interpolation to avoid aliasing, so they are resized
+    whole and cropped with a view.
+
+    Args:
+    ----
+        img: The BGR image.
+        out: A float32 array of shape (3, INPUT_SIZE, INPUT_SIZE).
+        resized: Optional uint8 scratch of shape (INPUT_SIZE, INPUT_SIZE, 3).
+
+    """
+    height, width = img.shape[:2]
+    resized_height, resized_width = resized_shape(height, width)
+    top = round((resized_height - INPUT_SIZE) / 2)
+    left = round((resized_width - INPUT_SIZE) / 2)
+
+    if resized_height * resized_width <= height * width:
+        full = cv2.resize(img, (resized_width, resized_height), interpolation=cv2.INTER_AREA)
+        crop = full[top : top + INPUT_SIZE, left : left + INPUT_SIZE]
+    else:
+        scale_y, scale_x = resized_height / height, resized_width / width
+        # Maps the pixel centers of the crop to the image, as a bilinear resize and crop do
+        transform = np.array(
+            [
+                [scale_x, 0, 0.5 * scale_x - 0.5 - left],
+                [0, scale_y, 0.5 * scale_y - 0.5 - top],
+            ]
+        )
+        crop = cv2.warpAffine(
+            img,
+            transform,
+            (INPUT_SIZE, INPUT_SIZE),
+            dst=resized,
+            flags=cv2.INTER_LINEAR,
+            borderMode=cv2.BORDER_REPLICATE,
+        )
+
+    for channel in range(3):
+        # BGR to RGB by reading the channels in reverse
+        np.multiply(crop[..., 2 - channel], SCALE[channel], out=out[channel], dtype=np.float32)
+        out[channel] -= SHIFT[channel]
+
+
+def preprocess_batch(imgs: list[np.ndarray]) -> np.ndarray:
+    """Preprocess the BGR images into the (N, 3, 224, 224) batch of the vectorizer.
+
+    The batch is a buffer of the calling thread, it is overwritten by its next call.
+
+    Args:
+    ----
+        imgs: The BGR images, they can have different sizes.
+
+    Returns:
+    -------
+        A float32 array of shape (len(imgs), 3, INPUT_SIZE, INPUT_SIZE).
+
+    """
+    buffer = _thread_buffer()
+    batch = buffer.get(len(imgs))
+    for img, out in zip(imgs, batch, strict=True):
+        preprocess_into(img, out, buffer.resized)
+    return batch
@@ -1,14 +1,23 @@
-import cv2
-import numpy as np
-from fastapi import APIRouter, Depends, UploadFile
+import json
+
+import starlette.status
+from fastapi import APIRouter, Depends, HTTPException, UploadFile
 from starlette.requests import Request
-from starlette.responses import JSONResponse
+from starlette.responses import JSONResponse, StreamingResponse
 
-from app.config import LIMIT_PERIOD
+from app.config import LIMIT_PERIOD, Settings
 from app.services.auth import validate_api_key
-from app.services.identify.manager import identify_cap, post_detect_and_identify
+from app.services.identify.batcher import EmbeddingBatcher
+from app.services.identify.manager import (
+    identify_many,
+    post_detect_and_identify,
+    post_identify,
+)
 from app.services.limiter import request_limiter
-from app.shared.utils import resize_image_max_size
+from app.services.result_cache import ResultCache
+from app.shared.utils import detach_upload_files
+
+settings = Settings()
 
 identify_router: APIRouter = APIRouter(dependencies=[Depends(validate_api_key)], tags=["Identify"])
 
@@ -29,9 +38,46 @@ async def identify(file: UploadFile, user_id: str, request: Request) -> list[dic
         The result of the identification of the bottle cap in a dictionary.
 
     """
-    image = cv2.imdecode(np.frombuffer(await file.read(), np.uint8), cv2.IMREAD_COLOR)
-    image = resize_image_max_size(image)
-    return identify_cap(cap=np.array(image), user_id=user_id)
+    file_contents: bytes = await file.read()
+    return await ResultCache().get_or_compute(
+        "identify",
+        file_contents,
+        lambda: post_identify(file_contents, user_id=user_id),
+        user_id=user_id,
+    )
+
+
+@identify_router.post("/identify/bulk")
+@request_limiter.limit(LIMIT_PERIOD)
+async def identify_bulk(
+    files: list[UploadFile], user_id: str, request: Request
+) -> StreamingResponse:
+    """Identify many images of one bottle cap each, streaming the results as NDJSON.
+
+    Args:
+    ----
+        files: The images, one cap per image.
+        user_id: The user_id of the person.
+        request (Request): Needed for the limiter
+
+    Returns:
+    -------
+        One JSON line per file as soon as it is identified, with its index in the request,
+        its filename and its matches (or the error), in the order they finish.
+
+    """
+    if len(files) > settings.bulk_identify_max_files:
+        raise HTTPException(
+            status_code=starlette.status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"At most {settings.bulk_identify_max_files} files per request.",
+        )
+    uploads = detach_upload_files(files)
+
+    async def result_stream():
+        async for result in identify_many(uploads, user_id):
+            yield json.dumps(result) + "\n"
+
+    return StreamingResponse(result_stream(), media_type="application/x-ndjson")
 
 
 @identify_router.post("/detect_and_identify")
@@ -50,7 +96,13 @@ async def detect_and_identify(file: UploadFile, user_id: str, request: Request):
         A json response containing the main information.
 
     """
-    result = post_detect_and_identify(await file.read(), user_id=user_id)
+    file_contents: bytes = await file.read()
+    result = await ResultCache().get_or_compute(
+        "detect_and_identify",
+        file_contents,
+        lambda: post_detect_and_identify(file_contents, user_id=user_id),
+        user_id=user_id,
+    )
     return JSONResponse(
         content={
             "filename": file.filename,
@@ -58,3 +110,9 @@ async def detect_and_identify(file: UploadFile, user_id: str, request: Request):
             "caps": result["caps_identified"],
         }
     )
+
+
+@identify_router.get("/identify/stats")
+async def embedding_stats() -> dict:
+    """Return the queue depth and batch sizes of the embedding micro-batcher."""
+    return EmbeddingBatcher().get_stats()
@@ -0,0 +1,448 @@
+import json
+import threading
+from pathlib import Path
+from typing import IO
+
+try:
+    import fcntl
+except ImportError:  # Windows, the single writer is not enforced
+    fcntl = None  # type: ignore[assignment]
+
+import numpy as np
+from loguru import logger
+
+from app.config import Settings
+from app.services.vector_store import TOP_K, VECTOR_SIZE, VectorStore
+
+settings = Settings()
+
+VECTORS_FILE = "vectors.npy"
+RECORDS_FILE = "records.json"
+CENTROIDS_FILE = "centroids.npy"
+ASSIGNMENTS_FILE = "assignments.npy"
+LOCK_FILE = ".lock"
+
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLES_PER_LIST = 64
+MIN_VECTORS_PER_LIST = 39
+RETRAIN_GROWTH = 4
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, np.finfo(np.float32).eps)
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Return the positions of the k highest scores, sorted from the highest."""
+    if len(scores) > k:
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+class LocalIndex:
+    """In-process approximate nearest neighbour index with an inverted file (IVF).
+
+    The vectors are normalized, so the score is the cosine similarity. While there are less
+    than `exact_threshold` candidates the search is exact, above that the index is trained with
+    k-means and only the `nprobe` closest lists are scanned. Filtering by user_id uses a
+    per-user row index, so the searches inside one collection never scan the other users.
+    """
+
+    def __init__(
+        self,
+        dimension: int = VECTOR_SIZE,
+        nlist: int = 0,
+        nprobe: int = 8,
+        exact_threshold: int = 20000,
+    ):
+        self.dimension = dimension
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.exact_threshold = exact_threshold
+        self._lock = threading.RLock()
+        self.clear()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._vectors: np.ndarray = np.empty((0, self.dimension), dtype=np.float32)
+            self._size = 0
+            self._ids: list[str | None] = []
+            self._metadata: list[dict | None] = []
+            self._alive = np.zeros(0, dtype=bool)
+            self._row_of: dict[str, int] = {}
+            self._rows_by_user: dict[str, set[int]] = {}
+            self._centroids: np.ndarray | None = None
+            self._trained_size = 0
+            self._assignments = np.zeros(0, dtype=np.int32)
+            self._list_rows = np.zeros(0, dtype=np.int64)
+            self._list_offsets = np.zeros(1, dtype=np.int64)
+            self._lists_dirty = True
+
+    def __len__(self) -> int:
+        return len(self._row_of)
+
+    @property
+    def is_trained(self) -> bool:
+        return self._centroids is not None
+
+    def upsert(self, ids: list[str], vectors: np.ndarray, metadata: list[dict]) -> None:
+        vectors = _normalize(vectors).reshape(-1, self.dimension)
+        with self._lock:
+            self._make_writable(self._size + len(ids))
+            for vector_id, vector, meta in zip(ids, vectors, metadata, strict=True):
+                row = self._row_of.get(vector_id)
+                if row is None:
+                    row = self._size
+                    self._size += 1
+                    self._ids.append(vector_id)
+                    self._metadata.append(None)
+                    self._row_of[vector_id] = row
+                else:
+                    self._unindex_user(row)
+                self._vectors[row] = vector
+                self._metadata[row] = dict(meta)
+                self._alive[row] = True
+                self._index_user(row)
+                if self._centroids is not None:
+                    self._assignments[row] = int(np.argmax(self._centroids @ vector))
+            self._lists_dirty = True
+
+    def delete(self, ids: list[str]) -> int:
+        """Delete the vectors by id, the ids that do not exist are ignored."""
+        deleted = 0
+        with self._lock:
+            for vector_id in ids:
+                row = self._row_of.pop(vector_id, None)
+                if row is None:
+                    continue
+                self._unindex_user(row)
+                self._alive[row] = False
+                self._ids[row] = None
+                self._metadata[row] = None
+                deleted += 1
+            if deleted:
+                self._lists_dirty = True
+        return deleted
+
+    def fetch(self, metadata_filter: dict) -> tuple[list[str], list[dict], np.ndarray]:
+        """Return the ids, metadata and normalized vectors that match the filter."""
+        with self._lock:
+            rows = self._filter_rows(metadata_filter)
+            return (
+                [self._ids[row] for row in rows],  # type: ignore[misc]
+                [dict(self._metadata[row]) for row in rows],  # type: ignore[arg-type]
+                np.array(self._vectors[rows], dtype=np.float32),
+            )
+
+    def get(self, ids: list[str]) -> tuple[list[str], list[dict], np.ndarray]:
+        """Return the ids, metadata and normalized vectors of the ids that exist."""
+        with self._lock:
+            rows = [self._row_of[vector_id] for vector_id in ids if vector_id in self._row_of]
+            return (
+                [self._ids[row] for row in rows],  # type: ignore[misc]
+                [dict(self._metadata[row]) for row in rows],  # type: ignore[arg-type]
+                np.array(self._vectors[rows], dtype=np.float32),
+            )
+
+    def find_ids(self, metadata_filter: dict) -> list[str]:
+        with self._lock:
+            return [self._ids[row] for row in self._filter_rows(metadata_filter)]  # type: ignore[misc]
+
+    def train(self, nlist: int | None = None, seed: int = 0) -> None:
+        """Cluster the vectors with spherical k-means to build the inverted lists."""
+        with self._lock:
+            rows = np.flatnonzero(self._alive[: self._size])
+            if len(rows) == 0:
+                return
+            nlist = nlist or self.nlist or max(1, int(np.sqrt(len(rows))))
+            nlist = min(nlist, max(1, len(rows) // MIN_VECTORS_PER_LIST))
+            rng = np.random.default_rng(seed)
+            sample_size = min(len(rows), nlist * KMEANS_SAMPLES_PER_LIST)
+            sample = self._vectors[rng.choice(rows, size=sample_size, replace=False)]
+
+            centroids = sample[rng.choice(len(sample), size=nlist, replace=False)]
+            for _ in range(KMEANS_ITERATIONS):
+                labels = np.argmax(sample @ centroids.T, axis=1)
+                sums = np.zeros_like(centroids)
+                np.add.at(sums, labels, sample)
+                counts = np.bincount(labels, minlength=nlist)
+                empty = counts == 0
+                # Restart the empty clusters from random points
+                sums[empty] = sample[rng.choice(len(sample), size=int(empty.sum()))]
+                centroids = _normalize(sums)
+
+            self._centroids = centroids
+            self._trained_size = len(rows)
+            self._assignments = np.zeros(len(self._alive), dtype=np.int32)
+            for start in range(0, self._size, 65536):
+                block = self._vectors[start : start + 65536]
+                self._assignments[start : start + len(block)] = np.argmax(
+                    block @ centroids.T, axis=1
+                )
+            self._lists_dirty = True
+
+    def query(
+        self, vectors: np.ndarray, top_k: int = TOP_K, metadata_filter: dict | None = None
+    ) -> list[list[dict]]:
+        """Search the top_k closest vectors of every query that match the filter."""
+        queries = _normalize(vectors).reshape(-1, self.dimension)
+        with self._lock:
+            if metadata_filter:
+                candidates = self._filter_rows(metadata_filter)
+            else:
+                candidates = np.flatnonzero(self._alive[: self._size])
+
+            if len(candidates) == 0:
+                return [[] for _ in queries]
+
+            if len(candidates) <= self.exact_threshold:
+                scores = self._vectors[candidates] @ queries.T
+                return [self._matches(candidates, scores[:, i], top_k) for i in range(len(queries))]
+
+            # Train again when the index has grown a lot, so the lists stay short
+            if not self.is_trained or len(self) > RETRAIN_GROWTH * self._trained_size:
+                self.train()
+            self._build_lists()
+            allowed = None
+            if metadata_filter:
+                allowed = np.zeros(self._size, dtype=bool)
+                allowed[candidates] = True
+            return [self._search_lists(query, top_k, allowed) for query in queries]
+
+    def save(self, path: Path) -> None:
+        """Save the alive vectors, compacting the deleted ones."""
+        with self._lock:
+            path.mkdir(parents=True, exist_ok=True)
+            rows = np.flatnonzero(self._alive[: self._size])
+            records = [{"id": self._ids[row], "metadata": self._metadata[row]} for row in rows]
+            self._write(path / VECTORS_FILE, lambda f: np.save(f, self._vectors[rows]))
+            self._write(path / RECORDS_FILE, lambda f: f.write(json.dumps(records).encode()))
+            if self._centroids is not None:
+                self._write(path / CENTROIDS_FILE, lambda f: np.save(f, self._centroids))
+                self._write(path / ASSIGNMENTS_FILE, lambda f: np.save(f, self._assignments[rows]))
+            else:
+                (path / CENTROIDS_FILE).unlink(missing_ok=True)
+                (path / ASSIGNMENTS_FILE).unlink(missing_ok=True)
+
+    @classmethod
+    def load(cls, path: Path, **kwargs) -> "LocalIndex":
+        """Load an index, the vectors are memory-mapped until the first write."""
+        index = cls(**kwargs)
+        vectors = np.load(path / VECTORS_FILE, mmap_mode="r")
+        records = json.loads((path / RECORDS_FILE).read_text())
+        with index._lock:
+            index._vectors = vectors
+            index._size = len(records)
+            index._ids = [record["id"] for record in records]
+            index._metadata = [record["metadata"] for record in records]
+            index._alive = np.ones(len(records), dtype=bool)
+            index._row_of = {vector_id: row for row, vector_id in enumerate(index._ids)}  # type: ignore[misc]
+            for row in range(index._size):
+                index._index_user(row)
+            if (path / CENTROIDS_FILE).exists():
+                index._centroids = np.load(path / CENTROIDS_FILE)
+                index._trained_size = index._size
+                index._assignments = np.load(path / ASSIGNMENTS_FILE).astype(np.int32)
+        return index
+
+    @staticmethod
+    def _write(path: Path, write) -> None:
+        tmp_path = path.with_name(f".{path.name}.tmp")
+        with tmp_path.open("wb") as file:
+            write(file)
+        tmp_path.replace(path)
+
+    def _make_writable(self, size: int) -> None:
+        capacity = len(self._vectors)
+        if size <= capacity and self._vectors.flags.writeable:
+            return
+        new_capacity = max(size, 2 * capacity, 1024)
+        vectors = np.zeros((new_capacity, self.dimension), dtype=np.float32)
+        vectors[: self._size] = self._vectors[: self._size]
+        alive = np.zeros(new_capacity, dtype=bool)
+        alive[: self._size] = self._alive[: self._size]
+        assignments = np.zeros(new_capacity, dtype=np.int32)
+        assignments[: len(self._assignments)] = self._assignments
+        self._vectors, self._alive, self._assignments = vectors, alive, assignments
+
+    def _index_user(self, row: int) -> None:
+        user_id = (self._metadata[row] or {}).get("user_id")
+        if user_id is not None:
+            self._rows_by_user.setdefault(user_id, set()).add(row)
+
+    def _unindex_user(self, row: int) -> None:
+        user_id = (self._metadata[row] or {}).get("user_id")
+        rows = self._rows_by_user.get(user_id) if user_id is not None else None
+        if rows is not None:
+            rows.discard(row)
+            if not rows:
+                del self._rows_by_user[user_id]
+
+    def _filter_rows(self, metadata_filter: dict) -> np.ndarray:
+        for value in metadata_filter.values():
+            if isinstance(value, dict):
+                raise ValueError("Only equality filters are supported by the local index.")  # noqa: TRY004
+        if "user_id" in metadata_filter:
+            rows = sorted(self._rows_by_user.get(metadata_filter["user_id"], ()))
+        else:
+            rows = np.flatnonzero(self._alive[: self._size]).tolist()
+        others = {key: value for key, value in metadata_filter.items() if key != "user_id"}
+        if others:
+            rows = [
+                row
+                for row in rows
+                if all((self._metadata[row] or {}).get(k) == v for k, v in others.items())
+            ]
+        return np.asarray(rows, dtype=np.int64)
+
+    def _build_lists(self) -> None:
+        if not self._lists_dirty or self._centroids is None:
+            return
+        rows = np.flatnonzero(self._alive[: self._size])
+        assignments = self._assignments[rows]
+        order = np.argsort(assignments, kind="stable")
+        self._list_rows = rows[order]
+        counts = np.bincount(assignments, minlength=len(self._centroids))
+        self._list_offsets = np.concatenate(([0], np.cumsum(counts)))
+        self._lists_dirty = False
+
+    def _search_lists(self, query: np.ndarray, top_k: int, allowed: np.ndarray | None) -> list:
+        centroids: np.ndarray = self._centroids  # type: ignore[assignment]
+        probes = _top_k(centroids @ query, min(self.nprobe, len(centroids)))
+        rows = np.concatenate(
+            [self._list_rows[self._list_offsets[p] : self._list_offsets[p + 1]] for p in probes]
+        )
+        if allowed is not None:
+            rows = rows[allowed[rows]]
+        if len(rows) == 0:
+            return []
+        return self._matches(rows, self._vectors[rows] @ query, top_k)
+
+    def _matches(self, rows: np.ndarray, scores: np.ndarray, top_k: int) -> list[dict]:
+        return [
+            {
+                "id": self._ids[rows[i]],
+                "score": float(scores[i]),
+                "metadata": self._metadata[rows[i]],
+            }
+            for i in _top_k(scores, top_k)
+        ]
+
+
+class LocalVectorStore(VectorStore):
+    """Vector store backed by a `LocalIndex` persisted in `local_vector_store_path`.
+
+    Every process keeps its own copy of the index, so only one process can open the folder:
+    run the server with a single worker, or use Pinecone. The changes are written to disk
+    `local_vector_store_persist_delay_seconds` after the first one, grouping the ones that
+    arrive meanwhile, so a crash loses at most that last moment.
+    """
+
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+            cls._instance._initialize()
+        return cls._instance
+
+    def _initialize(self):
+        self.path = Path(settings.local_vector_store_path)
+        self.persist_delay: float = settings.local_vector_store_persist_delay_seconds
+        self._lock_file = self._acquire_single_writer(self.path)
+        self._persist_lock = threading.Lock()
+        self._persist_timer: threading.Timer | None = None
+        index_kwargs = {
+            "nlist": settings.local_index_nlist,
+            "nprobe": settings.local_index_nprobe,
+            "exact_threshold": settings.local_index_exact_threshold,
+        }
+        if (self.path / VECTORS_FILE).exists():
+            self.index = LocalIndex.load(self.path, **index_kwargs)
+            logger.info(f"Loaded {len(self.index)} vectors from {self.path}")
+        else:
+            self.index = LocalIndex(**index_kwargs)
+
+    def query_database(self, vector: list[float]) -> list:
+        return self.index.query(np.asarray([vector]), top_k=TOP_K)[0]
+
+    def query_with_metadata(self, vector: list[float], metadata: dict) -> list:
+        return self.index.query(np.asarray([vector]), top_k=TOP_K, metadata_filter=metadata)[0]
+
+    def query_many_with_metadata(self, vectors: list[list[float]], metadata: dict) -> list[list]:
+        if not vectors:
+            return []
+        return self.index.query(np.asarray(vectors), top_k=TOP_K, metadata_filter=metadata)
+
+    def fetch_user_vectors(self, user_id: str) -> tuple[list[str], list[dict], list]:
+        ids, metadata, vectors = self.index.fetch({"user_id": user_id})
+        return ids, metadata, list(vectors)
+
+    def fetch_metadata(self, names: list[str], user_id: str) -> dict[str, dict]:
+        names_by_id = {self.build_vector_id(user_id, name): name for name in names}
+        ids, metadata, _ = self.index.get(list(names_by_id))
+        return {names_by_id[vector_id]: meta for vector_id, meta in zip(ids, metadata, strict=True)}
+
+    def upsert_multiple_pinecone(self, vectors: list[dict]) -> None:
+        self.index.upsert(
+            ids=[vector["id"] for vector in vectors],
+            vectors=np.asarray([vector["values"] for vector in vectors], dtype=np.float32),
+            metadata=[vector.get("metadata", {}) for vector in vectors],
+        )
+        self._changed()
+
+    def remove_vector(self, name: str, user_id: str) -> None:
+        self.index.delete([self.build_vector_id(user_id, name)])
+        self._changed()
+
+    def remove_vectors(self, names: list[str], user_id: str) -> None:
+        self.index.delete([self.build_vector_id(user_id, name) for name in names])
+        self._changed()
+
+    def empty_index(self) -> None:
+        self.index.clear()
+        self._changed()
+
+    def persist(self) -> None:
+        with self._persist_lock:
+            if self._persist_timer is not None:
+                self._persist_timer.cancel()
+                self._persist_timer = None
+        self.index.save(self.path)
+
+    def _changed(self) -> None:
+        if self.persist_delay <= 0:
+            self.persist()
+            return
+        with self._persist_lock:
+            if self._persist_timer is None:
+                self._persist_timer = threading.Timer(self.persist_delay, self._persist_changes)
+                self._persist_timer.daemon = True
+                self._persist_timer.start()
+
+    def _persist_changes(self) -> None:
+        try:
+            self.persist()
+        except OSError as e:
+            logger.error(f"Failed to persist the vectors to {self.path}: {e!s}")
+
+    @staticmethod
+    def _acquire_single_writer(path: Path) -> IO | None:
+        """Lock the folder until the process exits, a second process would overwrite it."""
+        if fcntl is None:
+            return None
+        path.mkdir(parents=True, exist_ok=True)
+        lock_file = (path / LOCK_FILE).open("w")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError as e:
+            lock_file.close()
+            raise RuntimeError(
+                f"{path} is used by another process, the local vector store needs a single "
+                "worker."
+            ) from e
+        return lock_file
@@ -1,20 +1,21 @@
-from fastapi import HTTPException
-from pinecone import Pinecone
-from starlette import status
+from concurrent.futures import ThreadPoolExecutor
 
 from app.config import Settings
-
-TOP_K = 9
+from app.services.vector_store import TOP_K, VectorStore
+from app.shared.executors import get_storage_executor
+from app.shared.metrics import time_call
 
 settings = Settings()
 
-VECTOR_SIZE: int = 576
-EMPTY_VECTOR: list[float] = VECTOR_SIZE * [0.1]
+# Pinecone deletes at most 1000 ids per request
+DELETE_BATCH_SIZE: int = 1000
+# The ids of a fetch go in the query string, like the pages of the list
+FETCH_BATCH_SIZE: int = 100
 
 
-class PineconeContainer:
-    # The updates from Pinecone take a little bit to reflect,
-    # so if you upload and then instantly remove, it will probably not work.
+class PineconeContainer(VectorStore):
+    # The updates from Pinecone take a little bit to reflect, the queries may not see the
+    # vectors that were just uploaded. Removing doesn't query, it deletes by the vector id.
 
     _instance = None
 
@@ -25,57 +26,101 @@ class PineconeContainer:
         return cls._instance
 
     def _initialize(self):
-        self.pc = Pinecone(api_key=settings.pinecone_api_key, environment=settings.pinecone_env)
-        self.index = self.pc.Index(name="bottle-caps")
+        if settings.pinecone_backend == "fake":
+            from app.services.fake_backends import FakePineconeIndex, FaultInjector
+
+            self.index = FakePineconeIndex(FaultInjector.from_settings())
+        else:
+            from pinecone import Pinecone
+
+            self.pc = Pinecone(api_key=settings.pinecone_api_key, environment=settings.pinecone_env)
+            self.index = self.pc.Index(name="bottle-caps")
+        self.query_executor = ThreadPoolExecutor(
+            max_workers=settings.pinecone_query_concurrency, thread_name_prefix="pinecone"
+        )
 
     def query_database(self, vector):
-        result = self.index.query(vector=[vector], top_k=TOP_K, namespace="bottle-caps")
+        with time_call("pinecone", "query"):
+            result = self.index.query(vector=[vector], top_k=TOP_K, namespace="bottle-caps")
         return self.parse_result_query(result)
 
     def query_with_metadata(self, vector: list[float], metadata: dict):
-        result = self.index.query(
-            vector=vector,
-            filter=metadata,
-            top_k=TOP_K,
-            include_metadata=True,
-            namespace="bottle-caps",
-        )
+        with time_call("pinecone", "query"):
+            result = self.index.query(
+                vector=vector,
+                filter=metadata,
+                top_k=TOP_K,
+                include_metadata=True,
+                namespace="bottle-caps",
+            )
         return self.parse_result_query(result)
 
-    def upsert_into_pinecone(self, vector_id: str, values: list[float], metadata: dict) -> None:
-        cap = {"id": vector_id, "values": values, "metadata": metadata}
-        return self.upsert_dict_pinecone(cap)
-
-    def upsert_dict_pinecone(self, cap_info: dict) -> None:
-        """Upsert dictionary into pinecone.
+    def query_many_with_metadata(
+        self, vectors: list[list[float]], metadata: dict
+    ) -> list[list[dict]]:
+        """Send one query per vector at the same time.
 
         Args:
         ----
-            cap_info (dict): The dictionary can contain the following keys: id, values, metadata.
+            vectors: The vectors to query, for example one per detected cap.
+            metadata: The filter applied to all the queries.
+
+        Returns:
+        -------
+            The matches of every vector, in the same order as the vectors.
 
         """
-        self.index.upsert(vectors=[cap_info], namespace="bottle-caps")
+        if len(vectors) <= 1:
+            return [self.query_with_metadata(vector, metadata) for vector in vectors]
+        return list(
+            self.query_executor.map(
+                lambda vector: self.query_with_metadata(vector, metadata), vectors
+            )
+        )
+
+    def fetch_user_vectors(self, user_id: str) -> tuple[list[str], list[dict], list]:
+        """Fetch the pages of ids of the user at the same time on the storage executor.
+
+        The io executor may be running this call, its own fetches could wait for it forever.
+        """
+        pages = self.index.list(prefix=self.build_vector_prefix(user_id), namespace="bottle-caps")
+        ids, metadata, values = [], [], []
+        for fetched in get_storage_executor().map(self._fetch_page, pages):
+            for vector_id, vector in fetched.vectors.items():
+                ids.append(vector_id)
+                metadata.append(vector.metadata)
+                values.append(vector.values)
+        return ids, metadata, values
+
+    def _fetch_page(self, page: list[str]):
+        with time_call("pinecone", "fetch"):
+            return self.index.fetch(ids=page, namespace="bottle-caps")
+
+    def fetch_metadata(self, names: list[str], user_id: str) -> dict[str, dict]:
+        names_by_id = {self.build_vector_id(user_id, name): name for name in names}
+        ids = list(names_by_id)
+        metadata = {}
+        for start in range(0, len(ids), FETCH_BATCH_SIZE):
+            fetched = self._fetch_page(ids[start : start + FETCH_BATCH_SIZE])
+            for vector_id, vector in fetched.vectors.items():
+                metadata[names_by_id[vector_id]] = vector.metadata or {}
+        return metadata
 
     def upsert_multiple_pinecone(self, vectors):
-        self.index.upsert(vectors=vectors, namespace="bottle-caps")
+        with time_call("pinecone", "upsert"):
+            self.index.upsert(vectors=vectors, namespace="bottle-caps")
 
     def remove_vector(self, name: str, user_id: str) -> None:
-        res = self.index.query(
-            filter={"name": name, "user_id": user_id},
-            top_k=1,
-            vector=EMPTY_VECTOR,
-            include_metadata=True,
-            namespace="bottle-caps",
-        )
-        if len(res["matches"]) == 0:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND, detail="Image does not exist."
-            )
-        vector_obj = res["matches"][0]
-        self.index.delete(
-            ids=[vector_obj["id"]],
-            namespace="bottle-caps",
-        )
+        with time_call("pinecone", "delete"):
+            self.index.delete(ids=[self.build_vector_id(user_id, name)], namespace="bottle-caps")
+
+    def remove_vectors(self, names: list[str], user_id: str) -> None:
+        ids = [self.build_vector_id(user_id, name) for name in names]
+        for start in range(0, len(ids), DELETE_BATCH_SIZE):
+            with time_call("pinecone", "delete"):
+                self.index.delete(
+                    ids=ids[start : start + DELETE_BATCH_SIZE], namespace="bottle-caps"
+                )
 
     @staticmethod
     def parse_result_query(result_query):
@@ -0,0 +1,222 @@
+import asyncio
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable
+from pathlib import Path
+from typing import Any
+
+from loguru import logger
+
+from app.config import Settings
+from app.shared.executors import get_io_executor
+
+settings = Settings()
+
+
+class ResultCache:
+    """Cache of the results of the endpoints keyed by the hash of the uploaded bytes.
+
+    There is an in-process LRU tier and, when `result_cache_dir` is set, a JSON tier on disk
+    that is shared by all the workers. The keys of the identify results contain a generation
+    of the user, which is increased every time the user saves or deletes a cap, so the old
+    entries are never read again. The generations are kept in `result_cache_dir`, so that a
+    save in one worker invalidates the results of all of them: without it the results of the
+    users are not cached, only the detections. Identical requests that arrive at the same time
+    are coalesced and computed only once, if the request that computes it is cancelled one of
+    the others takes over. The entries on disk are swept every `result_cache_sweep_seconds`.
+    """
+
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+            cls._instance._initialize()
+        return cls._instance
+
+    def _initialize(self):
+        self.enabled: bool = settings.result_cache_enabled
+        self.max_entries: int = settings.result_cache_max_entries
+        self.ttl: float = settings.result_cache_ttl_seconds
+        self.directory: Path | None = (
+            Path(settings.result_cache_dir) if settings.result_cache_dir else None
+        )
+        self.max_disk_bytes: int = settings.result_cache_max_disk_bytes
+        self.sweep_interval: float = settings.result_cache_sweep_seconds
+        self._entries: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+        self._inflight: dict[str, asyncio.Future] = {}
+        self._last_sweep: float = time.monotonic()
+        self._sweeping = threading.Lock()
+
+    async def get_or_compute(
+        self,
+        endpoint: str,
+        file_contents: bytes,
+        compute: Callable[[], Awaitable[Any]],
+        user_id: str | None = None,
+    ) -> Any:
+        """Return the cached result of the request or compute it.
+
+        Args:
+        ----
+            endpoint: The name of the endpoint, part of the key.
+            file_contents: The uploaded bytes.
+            compute: Computes the result when it's not cached, it must be JSON serializable.
+            user_id: For the results that depend on the collection of the user.
+
+        Returns:
+        -------
+            The result, the same one for all the identical requests.
+
+        """
+        if not self.enabled or (user_id is not None and self.directory is None):
+            return await compute()
+
+        key = self.build_key(endpoint, file_contents, user_id)
+        while True:
+            cached = self._get(key)
+            if cached is not None:
+                return cached
+            inflight = self._inflight.get(key)
+            if inflight is None:
+                break
+            try:
+                return await asyncio.shield(inflight)
+            except asyncio.CancelledError:
+                # The request computing it went away (e.g. the client disconnected), not this one
+                if inflight.cancelled() and not asyncio.current_task().cancelling():
+                    continue
+                raise
+
+        future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await compute()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Nobody may be waiting, don't log it as never retrieved
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(key, None)
+        future.set_result(result)
+        self._set(key, result)
+        return result
+
+    def build_key(self, endpoint: str, file_contents: bytes, user_id: str | None = None) -> str:
+        digest = hashlib.sha256(file_contents).hexdigest()
+        if user_id is None:
+            return f"{endpoint}-{digest}"
+        user_hash = hashlib.sha256(user_id.encode()).hexdigest()[:16]
+        return f"{endpoint}-{user_hash}-{self._generation(user_id)}-{digest}"
+
+    def invalidate_user(self, user_id: str) -> None:
+        """Stop serving the cached identify results of a user, in all the workers."""
+        path = self._generation_path(user_id)
+        if path is not None:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self._write(path, str(self._generation(user_id) + 1))
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def _generation(self, user_id: str) -> int:
+        path = self._generation_path(user_id)
+        if path is None:
+            return 0
+        try:
+            return int(path.read_text())
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def _generation_path(self, user_id: str) -> Path | None:
+        if self.directory is None:
+            return None
+        return self.directory / "users" / hashlib.sha256(user_id.encode()).hexdigest()
+
+    def _entry_path(self, key: str) -> Path | None:
+        if self.directory is None:
+            return None
+        return self.directory / "entries" / key[-2:] / f"{key}.json"
+
+    def _get(self, key: str) -> Any:
+        entry = self._entries.get(key)
+        if entry is not None:
+            stored_at, result = entry
+            if time.time() - stored_at <= self.ttl:
+                self._entries.move_to_end(key)
+                return result
+            del self._entries[key]
+
+        path = self._entry_path(key)
+        if path is None:
+            return None
+        try:
+            if time.time() - path.stat().st_mtime > self.ttl:
+                path.unlink(missing_ok=True)
+                return None
+            result = json.loads(path.read_text())
+        except (OSError, ValueError):
+            return None
+        self._set_memory(key, result)
+        return result
+
+    def _set(self, key: str, result: Any) -> None:
+        self._set_memory(key, result)
+        path = self._entry_path(key)
+        if path is not None:
+            try:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                self._write(path, json.dumps(result))
+            except (OSError, TypeError) as e:
+                logger.warning(f"Failed to save {key} in the result cache: {e!s}")
+            if time.monotonic() - self._last_sweep >= self.sweep_interval:
+                self._last_sweep = time.monotonic()
+                get_io_executor().submit(self.sweep)
+
+    def sweep(self) -> None:
+        """Remove the entries on disk past the TTL, and then the oldest past the maximum size."""
+        if self.directory is None or not self._sweeping.acquire(blocking=False):
+            return
+        try:
+            files = []
+            now = time.time()
+            for path in (self.directory / "entries").rglob("*"):
+                try:
+                    stat = path.stat()
+                    if not path.is_file():
+                        continue
+                    if now - stat.st_mtime > self.ttl:
+                        path.unlink(missing_ok=True)
+                    else:
+                        files.append((stat.st_mtime, stat.st_size, path))
+                except OSError:
+                    # Removed by another worker or read past its TTL meanwhile
+                    continue
+
+            total = sum(size for _, size, _ in files)
+            for _, size, path in sorted(files):
+                if total <= self.max_disk_bytes:
+                    break
+                path.unlink(missing_ok=True)
+                total -= size
+        finally:
+            self._sweeping.release()
+
+    def _set_memory(self, key: str, result: Any) -> None:
+        self._entries[key] = (time.time(), result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    @staticmethod
+    def _write(path: Path, content: str) -> None:
+        tmp_path = path.with_name(f".{path.name}.{time.monotonic_ns()}.tmp")
+        tmp_path.write_text(content)
+        tmp_path.replace(path)
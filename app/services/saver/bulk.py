@@ -0,0 +1,275 @@
+import asyncio
+import contextlib
+import time
+from collections.abc import AsyncIterator, Awaitable, Callable
+from dataclasses import dataclass
+from typing import IO
+
+import numpy as np
+from fastapi import HTTPException
+from loguru import logger
+
+from app.config import Settings
+from app.services.identify.batcher import EmbeddingBatcher
+from app.services.result_cache import ResultCache
+from app.services.saver.manager import (
+    build_file_name,
+    build_metadata,
+    remove_stored_image,
+    store_image,
+)
+from app.services.user_vector_cache import UserVectorCache
+from app.services.vector_store import get_vector_store
+from app.shared.decoded_image import DecodedImage
+from app.shared.executors import run_in_thread, run_io
+from app.shared.perceptual_hash import dhash
+
+settings = Settings()
+
+
+@dataclass
+class BulkItem:
+    """One file of a bulk upload, it only keeps the form the next stage needs."""
+
+    index: int
+    filename: str
+    file: IO[bytes] | None
+    masked: np.ndarray | None = None
+    resized: np.ndarray | None = None
+    vector: list[float] | None = None
+    dhash: str | None = None
+    url: str | None = None
+    reported: bool = False
+
+    @property
+    def file_name(self) -> str:
+        return build_file_name(self.filename)
+
+
+def _read_and_decode(file: IO[bytes]) -> tuple[np.ndarray, np.ndarray, str]:
+    try:
+        image = DecodedImage(file.read())
+    finally:
+        file.close()
+    return image.masked(), image.resized(), dhash(image.masked())
+
+
+def _error_message(error: BaseException) -> str:
+    if isinstance(error, HTTPException):
+        return str(error.detail)
+    return f"{type(error).__name__}: {error!s}"
+
+
+class BulkSaver:
+    """Save the files of a bulk upload through a pipeline of bounded stages.
+
+    decode -> batched embedding -> parallel uploads to Firebase -> batched upserts
+
+    The stages are connected by queues of `bulk_save_queue_size` items, so only a few decoded
+    images are in memory at any time whatever the number of files. The embedding takes all
+    the decoded images that are ready in one batch, `bulk_save_upload_concurrency` uploads
+    run at the same time and the vectors are upserted `bulk_save_upsert_batch_size` at a time.
+    A file that fails at any stage is reported and skipped, it doesn't stop the others.
+
+    Args:
+    ----
+        files: The (filename, file) of every upload, the files are closed once read.
+        user_id: The user uploading the files.
+
+    """
+
+    def __init__(self, files: list[tuple[str, IO[bytes]]], user_id: str):
+        self.user_id = user_id
+        self.items = [
+            BulkItem(index=index, filename=filename, file=file)
+            for index, (filename, file) in enumerate(files)
+        ]
+        self.events: asyncio.Queue[dict] = asyncio.Queue()
+        self.processed = 0
+
+    async def run(self) -> AsyncIterator[dict]:
+        """Yield one event per file as soon as it is saved or fails."""
+        to_decode: asyncio.Queue[BulkItem] = asyncio.Queue()
+        for item in self.items:
+            to_decode.put_nowait(item)
+        to_embed: asyncio.Queue[BulkItem] = asyncio.Queue(settings.bulk_save_queue_size)
+        to_upload: asyncio.Queue[BulkItem] = asyncio.Queue(settings.bulk_save_queue_size)
+        to_upsert: asyncio.Queue[BulkItem] = asyncio.Queue(settings.bulk_save_queue_size)
+
+        tasks = [
+            *[
+                asyncio.create_task(self._worker(to_decode, to_embed, self._decode))
+                for _ in range(settings.cpu_thread_workers)
+            ],
+            asyncio.create_task(self._embed_stage(to_embed, to_upload)),
+            *[
+                asyncio.create_task(self._worker(to_upload, to_upsert, self._upload))
+                for _ in range(settings.bulk_save_upload_concurrency)
+            ],
+            asyncio.create_task(self._upsert_stage(to_upsert)),
+        ]
+        try:
+            for _ in self.items:
+                yield await self._next_event(tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            for item in self.items:
+                if item.file is not None:
+                    item.file.close()
+            ResultCache().invalidate_user(self.user_id)
+
+    async def _next_event(self, tasks: list[asyncio.Task]) -> dict:
+        """Wait for the next event, if a stage dies the files it didn't report fail with it."""
+        if self.events.empty():
+            next_event = asyncio.ensure_future(self.events.get())
+            await asyncio.wait([next_event, *tasks], return_when=asyncio.FIRST_COMPLETED)
+            if next_event.done():
+                return next_event.result()
+            next_event.cancel()
+            dead = next(task for task in tasks if task.done())
+            error = dead.exception() or RuntimeError("A stage of the bulk upload stopped.")
+            logger.error(f"Bulk upload stage of {self.user_id} died: {error!r}")
+            for item in self.items:
+                if not item.reported:
+                    self._report(item, error=error)
+        return self.events.get_nowait()
+
+    def _report(self, item: BulkItem, error: BaseException | None = None, url: str | None = None):
+        if item.reported:
+            # Already failed with a stage that died
+            return
+        event = {"filename": item.filename, "processed": self.processed, "total": len(self.items)}
+        if error is None:
+            event["url"] = url
+        else:
+            event["error"] = _error_message(error)
+            logger.warning(f"Bulk upload of {item.filename} failed for {self.user_id}: {error!s}")
+        self.processed += 1
+        item.reported = True
+        # Release what is left of the file, a failed item leaves the pipeline here
+        item.file = item.masked = item.resized = None
+        self.events.put_nowait(event)
+
+    async def _worker(
+        self,
+        inbox: asyncio.Queue[BulkItem],
+        outbox: asyncio.Queue[BulkItem],
+        process: Callable[[BulkItem], Awaitable[None]],
+    ) -> None:
+        while True:
+            item = await inbox.get()
+            try:
+                await process(item)
+            except Exception as e:  # noqa: BLE001
+                self._report(item, error=e)
+                continue
+            await outbox.put(item)
+
+    async def _decode(self, item: BulkItem) -> None:
+        file, item.file = item.file, None
+        item.masked, item.resized, item.dhash = await run_in_thread(_read_and_decode, file)
+
+    async def _upload(self, item: BulkItem) -> None:
+        resized, item.resized = item.resized, None
+        try:
+            item.url = await store_image(resized, item.file_name, self.user_id)  # type: ignore[arg-type]
+        except HTTPException:
+            # A conflict, the image belongs to an earlier upload
+            raise
+        except Exception:
+            await self._discard([item])
+            raise
+
+    async def _discard(self, items: list[BulkItem]) -> None:
+        """Remove what was stored of the items, so the user can upload them again."""
+        await asyncio.gather(
+            *[remove_stored_image(item.file_name, self.user_id) for item in items],
+            return_exceptions=True,
+        )
+
+    async def _embed_stage(
+        self, inbox: asyncio.Queue[BulkItem], outbox: asyncio.Queue[BulkItem]
+    ) -> None:
+        while True:
+            batch = await self._take_batch(inbox, settings.embedding_batch_max_size, 0.0)
+            try:
+                vectors = await self._embed_batch(batch)
+            except Exception as e:  # noqa: BLE001
+                vectors = [e] * len(batch)
+            for item, vector in zip(batch, vectors, strict=True):
+                item.masked = None
+                if isinstance(vector, BaseException):
+                    self._report(item, error=vector)
+                    continue
+                item.vector = vector
+                await outbox.put(item)
+
+    async def _embed_batch(self, batch: list[BulkItem]) -> list[list[float] | BaseException]:
+        try:
+            vectors = await EmbeddingBatcher().embed_many([item.masked for item in batch])
+            return vectors.tolist()
+        except Exception as e:  # noqa: BLE001
+            # Embed every image on its own so the errors are reported per file
+            logger.warning(f"Bulk vectorization failed for {self.user_id}, falling back: {e!s}")
+        # embed() already returns lists
+        return await asyncio.gather(
+            *[EmbeddingBatcher().embed(item.masked) for item in batch],
+            return_exceptions=True,
+        )
+
+    async def _upsert_stage(self, inbox: asyncio.Queue[BulkItem]) -> None:
+        vector_store = get_vector_store()
+        while True:
+            batch = await self._take_batch(
+                inbox,
+                settings.bulk_save_upsert_batch_size,
+                settings.bulk_save_upsert_max_wait_ms / 1000,
+            )
+            records = [
+                {
+                    "id": vector_store.build_vector_id(self.user_id, item.filename),
+                    "values": item.vector,
+                    "metadata": build_metadata(
+                        self.user_id, item.filename, item.dhash, file_name=item.file_name
+                    ),
+                }
+                for item in batch
+            ]
+            try:
+                await run_io(vector_store.upsert_multiple_pinecone, records)
+            except Exception as e:  # noqa: BLE001
+                # Without their vectors the images can't be found
+                await self._discard(batch)
+                for item in batch:
+                    self._report(item, error=e)
+                continue
+            for item, record in zip(batch, records, strict=True):
+                UserVectorCache().upsert(
+                    self.user_id,
+                    vector_id=record["id"],
+                    values=record["values"],
+                    metadata=record["metadata"],
+                )
+                self._report(item, url=item.url)
+
+    @staticmethod
+    async def _take_batch(
+        inbox: asyncio.Queue[BulkItem], max_size: int, max_wait: float
+    ) -> list[BulkItem]:
+        """Wait for one item, then take the ones that arrive within max_wait, up to max_size."""
+        batch = [await inbox.get()]
+        deadline = time.monotonic() + max_wait
+        while len(batch) < max_size:
+            if not inbox.empty():
+                batch.append(inbox.get_nowait())
+                continue
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            with contextlib.suppress(TimeoutError):
+                batch.append(await asyncio.wait_for(inbox.get(), timeout))
+                continue
+            break
+        return batch
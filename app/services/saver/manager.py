@@ -1,26 +1,37 @@
-import uuid
-from typing import TYPE_CHECKING
+import asyncio
 
+import numpy as np
+import starlette.status
+from fastapi import HTTPException
+
+from app.config import Settings
 from app.services.firebase_container import FirebaseContainer
-from app.services.identify.image_vectorizer import ImageVectorizer
-from app.services.pinecone_container import PineconeContainer
-from app.shared.utils import resize_image_max_size
+from app.services.identify.batcher import EmbeddingBatcher
+from app.services.result_cache import ResultCache
+from app.services.user_vector_cache import UserVectorCache
+from app.services.vector_store import VectorStore, get_vector_store
+from app.shared.decoded_image import DecodedImage
+from app.shared.executors import run_in_thread, run_io, run_storage
+from app.shared.perceptual_hash import dhash
+from app.shared.utils import build_thumbnails, image_extension
 
-if TYPE_CHECKING:
-    import numpy as np
+settings = Settings()
 
 
 async def save_image(
-    file: bytes,
+    file: bytes | DecodedImage,
     name: str,
     user_id: str,
     vector: list[float] | None = None,
 ) -> str:
     """Add an image it will upload it to Firebase and Pinecone.
 
+    The image is decoded once, the masked image that is embedded and the resized one that is
+    stored are derived from the same pixels.
+
     Args:
     ----
-        file (UploadFile): The image.
+        file (bytes | DecodedImage): The image, a DecodedImage reuses the forms already built.
         name (str): The name.
         user_id (str): The user id.
         vector (list[float]): The vector to save in Pinecone.
@@ -30,21 +41,114 @@ async def save_image(
     The path of the firebase image.
 
     """
+    image = file if isinstance(file, DecodedImage) else DecodedImage(file)
+    masked = await run_in_thread(image.masked)
     if not vector:
-        vector = await ImageVectorizer().image_to_vector(file)
-    pinecone_container: PineconeContainer = PineconeContainer()
+        vector = await EmbeddingBatcher().embed(masked)
+    vector_store: VectorStore = get_vector_store()
     firebase_container: FirebaseContainer = FirebaseContainer()
-    file_name: str = f"{name}.jpg"
+    file_name: str = build_file_name(name)
+
+    resized: np.ndarray = await run_in_thread(image.resized)
+    upload_url: str = await run_storage(
+        firebase_container.add_image_to_container, resized, file_name, user_id
+    )
+    vector_id: str = vector_store.build_vector_id(user_id, name)
+    metadata: dict = build_metadata(
+        user_id, name, await run_in_thread(dhash, masked), file_name=file_name
+    )
+    # The thumbnails and the vector only go after the image, it detects the duplicates
+    await asyncio.gather(
+        run_io(
+            vector_store.upsert_into_pinecone,
+            vector_id=vector_id,
+            values=vector,
+            metadata=metadata,
+        ),
+        upload_thumbnails(resized, file_name, user_id),
+    )
+    UserVectorCache().upsert(user_id, vector_id=vector_id, values=vector, metadata=metadata)
+    ResultCache().invalidate_user(user_id)
+    return upload_url
+
+
+def build_file_name(name: str) -> str:
+    """Name of the stored file of an image, with the extension of `storage_image_format`.
+
+    The vector and its metadata keep the name without extension, changing the format doesn't
+    change them.
+    """
+    return f"{name}{image_extension(settings.storage_image_format)}"
+
+
+def stored_file_name(name: str, metadata: dict | None) -> str:
+    """Name of the stored file of an image, from the metadata of its vector.
+
+    The vectors keep the name of their file, the format may have changed since they were
+    saved. The vectors saved before have no file_name, their name is the one of the file.
+    Without a vector, it is the file the image would have with the current format.
+    """
+    if metadata is None:
+        return build_file_name(name)
+    return metadata.get("file_name", metadata["name"])
+
+
+def build_metadata(user_id: str, name: str, image_hash: str, file_name: str) -> dict:
+    """Metadata of the vector of an image, the same for all the savers."""
+    return {"user_id": user_id, "name": name, "dhash": image_hash, "file_name": file_name}
+
+
+def migrate_legacy_metadata(metadata: dict) -> dict:
+    """Metadata of a vector saved before it kept its file_name, with the name of the new ones.
+
+    Those vectors were named after their file, which is the name they were saved with
+    followed by .jpg.
+    """
+    if "file_name" in metadata:
+        return metadata
+    return {
+        **metadata,
+        "name": metadata["name"].removesuffix(".jpg"),
+        "file_name": metadata["name"],
+    }
+
+
+async def store_image(resized: np.ndarray, file_name: str, user_id: str) -> str:
+    """Upload an image already resized to MAX_SIZE and then its thumbnails.
+
+    Args:
+    ----
+        resized: The image to store.
+        file_name: The name of the file, see `build_file_name`.
+        user_id: The user id.
+
+    Returns:
+    -------
+        The public url of the image.
 
-    image: np.ndarray = resize_image_max_size(file)
-    upload_url: str = firebase_container.add_image_to_container(image, file_name, user_id)
-    pinecone_container.upsert_into_pinecone(
-        vector_id=str(uuid.uuid4()), values=vector, metadata={"user_id": user_id, "name": file_name}
+    """
+    upload_url: str = await run_storage(
+        FirebaseContainer().add_image_to_container, resized, file_name, user_id
     )
+    await upload_thumbnails(resized, file_name, user_id)
     return upload_url
 
 
-def remove_image(
+async def upload_thumbnails(resized: np.ndarray, file_name: str, user_id: str) -> None:
+    """Build the thumbnail pyramid of a stored image and upload the sizes in parallel."""
+    firebase_container: FirebaseContainer = FirebaseContainer()
+    thumbnails = await run_in_thread(build_thumbnails, resized, settings.storage_thumbnail_sizes)
+    await asyncio.gather(
+        *[
+            run_storage(
+                firebase_container.add_thumbnail_to_container, thumbnail, size, file_name, user_id
+            )
+            for size, thumbnail in thumbnails.items()
+        ]
+    )
+
+
+async def remove_image(
     name: str,
     user_id: str,
 ) -> None:
@@ -56,7 +160,70 @@ def remove_image(
         user_id (str): The id of the user
 
     """
-    pinecone_container: PineconeContainer = PineconeContainer()
+    vector_store: VectorStore = get_vector_store()
+    metadata = await run_io(vector_store.fetch_metadata, [name], user_id)
+    await remove_stored_image(stored_file_name(name, metadata.get(name)), user_id)
+    await run_io(vector_store.remove_vector, name=name, user_id=user_id)
+    UserVectorCache().remove(user_id, name=name)
+    ResultCache().invalidate_user(user_id)
+
+
+async def remove_images(names: list[str], user_id: str) -> list[dict]:
+    """Delete multiple images at once.
+
+    The images are removed from Firebase in parallel, bounded by the storage executor, and
+    then all their vectors with one request. The vector of an image that was not in Firebase
+    is removed too, an image that failed for another reason keeps its vector.
+
+    Args:
+    ----
+        names: The names of the images.
+        user_id: The id of the user.
+
+    Returns:
+    -------
+        For every name, in the same order, whether it was deleted and the error if not.
+
+    """
+    metadata = await run_io(get_vector_store().fetch_metadata, names, user_id)
+    outcomes = await asyncio.gather(
+        *[
+            remove_stored_image(stored_file_name(name, metadata.get(name)), user_id)
+            for name in names
+        ],
+        return_exceptions=True,
+    )
+    results = []
+    orphans = []
+    for name, outcome in zip(names, outcomes, strict=True):
+        if isinstance(outcome, BaseException):
+            missing = (
+                isinstance(outcome, HTTPException)
+                and outcome.status_code == starlette.status.HTTP_404_NOT_FOUND
+            )
+            error = outcome.detail if isinstance(outcome, HTTPException) else repr(outcome)
+            results.append({"name": name, "deleted": False, "error": error})
+            if missing:
+                orphans.append(name)
+        else:
+            results.append({"name": name, "deleted": True, "error": None})
+
+    removed = [result["name"] for result in results if result["deleted"]] + orphans
+    if removed:
+        await run_io(get_vector_store().remove_vectors, removed, user_id)
+        for name in removed:
+            UserVectorCache().remove(user_id, name=name)
+        ResultCache().invalidate_user(user_id)
+    return results
+
+
+async def remove_stored_image(file_name: str, user_id: str) -> None:
+    """Remove a stored file and its thumbnails from Firebase, 404 if the file doesn't exist."""
     firebase_container: FirebaseContainer = FirebaseContainer()
-    firebase_container.remove_image(name=name, user_id=user_id)
-    pinecone_container.remove_vector(name=name, user_id=user_id)
+    await run_storage(firebase_container.remove_image, name=file_name, user_id=user_id)
+    await asyncio.gather(
+        *[
+            run_storage(firebase_container.remove_thumbnail, size, name=file_name, user_id=user_id)
+            for size in settings.storage_thumbnail_sizes
+        ]
+    )
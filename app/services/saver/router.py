@@ -1,15 +1,19 @@
-import asyncio
 import json
+from typing import Annotated
 
-from fastapi import APIRouter, Depends, UploadFile
-from loguru import logger
+import starlette.status
+from fastapi import APIRouter, Body, Depends, HTTPException, UploadFile
 from starlette.requests import Request
 from starlette.responses import StreamingResponse
 
-from app.config import LIMIT_PERIOD
+from app.config import LIMIT_PERIOD, Settings
 from app.services.auth import validate_api_key
 from app.services.limiter import request_limiter
-from app.services.saver.manager import remove_image, save_image
+from app.services.saver.bulk import BulkSaver
+from app.services.saver.manager import remove_image, remove_images, save_image
+from app.shared.utils import detach_upload_files
+
+settings = Settings()
 
 saver_router: APIRouter = APIRouter(dependencies=[Depends(validate_api_key)], tags=["Saver"])
 
@@ -48,21 +52,17 @@ async def post_save_images(
     user_id: str,
     request: Request,
 ) -> StreamingResponse:
-    """Save multiple images and send progress updates via SSE."""
-    files_data = [(await data.read(), data.filename) for data in files]
-    total_images: int = len(files)
+    """Save multiple images and send progress updates via SSE.
 
-    async def event_stream():
-        tasks = [save_image(file, name, user_id) for file, name in files_data]
-        for index, coro in enumerate(asyncio.as_completed(tasks)):
-            try:
-                await coro
-                data = {"processed": index, "total": total_images}
-                yield f"data: {json.dumps(data)}\n\n"
-                logger.info(f" Bulk upload succeeded {user_id}: {index}")
+    Every file gets one event when it is saved or fails, with its filename and the error if
+    any, e.g. data: {"filename": "cap.jpg", "processed": 0, "total": 2, "url": "..."}.
+    """
+    # The pipeline reads the files one by one while the events are streamed
+    uploads = detach_upload_files(files)
 
-            except Exception as e:  # noqa: BLE001
-                yield f"data:{e!s}\n\n"
+    async def event_stream():
+        async for event in BulkSaver(uploads, user_id).run():
+            yield f"data: {json.dumps(event)}\n\n"
 
     return StreamingResponse(event_stream(), media_type="text/event-stream")
 
@@ -78,9 +78,37 @@ async def delete_image(
 
     Args:
     ----
-        name (str): The name of the image
+        name (str): The name of the image, as returned by identify
         user_id (str): The id of the user
         request (Request): Needed for the limiter
 
     """
-    remove_image(name, user_id)
+    await remove_image(name, user_id)
+
+
+@saver_router.delete("/delete/bulk")
+@request_limiter.limit(LIMIT_PERIOD)
+async def delete_images(
+    user_id: str,
+    request: Request,
+    names: Annotated[list[str], Body()],
+) -> list[dict]:
+    """Delete multiple images in one request.
+
+    Args:
+    ----
+        user_id (str): The id of the user
+        request (Request): Needed for the limiter
+        names (list[str]): The names of the images, a JSON list in the body
+
+    Returns:
+    -------
+        For every name, in the same order, whether it was deleted and the error if not.
+
+    """
+    if len(names) > settings.bulk_delete_max_names:
+        raise HTTPException(
+            status_code=starlette.status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {settings.bulk_delete_max_names} names per request.",
+        )
+    return await remove_images(names, user_id)
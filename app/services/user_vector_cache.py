@@ -0,0 +1,273 @@
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, replace
+
+import numpy as np
+
+from app.config import Settings
+from app.services.vector_store import TOP_K, VECTOR_SIZE, get_vector_store
+from app.shared.perceptual_hash import HASH_BITS, hamming_distances, hash_to_int
+
+settings = Settings()
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, np.finfo(np.float32).eps)
+
+
+def _hashes(metadata: list[dict]) -> np.ndarray:
+    # The images saved before the hashes were added have none, their hash is never compared
+    return np.asarray([hash_to_int(m.get("dhash") or "0") for m in metadata], dtype=np.uint64)
+
+
+def _hashed(metadata: list[dict]) -> np.ndarray:
+    return np.asarray(["dhash" in m for m in metadata], dtype=bool)
+
+
+@dataclass(frozen=True)
+class UserWorkingSet:
+    """All the vectors of one user in a contiguous float32 matrix of normalized rows.
+
+    The perceptual hashes of the images, stored in their metadata, are kept next to them. A
+    working set is never modified, the changes return a new one, so it can be searched
+    without any lock while it is replaced.
+    """
+
+    ids: list[str]
+    metadata: list[dict]
+    vectors: np.ndarray
+    loaded_at: float
+    hashes: np.ndarray
+    hashed: np.ndarray
+
+    @classmethod
+    def from_values(cls, ids: list[str], metadata: list[dict], values: list) -> "UserWorkingSet":
+        vectors = np.asarray(values, dtype=np.float32).reshape(-1, VECTOR_SIZE)
+        return cls(
+            ids=list(ids),
+            metadata=list(metadata),
+            vectors=np.ascontiguousarray(_normalize(vectors)),
+            loaded_at=time.monotonic(),
+            hashes=_hashes(metadata),
+            hashed=_hashed(metadata),
+        )
+
+    @property
+    def nbytes(self) -> int:
+        return self.vectors.nbytes + self.hashes.nbytes + self.hashed.nbytes
+
+    def query(self, queries: np.ndarray, top_k: int = TOP_K) -> list[list[dict]]:
+        """Answer all the queries with a single matrix multiplication (cosine similarity)."""
+        if len(self.ids) == 0:
+            return [[] for _ in queries]
+        scores = _normalize(queries) @ self.vectors.T
+        k = min(top_k, len(self.ids))
+        results = []
+        for row in scores:
+            best = np.argpartition(-row, k - 1)[:k]
+            best = best[np.argsort(-row[best], kind="stable")]
+            results.append(
+                [
+                    {"id": self.ids[i], "score": float(row[i]), "metadata": self.metadata[i]}
+                    for i in best
+                ]
+            )
+        return results
+
+    def find_near_duplicate(
+        self, query: str, max_distance: int, top_k: int = TOP_K
+    ) -> list[dict] | None:
+        """Return the matches of the image with the closest hash, if within max_distance bits.
+
+        The stored vector of that image is searched in place of the embedding of the query, so
+        the matches are the usual TOP_K on the cosine scale, with the duplicate ranked first.
+        """
+        if not self.hashed.any():
+            return None
+        distances = hamming_distances(self.hashes, query)
+        distances[~self.hashed] = HASH_BITS + 1
+        best = int(np.argmin(distances))
+        if distances[best] > max_distance:
+            return None
+        matches = self.query(self.vectors[best : best + 1], top_k + 1)[0]
+        duplicate = next(match for match in matches if match["id"] == self.ids[best])
+        others = [match for match in matches if match["id"] != self.ids[best]]
+        return [duplicate, *others][:top_k]
+
+    def upsert(self, vector_id: str, values: list[float], metadata: dict) -> "UserWorkingSet":
+        """Return a copy with the vector added, or replaced if the id is already there."""
+        vector = _normalize(np.asarray(values, dtype=np.float32).reshape(1, VECTOR_SIZE))
+        if vector_id not in self.ids:
+            return replace(
+                self,
+                ids=[*self.ids, vector_id],
+                metadata=[*self.metadata, metadata],
+                vectors=np.concatenate((self.vectors, vector)),
+                hashes=np.concatenate((self.hashes, _hashes([metadata]))),
+                hashed=np.concatenate((self.hashed, _hashed([metadata]))),
+            )
+        row = self.ids.index(vector_id)
+        changed = replace(
+            self,
+            metadata=[*self.metadata[:row], metadata, *self.metadata[row + 1 :]],
+            vectors=self.vectors.copy(),
+            hashes=self.hashes.copy(),
+            hashed=self.hashed.copy(),
+        )
+        changed.vectors[row] = vector[0]
+        changed.hashes[row] = _hashes([metadata])[0]
+        changed.hashed[row] = _hashed([metadata])[0]
+        return changed
+
+    def remove(self, name: str) -> "UserWorkingSet":
+        """Return a copy without the image, or this one if it is not there."""
+        keep = [i for i, metadata in enumerate(self.metadata) if metadata.get("name") != name]
+        if len(keep) == len(self.ids):
+            return self
+        return replace(
+            self,
+            ids=[self.ids[i] for i in keep],
+            metadata=[self.metadata[i] for i in keep],
+            vectors=np.ascontiguousarray(self.vectors[keep]),
+            hashes=self.hashes[keep],
+            hashed=self.hashed[keep],
+        )
+
+
+class UserVectorCache:
+    """LRU cache with the working set of the most recent users, bounded in bytes.
+
+    Queries of a cached user are answered in memory, so they don't depend on the vector store.
+    The scores are the cosine similarity, which is the metric of the Pinecone index. The saves
+    and removals of this process replace the cached sets, the ones made by other
+    workers are picked up once the entry is older than `user_cache_ttl_seconds`.
+    """
+
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+            cls._instance._initialize()
+        return cls._instance
+
+    def _initialize(self):
+        self.enabled: bool = settings.user_cache_enabled
+        self.max_bytes: int = settings.user_cache_max_bytes
+        self.ttl: float = settings.user_cache_ttl_seconds
+        self._entries: OrderedDict[str, UserWorkingSet] = OrderedDict()
+        self._lock = threading.RLock()
+        self._loading: dict[str, threading.Lock] = {}
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def nbytes(self) -> int:
+        return sum(entry.nbytes for entry in self._entries.values())
+
+    def query_many(self, user_id: str, vectors: list[list[float]]) -> list[list]:
+        """Return the TOP_K matches of every vector inside the collection of the user."""
+        working_set = self._get(user_id) if self.enabled else None
+        if working_set is None:
+            return get_vector_store().query_many_with_metadata(
+                vectors=vectors, metadata={"user_id": user_id}
+            )
+        return working_set.query(np.asarray(vectors, dtype=np.float32))
+
+    def find_near_duplicates(self, user_id: str, queries: list[str]) -> list[list[dict] | None]:
+        """Return, for every query, the matches of the saved image whose hash is almost it.
+
+        Only the users that can be cached are searched, for the others the hashes would have
+        to be fetched on every call and the model is cheaper.
+
+        Args:
+        ----
+            user_id: The user.
+            queries: The dHash of every masked image.
+
+        Returns:
+        -------
+            For every query, the TOP_K matches with the near duplicate first, or None.
+
+        """
+        if not (self.enabled and settings.near_duplicate_enabled):
+            return [None] * len(queries)
+        working_set = self._get(user_id)
+        if working_set is None:
+            return [None] * len(queries)
+        return [
+            working_set.find_near_duplicate(query, settings.near_duplicate_max_distance)
+            for query in queries
+        ]
+
+    def upsert(self, user_id: str, vector_id: str, values: list[float], metadata: dict) -> None:
+        """Add a vector to the working set of the user, if it is cached."""
+        with self._lock:
+            working_set = self._entries.get(user_id)
+            if working_set is not None:
+                self._entries[user_id] = working_set.upsert(vector_id, values, metadata)
+                self._evict()
+
+    def remove(self, user_id: str, name: str) -> None:
+        """Remove an image from the working set of the user, if it is cached."""
+        with self._lock:
+            working_set = self._entries.get(user_id)
+            if working_set is not None:
+                self._entries[user_id] = working_set.remove(name)
+
+    def invalidate(self, user_id: str | None = None) -> None:
+        with self._lock:
+            if user_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(user_id, None)
+
+    def _get(self, user_id: str) -> UserWorkingSet | None:
+        with self._lock:
+            working_set = self._fresh_entry(user_id)
+            if working_set is not None:
+                self.hits += 1
+                return working_set
+            loading = self._loading.setdefault(user_id, threading.Lock())
+
+        # Only one thread loads a user, the others wait for it and use its result
+        with loading:
+            with self._lock:
+                working_set = self._fresh_entry(user_id)
+                if working_set is not None:
+                    self.hits += 1
+                    return working_set
+                self.misses += 1
+            try:
+                working_set = self._load(user_id)
+                with self._lock:
+                    if working_set.nbytes <= self.max_bytes:
+                        self._entries[user_id] = working_set
+                        self._evict()
+            finally:
+                # A failed load is tried again by the next call
+                with self._lock:
+                    self._loading.pop(user_id, None)
+        return working_set
+
+    def _fresh_entry(self, user_id: str) -> UserWorkingSet | None:
+        working_set = self._entries.get(user_id)
+        if working_set is None:
+            return None
+        if time.monotonic() - working_set.loaded_at > self.ttl:
+            del self._entries[user_id]
+            return None
+        self._entries.move_to_end(user_id)
+        return working_set
+
+    @staticmethod
+    def _load(user_id: str) -> UserWorkingSet:
+        return UserWorkingSet.from_values(*get_vector_store().fetch_user_vectors(user_id))
+
+    def _evict(self) -> None:
+        total = self.nbytes
+        while total > self.max_bytes and self._entries:
+            _, evicted = self._entries.popitem(last=False)
+            total -= evicted.nbytes
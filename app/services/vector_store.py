@@ -0,0 +1,106 @@
+import uuid
+from abc import ABC, abstractmethod
+
+from app.config import Settings
+
+settings = Settings()
+
+TOP_K = 9
+
+VECTOR_SIZE: int = 576
+EMPTY_VECTOR: list[float] = VECTOR_SIZE * [0.1]
+
+
+class VectorStore(ABC):
+    """Where the vectors of the caps are saved and searched.
+
+    The matches returned by the queries can be indexed as dictionaries with the keys
+    id, score and metadata, like the ones returned by Pinecone.
+    """
+
+    @staticmethod
+    def build_vector_id(user_id: str, name: str) -> str:
+        """Build the id of the vector of an image, the same image always gets the same id.
+
+        The ids start with the user_id, so all the vectors of a user can be listed by prefix.
+        """
+        name_id = uuid.uuid5(uuid.NAMESPACE_URL, f"{user_id}/{name}")
+        return f"{VectorStore.build_vector_prefix(user_id)}{name_id}"
+
+    @staticmethod
+    def build_vector_prefix(user_id: str) -> str:
+        return f"{user_id}#"
+
+    @abstractmethod
+    def query_database(self, vector: list[float]) -> list:
+        """Query the whole database without any filter."""
+
+    @abstractmethod
+    def query_with_metadata(self, vector: list[float], metadata: dict) -> list:
+        """Query the TOP_K closest vectors whose metadata matches the filter."""
+
+    def query_many_with_metadata(self, vectors: list[list[float]], metadata: dict) -> list[list]:
+        """Query multiple vectors with the same filter, the results keep the order."""
+        return [self.query_with_metadata(vector, metadata) for vector in vectors]
+
+    def upsert_into_pinecone(self, vector_id: str, values: list[float], metadata: dict) -> None:
+        cap = {"id": vector_id, "values": values, "metadata": metadata}
+        return self.upsert_dict_pinecone(cap)
+
+    def upsert_dict_pinecone(self, cap_info: dict) -> None:
+        """Upsert dictionary into the vector store.
+
+        Args:
+        ----
+            cap_info (dict): The dictionary can contain the following keys: id, values, metadata.
+
+        """
+        self.upsert_multiple_pinecone([cap_info])
+
+    @abstractmethod
+    def fetch_user_vectors(self, user_id: str) -> tuple[list[str], list[dict], list]:
+        """Fetch all the vectors of a user as (ids, metadata, values), empty lists if none."""
+
+    @abstractmethod
+    def fetch_metadata(self, names: list[str], user_id: str) -> dict[str, dict]:
+        """Fetch the metadata of the images of a user by name, the missing ones are left out."""
+
+    @abstractmethod
+    def upsert_multiple_pinecone(self, vectors: list[dict]) -> None:
+        """Upsert multiple dictionaries with the keys id, values and metadata."""
+
+    @abstractmethod
+    def remove_vector(self, name: str, user_id: str) -> None:
+        """Remove the vector of an image, removing one that does not exist does nothing."""
+
+    def remove_vectors(self, names: list[str], user_id: str) -> None:
+        """Remove the vectors of multiple images, the stores override it with one request."""
+        for name in names:
+            self.remove_vector(name=name, user_id=user_id)
+
+    @abstractmethod
+    def empty_index(self) -> None:
+        """Remove all the vectors."""
+
+    def persist(self) -> None:  # noqa: B027
+        """Save the vectors to disk, only needed for the local backends."""
+
+
+def get_vector_store() -> VectorStore:
+    """Return the vector store configured in `Settings.vector_store`."""
+    if settings.vector_store == "local":
+        from app.services.local_vector_store import LocalVectorStore
+
+        return LocalVectorStore()
+
+    from app.services.pinecone_container import PineconeContainer
+
+    return PineconeContainer()
+
+
+def close_vector_store() -> None:
+    """Persist the local vector store if it was used."""
+    from app.services.local_vector_store import LocalVectorStore
+
+    if LocalVectorStore._instance is not None:
+        LocalVectorStore._instance.persist()
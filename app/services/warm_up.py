@@ -0,0 +1,78 @@
+import asyncio
+import time
+
+import numpy as np
+from loguru import logger
+
+from app.config import Settings
+from app.shared.executors import run_in_thread, run_io, run_on_image, run_storage
+
+settings = Settings()
+
+# A gray square bigger than the crops, it goes through the resize path of the preprocessing
+DUMMY_IMAGE: np.ndarray = np.full((300, 300, 3), 127, dtype=np.uint8)
+
+
+class WarmUp:
+    """Initialize the singletons and run a first inference before the worker takes traffic.
+
+    `/ready` answers 503 until it has finished, so the load balancer keeps sending the requests
+    to the warm workers while a new one loads the model, spawns the detection processes and
+    opens the connections to the vector store and Firebase.
+    """
+
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+            cls._instance._initialize()
+        return cls._instance
+
+    def _initialize(self):
+        self.ready: bool = False
+        self.error: str | None = None
+        self.seconds: float | None = None
+        self.task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        """Run the warm-up in the background, the startup of the server doesn't wait for it."""
+        if not settings.warm_up_on_startup:
+            self.ready = True
+        elif self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    async def run(self) -> None:
+        from app.services.detect.manager import detect_rectangles
+        from app.services.firebase_container import FirebaseContainer
+        from app.services.identify.batcher import EmbeddingBatcher
+        from app.services.identify.image_vectorizer import ImageVectorizer
+        from app.services.vector_store import get_vector_store
+
+        started = time.perf_counter()
+        try:
+            await asyncio.gather(
+                run_on_image(detect_rectangles, DUMMY_IMAGE),
+                run_io(get_vector_store),
+                run_storage(FirebaseContainer),
+            )
+            # Without initialize_model the vectorizer has no model, as in the tests
+            if settings.initialize_model:
+                await run_in_thread(ImageVectorizer)
+                await EmbeddingBatcher().embed(DUMMY_IMAGE)
+        except Exception as e:  # noqa: BLE001
+            logger.exception("The warm-up failed.")
+            self.error = f"{type(e).__name__}: {e!s}"
+            return
+        self.seconds = time.perf_counter() - started
+        self.ready = True
+        logger.info(f"Warm-up finished in {self.seconds:.2f}s.")
+
+    async def close(self) -> None:
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+        self.task = None
+
+    def get_status(self) -> dict:
+        return {"ready": self.ready, "warm_up_seconds": self.seconds, "error": self.error}
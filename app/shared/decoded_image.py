@@ -0,0 +1,48 @@
+import threading
+from collections.abc import Callable
+
+import cv2
+import numpy as np
+
+from app.shared.metrics import time_stage
+from app.shared.utils import apply_mask, resize_to_max_size
+
+
+class DecodedImage:
+    """An uploaded image that is decoded once and shared by every stage of a request.
+
+    The decoded pixels and the forms derived from them are computed on first use and cached:
+    the masked image for the embedding and the image resized to MAX_SIZE for the storage. The
+    methods block, run them with `run_in_thread`. The 224 tensor is not cached, the embedding
+    batcher writes it straight into the buffer of the batch.
+    """
+
+    def __init__(self, data: bytes):
+        self.data = data
+        self._forms: dict[str, np.ndarray] = {}
+        self._lock = threading.RLock()
+
+    def _cached(self, form: str, build: Callable[[], np.ndarray]) -> np.ndarray:
+        with self._lock:
+            if form not in self._forms:
+                self._forms[form] = build()
+            return self._forms[form]
+
+    def decoded(self) -> np.ndarray:
+        """Return the BGR pixels of the image."""
+        return self._cached("decoded", self._decode)
+
+    def masked(self) -> np.ndarray:
+        """Return the image with the background around the cap in black, what is embedded."""
+        return self._cached("masked", lambda: apply_mask(self.decoded()))
+
+    def resized(self) -> np.ndarray:
+        """Return the image with its longest side reduced to MAX_SIZE, what is stored."""
+        return self._cached("resized", lambda: resize_to_max_size(self.decoded()))
+
+    @time_stage("decode")
+    def _decode(self) -> np.ndarray:
+        image = cv2.imdecode(np.frombuffer(self.data, np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            raise TypeError("Failed to load image. Ensure the file is a valid image format.")
+        return image
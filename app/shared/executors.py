@@ -0,0 +1,163 @@
+import asyncio
+import functools
+import multiprocessing
+from collections.abc import Callable
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+from multiprocessing import shared_memory
+from typing import Any, TypeVar
+
+import cv2
+import numpy as np
+
+from app.config import Settings
+from app.shared.metrics import collect_stages, observe_stage
+
+settings = Settings()
+
+T = TypeVar("T")
+
+_executors: dict[str, Executor] = {}
+
+
+@dataclass(frozen=True)
+class SharedImageHandle:
+    """What is sent to the worker processes instead of the pixels of the image."""
+
+    name: str
+    shape: tuple[int, ...]
+    dtype: str
+
+
+def _init_process_worker() -> None:
+    # Every process already runs in parallel, avoid oversubscribing the cores
+    cv2.setNumThreads(1)
+
+
+def get_process_executor() -> Executor:
+    """Return the executor for the CPU-bound work that holds the GIL (OpenCV, k-means).
+
+    It is a process pool when `detect_executor` is "process" and a thread pool otherwise.
+    """
+    if "process" not in _executors:
+        if settings.detect_executor == "process":
+            _executors["process"] = ProcessPoolExecutor(
+                max_workers=settings.detect_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_process_worker,
+            )
+        else:
+            _executors["process"] = ThreadPoolExecutor(
+                max_workers=settings.detect_workers, thread_name_prefix="detect"
+            )
+    return _executors["process"]
+
+
+def get_thread_executor() -> Executor:
+    """Return the executor for the CPU-bound work that releases the GIL (decoding, torch)."""
+    if "thread" not in _executors:
+        _executors["thread"] = ThreadPoolExecutor(
+            max_workers=settings.cpu_thread_workers, thread_name_prefix="cpu"
+        )
+    return _executors["thread"]
+
+
+def get_io_executor() -> Executor:
+    """Return the executor for the blocking network calls (Pinecone, Firebase)."""
+    if "io" not in _executors:
+        _executors["io"] = ThreadPoolExecutor(
+            max_workers=settings.io_workers, thread_name_prefix="io"
+        )
+    return _executors["io"]
+
+
+def get_storage_executor() -> Executor:
+    """Return the executor of the Firebase storage calls.
+
+    The uploads are slow and big, on their own executor they don't starve the vector store
+    queries of the io executor.
+    """
+    if "storage" not in _executors:
+        _executors["storage"] = ThreadPoolExecutor(
+            max_workers=settings.storage_workers, thread_name_prefix="storage"
+        )
+    return _executors["storage"]
+
+
+def shutdown_executors() -> None:
+    """Stop all the executors, they are created again on the next use."""
+    for executor in _executors.values():
+        executor.shutdown(wait=False, cancel_futures=True)
+    _executors.clear()
+
+
+async def run_in_thread(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Run a function that releases the GIL outside the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        get_thread_executor(), functools.partial(func, *args, **kwargs)
+    )
+
+
+async def run_io(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Run a blocking network call outside the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_io_executor(), functools.partial(func, *args, **kwargs))
+
+
+async def run_storage(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Run a blocking Firebase storage call outside the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        get_storage_executor(), functools.partial(func, *args, **kwargs)
+    )
+
+
+async def run_on_image(func: Callable[..., T], image: np.ndarray, *args: Any) -> T:
+    """Run `func(image, *args)` in the process executor.
+
+    When the executor is a process pool the image is copied once into shared memory and the
+    worker maps it, instead of pickling the pixels through the pipe. `func` must be a module
+    level function and its result should be small (e.g. positions, not images). The timings of
+    its stages come back with the result and are observed in this process.
+    """
+    if settings.detect_executor == "inline":
+        return func(image, *args)
+
+    loop = asyncio.get_running_loop()
+    executor = get_process_executor()
+    if not isinstance(executor, ProcessPoolExecutor):
+        return await loop.run_in_executor(executor, functools.partial(func, image, *args))
+
+    shm = shared_memory.SharedMemory(create=True, size=max(image.nbytes, 1))
+    try:
+        shared = np.ndarray(image.shape, dtype=image.dtype, buffer=shm.buf)
+        shared[...] = image
+        handle = SharedImageHandle(name=shm.name, shape=image.shape, dtype=image.dtype.str)
+        del shared
+        result, stages = await loop.run_in_executor(
+            executor, functools.partial(_call_with_shared_image, func, handle, *args)
+        )
+    finally:
+        shm.close()
+        shm.unlink()
+    for stage, seconds in stages:
+        observe_stage(stage, seconds)
+    return result
+
+
+def _call_with_shared_image(
+    func: Callable[..., T], handle: SharedImageHandle, *args: Any
+) -> tuple[T, list[tuple[str, float]]]:
+    # The spawned workers share the resource tracker of the parent, which unlinks the block
+    shm = shared_memory.SharedMemory(name=handle.name)
+    try:
+        image = np.ndarray(handle.shape, dtype=np.dtype(handle.dtype), buffer=shm.buf)
+        try:
+            with collect_stages() as stages:
+                result = func(image, *args)
+            return result, stages
+        finally:
+            del image
+    finally:
+        shm.close()
@@ -0,0 +1,166 @@
+import functools
+import os
+import time
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Histogram,
+    generate_latest,
+)
+from prometheus_client.multiprocess import MultiProcessCollector
+
+# The stages are a few ms (a resize) to a few hundred ms (a forward pass of a big batch)
+STAGE_BUCKETS: tuple[float, ...] = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+)
+CALL_BUCKETS: tuple[float, ...] = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CAPS_BUCKETS: tuple[float, ...] = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55)
+BYTES_BUCKETS: tuple[float, ...] = tuple(1024 * 2**power for power in range(13))  # 1KB to 4MB
+
+STAGE_SECONDS = Histogram(
+    "bottle_caps_stage_seconds",
+    "Time of every CPU stage of the pipeline.",
+    ["stage"],
+    buckets=STAGE_BUCKETS,
+)
+EXTERNAL_CALL_SECONDS = Histogram(
+    "bottle_caps_external_call_seconds",
+    "Time of every call to Pinecone and Firebase, errors included.",
+    ["service", "operation"],
+    buckets=CALL_BUCKETS,
+)
+CAPS_PER_IMAGE = Histogram(
+    "bottle_caps_caps_per_image",
+    "Caps detected in every image.",
+    buckets=CAPS_BUCKETS,
+)
+UPLOAD_BYTES = Histogram(
+    "bottle_caps_upload_bytes",
+    "Size of every file uploaded to Firebase, once encoded.",
+    ["kind"],
+    buckets=BYTES_BUCKETS,
+)
+
+
+# The timings of the stages run by a worker of the process pool, sent back with its result
+_collected_stages: ContextVar[list[tuple[str, float]] | None] = ContextVar(
+    "collected_stages", default=None
+)
+
+
+class _StageTimer:
+    def __init__(self, stage: str):
+        self.stage = stage
+
+    def __enter__(self) -> "_StageTimer":
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        observe_stage(self.stage, time.perf_counter() - self._start)
+
+    def __call__(self, func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapped(*args, **kwargs):
+            # A new timer for every call, the calls may run at the same time
+            with _StageTimer(self.stage):
+                return func(*args, **kwargs)
+
+        return wrapped
+
+
+def time_stage(stage: str) -> _StageTimer:
+    """Time a stage, as a decorator or as a context manager.
+
+    Args:
+    ----
+        stage: The name of the stage, the label of the histogram.
+
+    Returns:
+    -------
+        The timer of the stage.
+
+    """
+    return _StageTimer(stage)
+
+
+def observe_stage(stage: str, seconds: float) -> None:
+    """Observe the time of a stage, or keep it when the stages are being collected."""
+    collected = _collected_stages.get()
+    if collected is None:
+        STAGE_SECONDS.labels(stage).observe(seconds)
+    else:
+        collected.append((stage, seconds))
+
+
+@contextmanager
+def collect_stages() -> Iterator[list[tuple[str, float]]]:
+    """Keep the timings of the stages instead of observing them.
+
+    The metrics of a worker process are lost unless PROMETHEUS_MULTIPROC_DIR is set, the
+    process pool returns the timings with the result and the parent observes them.
+
+    Returns
+    -------
+        The list of (stage, seconds), filled when the block exits.
+
+    """
+    collected: list[tuple[str, float]] = []
+    token = _collected_stages.set(collected)
+    try:
+        yield collected
+    finally:
+        _collected_stages.reset(token)
+
+
+def time_call(service: str, operation: str):
+    """Time a call to Pinecone or Firebase, as a decorator or as a context manager.
+
+    Args:
+    ----
+        service: pinecone or firebase.
+        operation: The operation, e.g. query or upload.
+
+    Returns:
+    -------
+        The timer of the histogram.
+
+    """
+    return EXTERNAL_CALL_SECONDS.labels(service, operation).time()
+
+
+def render_metrics() -> tuple[bytes, str]:
+    """Export the metrics in the text format of Prometheus.
+
+    With several workers every process has its own metrics. When PROMETHEUS_MULTIPROC_DIR is
+    set, before the server starts and empty, all the processes write their metrics there and
+    this merges them, whatever worker answers. The detection pool sends its timings back to
+    the worker that called it, it doesn't need the folder.
+
+    Returns
+    -------
+        The body and its content type.
+
+    """
+    if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+        return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+    registry = CollectorRegistry()
+    MultiProcessCollector(registry)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,52 @@
+import cv2
+import numpy as np
+
+HASH_SIZE: int = 8
+HASH_BITS: int = HASH_SIZE * HASH_SIZE
+
+# Number of bits set in every byte, numpy has no popcount before 2.0
+_POPCOUNT: np.ndarray = np.array([byte.bit_count() for byte in range(256)], dtype=np.uint8)
+
+
+def dhash(image: np.ndarray) -> str:
+    """Compute the 64-bit difference hash of a masked cap.
+
+    The image is reduced to a 9x8 grayscale thumbnail and every bit says whether a pixel is
+    brighter than its right neighbour, so the hash doesn't change with the size, the
+    compression or small changes of light of another photo of the same cap.
+
+    Args:
+    ----
+        image: The BGR image, already masked.
+
+    Returns:
+    -------
+        The hash as 16 hexadecimal characters, the metadata of Pinecone can't keep 64-bit ints.
+
+    """
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(gray, (HASH_SIZE + 1, HASH_SIZE), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return np.packbits(bits).tobytes().hex()
+
+
+def hamming_distances(hashes: np.ndarray, query: str) -> np.ndarray:
+    """Count the bits that differ between every hash and the query.
+
+    Args:
+    ----
+        hashes: The hashes as an array of uint64.
+        query: The hash to compare, as returned by `dhash`.
+
+    Returns:
+    -------
+        The distance to every hash, from 0 (same hash) to 64.
+
+    """
+    differences = np.bitwise_xor(hashes, hash_to_int(query)).view(np.uint8)
+    return _POPCOUNT[differences].reshape(-1, HASH_BITS // 8).sum(axis=1, dtype=np.int64)
+
+
+def hash_to_int(value: str) -> np.uint64:
+    """Parse a hash returned by `dhash`."""
+    return np.uint64(int(value, 16))
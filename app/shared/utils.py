@@ -1,5 +1,6 @@
 from io import BytesIO
 from pathlib import Path
+from typing import IO
 
 import aiofiles
 import cv2
@@ -7,8 +8,15 @@ import numpy as np
 import starlette.datastructures
 from fastapi import UploadFile
 
-SIFT = cv2.SIFT_create()
 MAX_SIZE: int = 256
+PNG_COMPRESSION: int = 3
+
+# Extension, content type and quality flag of every storage format
+IMAGE_ENCODINGS: dict[str, tuple[str, str, int]] = {
+    "jpeg": (".jpg", "image/jpeg", cv2.IMWRITE_JPEG_QUALITY),
+    "webp": (".webp", "image/webp", cv2.IMWRITE_WEBP_QUALITY),
+    "png": (".png", "image/png", cv2.IMWRITE_PNG_COMPRESSION),
+}
 
 
 def _get_name_from_path(path: str) -> str:
@@ -30,6 +38,21 @@ def read_img_from_path_with_mask(img_path: str) -> np.ndarray:
     return apply_mask(cv2.imread(img_path))
 
 
+def read_img_from_bytes_with_mask(file: bytes) -> np.ndarray:
+    """Decode the raw bytes of an image of a cap and apply a black mask to it.
+
+    Args:
+    ----
+        file (bytes): The encoded image.
+
+    Returns:
+    -------
+        The ndarray of the mask.
+
+    """
+    return apply_mask(cv2.imdecode(np.frombuffer(file, np.uint8), cv2.IMREAD_COLOR))
+
+
 def apply_mask(image: np.ndarray) -> np.ndarray:
     """Apply a mask of the ndarray cap, basically removing the background of the bottle-cap.
 
@@ -117,6 +140,28 @@ async def upload_file(path: Path) -> UploadFile:
         return UploadFile(filename=str(path), file=BytesIO(file_contents))
 
 
+def detach_upload_files(files: list[UploadFile]) -> list[tuple[str, IO[bytes]]]:
+    """Take over the files of the uploads, to read them while the response is streamed.
+
+    FastAPI closes the uploads when the endpoint returns, before a streaming response is sent,
+    so they are replaced by empty buffers and the caller must close the returned files.
+
+    Args:
+    ----
+        files (list[UploadFile]): The uploaded files.
+
+    Returns:
+    -------
+    The filename and the file of every upload.
+
+    """
+    detached = []
+    for upload in files:
+        detached.append((upload.filename or "", upload.file))
+        upload.file = BytesIO()
+    return detached
+
+
 def resize_image_max_size(image: np.ndarray | UploadFile | bytes) -> np.ndarray:
     """Resize the image so its maximum dimension (width or height) is less than or equal to 512.
 
@@ -135,7 +180,11 @@ def resize_image_max_size(image: np.ndarray | UploadFile | bytes) -> np.ndarray:
     image = cv2.imdecode(image_array, cv2.IMREAD_COLOR)
     if image is None:
         raise TypeError("Failed to load image. Ensure the file is a valid image format.")
+    return resize_to_max_size(image)
+
 
+def resize_to_max_size(image: np.ndarray) -> np.ndarray:
+    """Resize a decoded image so its longest side is at most MAX_SIZE."""
     height, width = image.shape[:2]
     max_dimension = max(height, width)
 
@@ -146,3 +195,61 @@ def resize_image_max_size(image: np.ndarray | UploadFile | bytes) -> np.ndarray:
         return cv2.resize(image, (new_width, new_height), interpolation=cv2.INTER_AREA)
 
     return image
+
+
+def image_extension(image_format: str) -> str:
+    """Return the file extension of a storage format, e.g. ".jpg" for jpeg."""
+    return IMAGE_ENCODINGS[image_format][0]
+
+
+def encode_image(image: np.ndarray, image_format: str, quality: int) -> tuple[bytes, str]:
+    """Encode an image to store it.
+
+    Args:
+    ----
+        image: The BGR image.
+        image_format: jpeg, webp or png.
+        quality: The quality of jpeg and webp, from 0 to 100, png is always lossless.
+
+    Returns:
+    -------
+        The encoded bytes and their content type.
+
+    """
+    extension, content_type, flag = IMAGE_ENCODINGS[image_format]
+    params = [flag, PNG_COMPRESSION if image_format == "png" else quality]
+    if image_format == "jpeg":
+        params += [cv2.IMWRITE_JPEG_OPTIMIZE, 1]
+    success, encoded = cv2.imencode(extension, image, params)
+    if not success:
+        raise ValueError(f"Failed to encode the image as {image_format}.")
+    return encoded.tobytes(), content_type
+
+
+def build_thumbnails(image: np.ndarray, sizes: list[int]) -> dict[int, np.ndarray]:
+    """Resize an image to every size of a pyramid, keeping its aspect ratio.
+
+    The biggest thumbnail is resized from the image and every smaller one from the previous,
+    so the pixels of the image are only read once. Sizes bigger than the image are skipped.
+
+    Args:
+    ----
+        image: The image.
+        sizes: The longest side of every thumbnail.
+
+    Returns:
+    -------
+        The thumbnails by size.
+
+    """
+    thumbnails: dict[int, np.ndarray] = {}
+    source = image
+    for size in sorted(set(sizes), reverse=True):
+        height, width = source.shape[:2]
+        if size >= max(image.shape[:2]):
+            continue
+        scale = size / max(height, width)
+        new_size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        source = cv2.resize(source, new_size, interpolation=cv2.INTER_AREA)
+        thumbnails[size] = source
+    return thumbnails
@@ -0,0 +1,114 @@
+import argparse
+import json
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+from loguru import logger
+
+from app.services.detect import blobs
+from app.services.detect.blobs import PREPO_convolution_size, PREPO_number_of_levels
+from app.services.detect.manager import detect_rectangles
+from benchmarks.synthetic import synthetic_caps_image
+
+IMAGES: list[str] = ["tests/services/test_image.jpg"]
+IOU_MATCH: float = 0.5
+
+
+def _iou(a: tuple, b: tuple) -> float:
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    width = max(0, min(ax + aw, bx + bw) - max(ax, bx))
+    height = max(0, min(ay + ah, by + bh) - max(ay, by))
+    intersection = width * height
+    return intersection / (aw * ah + bw * bh - intersection)
+
+
+def detection_agreement(exact: list[tuple], fast: list[tuple]) -> float:
+    """F1 of the rectangles of the fast mode against the exact ones, matched with IoU >= 0.5."""
+    if not exact and not fast:
+        return 1.0
+    unmatched = list(exact)
+    matched = 0
+    for rectangle in fast:
+        best = max(unmatched, key=lambda other: _iou(rectangle, other), default=None)
+        if best is not None and _iou(rectangle, best) >= IOU_MATCH:
+            unmatched.remove(best)
+            matched += 1
+    return 2 * matched / (len(exact) + len(fast))
+
+
+def pixel_agreement(exact: np.ndarray, fast: np.ndarray) -> float:
+    """Fraction of the pixels quantized to the same color, centers paired by brightness.
+
+    Both images are reduced to the rank of the brightness of their colors, the fast centers
+    are not the same floats as the exact ones.
+    """
+
+    def ranks(image: np.ndarray) -> np.ndarray:
+        colors, inverse = np.unique(image.reshape(-1, 3), axis=0, return_inverse=True)
+        order = np.argsort(np.argsort(colors.astype(np.int32).sum(axis=1)))
+        return order[inverse.ravel()]
+
+    return float(np.mean(ranks(exact) == ranks(fast)))
+
+
+def _time(func, repeat: int) -> tuple[float, object]:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        result = func()
+    return (time.perf_counter() - started) / repeat, result
+
+
+def benchmark_image(image: np.ndarray, repeat: int) -> dict:
+    """Compare the exact and the fast quantization on one image."""
+    blurred = cv2.GaussianBlur(image, (PREPO_convolution_size, PREPO_convolution_size), 0)
+    result: dict = {"shape": list(image.shape)}
+    quantized, rectangles = {}, {}
+    for mode in ("exact", "fast"):
+        seconds, quantized[mode] = _time(
+            lambda mode=mode: blobs.reduce_colors_images(blurred, PREPO_number_of_levels, mode),
+            repeat,
+        )
+        blobs.settings.quantization_mode = mode
+        detect_seconds, rectangles[mode] = _time(lambda: detect_rectangles(image), repeat)
+        result[mode] = {"quantize_ms": 1000 * seconds, "detect_ms": 1000 * detect_seconds}
+    result["detections"] = {mode: len(found) for mode, found in rectangles.items()}
+    result["speedup"] = result["exact"]["quantize_ms"] / result["fast"]["quantize_ms"]
+    result["pixel_agreement"] = pixel_agreement(quantized["exact"], quantized["fast"])
+    result["detection_agreement"] = detection_agreement(rectangles["exact"], rectangles["fast"])
+    return result
+
+
+def benchmark_quantization(n_synthetic: int, repeat: int) -> dict:
+    """Compare the two modes on the test image and on synthetic images of 1 to 30 caps."""
+    images = [cv2.imread(path) for path in IMAGES if Path(path).exists()]
+    images += [
+        synthetic_caps_image(n_caps=int(n), seed=seed)[0]
+        for seed, n in enumerate(np.linspace(1, 30, n_synthetic))
+    ]
+    mode = blobs.settings.quantization_mode
+    try:
+        results = [benchmark_image(image, repeat) for image in images]
+    finally:
+        blobs.settings.quantization_mode = mode
+    return {
+        "images": results,
+        "mean_speedup": float(np.mean([r["speedup"] for r in results])),
+        "mean_pixel_agreement": float(np.mean([r["pixel_agreement"] for r in results])),
+        "mean_detection_agreement": float(np.mean([r["detection_agreement"] for r in results])),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Exact against fast color quantization.")
+    parser.add_argument("--synthetic", type=int, default=8, help="Synthetic images of caps")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", default=None, help="Write the results as JSON")
+    args = parser.parse_args()
+
+    results = benchmark_quantization(args.synthetic, args.repeat)
+    logger.info(json.dumps(results, indent=2))
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2))
@@ -0,0 +1,260 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from collections.abc import Callable
+from datetime import UTC, datetime
+from pathlib import Path
+from unittest.mock import patch
+
+import cv2
+import numpy as np
+from loguru import logger
+
+from app.config import Settings
+from app.services.detect.blobs import (
+    PREPO_convolution_size,
+    PREPO_number_of_levels,
+    get_avg_size_all_blobs,
+    reduce_colors_images,
+)
+from app.services.detect.htc import hough_transform_circle
+from app.services.detect.manager import detect_caps, preprocess_image_size
+from app.services.vector_store import VECTOR_SIZE, VectorStore
+from app.shared.utils import apply_mask
+from benchmarks.synthetic import BACKGROUNDS, synthetic_caps_image
+
+settings = Settings()
+
+DEFAULT_RESOLUTIONS: list[str] = ["640x480", "1600x1200", "4000x3000"]
+DEFAULT_CAPS: list[int] = [1, 8, 30]
+HISTORY_PATH: Path = Path("benchmarks/results/history.jsonl")
+BUDGETS_PATH: Path = Path("benchmarks/budgets.json")
+STUB_USER: str = "benchmark_user"
+STUB_COLLECTION_SIZE: int = 2000
+
+
+class StubVectorStore(VectorStore):
+    """In-memory collection of random vectors, the identify flow never leaves the process."""
+
+    def __init__(self, n: int = STUB_COLLECTION_SIZE, seed: int = 0):
+        rng = np.random.default_rng(seed)
+        self.ids = [f"stub-{i}" for i in range(n)]
+        self.metadata = [{"user_id": STUB_USER, "name": f"{i}.jpg"} for i in range(n)]
+        self.values = rng.normal(size=(n, VECTOR_SIZE)).astype(np.float32)
+
+    def query_database(self, vector: list[float]) -> list:  # noqa: ARG002
+        return []
+
+    def query_with_metadata(self, vector: list[float], metadata: dict) -> list:  # noqa: ARG002
+        return []
+
+    def fetch_user_vectors(self, user_id: str) -> tuple[list[str], list[dict], list] | None:  # noqa: ARG002
+        return self.ids, self.metadata, self.values
+
+    def upsert_multiple_pinecone(self, vectors: list[dict]) -> None:
+        pass
+
+    def remove_vector(self, name: str, user_id: str) -> None:
+        pass
+
+    def empty_index(self) -> None:
+        pass
+
+
+def _parse_resolution(resolution: str) -> tuple[int, int]:
+    width, height = (int(v) for v in resolution.lower().split("x"))
+    return height, width
+
+
+def _stats(samples: list[float]) -> dict:
+    values = 1000 * np.asarray(samples)
+    return {
+        "n": len(values),
+        "mean_ms": float(values.mean()),
+        "p50_ms": float(np.percentile(values, 50)),
+        "p95_ms": float(np.percentile(values, 95)),
+    }
+
+
+def _time(samples: list[float], func: Callable, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    samples.append(time.perf_counter() - started)
+    return result
+
+
+def _load_vectorizer():
+    """Return the vectorizer, or None when the model can't be loaded in this environment."""
+    if not settings.initialize_model:
+        return None
+    try:
+        from app.services.identify.image_vectorizer import ImageVectorizer
+
+        return ImageVectorizer()
+    except ImportError as e:
+        logger.warning(f"The vectorizer stages are skipped, the model can't be loaded: {e!s}")
+        return None
+
+
+async def _time_detect_and_identify(encoded: list[bytes], repeat: int) -> list[float]:
+    from app.services.identify.batcher import EmbeddingBatcher
+    from app.services.identify.manager import post_detect_and_identify
+
+    samples: list[float] = []
+    with patch("app.services.user_vector_cache.get_vector_store", return_value=StubVectorStore()):
+        # The first call spawns the detection processes and loads the collection
+        await post_detect_and_identify(encoded[0], STUB_USER)
+        for file_contents in encoded * repeat:
+            started = time.perf_counter()
+            await post_detect_and_identify(file_contents, STUB_USER)
+            samples.append(time.perf_counter() - started)
+    await EmbeddingBatcher().close()
+    return samples
+
+
+def benchmark_resolution(
+    size: tuple[int, int], caps_counts: list[int], repeat: int, vectorizer
+) -> dict[str, dict]:
+    """Time every stage on synthetic photos of one resolution.
+
+    Args:
+    ----
+        size: The (height, width) of the photos.
+        caps_counts: A photo is generated for every number of caps and every background.
+        repeat: How many times every stage runs on every photo.
+        vectorizer: The ImageVectorizer, None skips the stages that need the model.
+
+    Returns:
+    -------
+        The latency statistics of every stage.
+
+    """
+    samples: dict[str, list[float]] = defaultdict(list)
+    encoded = []
+    for seed, (n_caps, background) in enumerate(
+        (n, background) for n in caps_counts for background in BACKGROUNDS
+    ):
+        image, _ = synthetic_caps_image(n_caps, size=size, seed=seed, background=background)
+        encoded.append(cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes())
+
+        for _ in range(repeat):
+            decoded = _time(
+                samples["decode"],
+                cv2.imdecode,
+                np.frombuffer(encoded[-1], np.uint8),
+                cv2.IMREAD_COLOR,
+            )
+            analysis = _time(samples["preprocess_image_size"], preprocess_image_size, decoded)
+            blurred = cv2.GaussianBlur(analysis, (PREPO_convolution_size,) * 2, 0)
+            _time(
+                samples["reduce_colors_images"],
+                reduce_colors_images,
+                blurred,
+                PREPO_number_of_levels,
+            )
+            avg_size = _time(samples["get_avg_size_all_blobs"], get_avg_size_all_blobs, analysis)
+            if avg_size:
+                _time(samples["hough_transform_circle"], hough_transform_circle, analysis, avg_size)
+            caps = _time(samples["detect_caps"], detect_caps, decoded)
+
+        for crop, _ in caps:
+            masked = _time(samples["apply_mask"], apply_mask, crop)
+            if vectorizer is not None:
+                _time(samples["numpy_to_vector"], vectorizer.numpy_to_vector, masked)
+
+    if vectorizer is not None:
+        samples["post_detect_and_identify"] = asyncio.run(
+            _time_detect_and_identify(encoded, repeat)
+        )
+    return {stage: _stats(values) for stage, values in samples.items() if values}
+
+
+def check_budgets(results: dict[str, dict], budgets: dict[str, float]) -> list[str]:
+    """Compare the worst p95 of every stage, over all the resolutions, with its budget in ms."""
+    failures = []
+    for stage, budget in budgets.items():
+        worst = max(
+            (stages[stage]["p95_ms"] for stages in results.values() if stage in stages),
+            default=None,
+        )
+        if worst is not None and worst > budget:
+            failures.append(f"{stage}: p95 {worst:.1f} ms > budget {budget:.1f} ms")
+    return failures
+
+
+def _git_commit() -> str | None:
+    try:
+        completed = subprocess.run(  # noqa: S603
+            ["git", "rev-parse", "--short", "HEAD"],  # noqa: S607
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return completed.stdout.strip()
+
+
+def _load_budgets(path: Path, overrides: list[str]) -> dict[str, float]:
+    budgets = json.loads(path.read_text()) if path.exists() else {}
+    for override in overrides:
+        stage, budget = override.split("=")
+        budgets[stage] = float(budget)
+    return budgets
+
+
+def main() -> None:
+    """Run the offline micro-benchmarks of the detection and identification stages."""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--resolutions", nargs="+", default=DEFAULT_RESOLUTIONS)
+    parser.add_argument("--caps", type=int, nargs="+", default=DEFAULT_CAPS)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--history", type=Path, default=HISTORY_PATH)
+    parser.add_argument("--budgets", type=Path, default=BUDGETS_PATH)
+    parser.add_argument(
+        "--budget", action="append", default=[], help="Override a budget, e.g. detect_caps=300"
+    )
+    args = parser.parse_args()
+
+    vectorizer = _load_vectorizer()
+    results = {}
+    for resolution in args.resolutions:
+        results[resolution] = benchmark_resolution(
+            _parse_resolution(resolution), args.caps, args.repeat, vectorizer
+        )
+        logger.info(f"{resolution}: {json.dumps(results[resolution], indent=2)}")
+
+    failures = check_budgets(results, _load_budgets(args.budgets, args.budget))
+    record = {
+        "timestamp": datetime.now(tz=UTC).isoformat(),
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "settings": {
+            "quantization_mode": settings.quantization_mode,
+            "vectorizer_backend": settings.vectorizer_backend,
+            "detect_executor": settings.detect_executor,
+        },
+        "caps": args.caps,
+        "repeat": args.repeat,
+        "results": results,
+        "budget_failures": failures,
+    }
+    args.history.parent.mkdir(parents=True, exist_ok=True)
+    with args.history.open("a") as history:
+        history.write(json.dumps(record) + "\n")
+
+    for failure in failures:
+        logger.error(f"Over budget, {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
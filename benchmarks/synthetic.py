@@ -0,0 +1,83 @@
+import cv2
+import numpy as np
+
+BACKGROUNDS: list[str] = ["noise", "gradient", "wood", "checker"]
+
+
+def synthetic_background(
+    size: tuple[int, int], kind: str = "noise", rng: np.random.Generator | None = None
+) -> np.ndarray:
+    """Draw the surface the caps lie on: plain noise, a lighting gradient, wood or a tablecloth.
+
+    Args:
+    ----
+        size: The (height, width) of the image.
+        kind: One of BACKGROUNDS.
+        rng: The generator of the noise and the colors.
+
+    Returns:
+    -------
+        The BGR background.
+
+    """
+    rng = rng or np.random.default_rng(0)
+    height, width = size
+    if kind == "noise":
+        image = rng.normal(170, 12, (height, width, 3))
+    else:
+        noise = rng.normal(0, 12, (height, width, 1))
+        base = rng.integers(90, 200, 3)
+    if kind == "gradient":
+        light = np.linspace(0.6, 1.2, width)[None, :] * np.linspace(1.1, 0.8, height)[:, None]
+        image = base * light[..., None] + noise
+    elif kind == "wood":
+        waves = np.arange(height)[:, None] / rng.uniform(6, 14) + 3 * np.sin(np.arange(width) / 90)
+        image = np.array([40, 90, 150]) + 25 * np.sin(waves)[..., None] + noise
+    elif kind == "checker":
+        square = max(8, min(height, width) // 12)
+        cells = (np.arange(height)[:, None] // square + np.arange(width)[None, :] // square) % 2
+        image = np.where(cells[..., None] == 1, base, base * 0.5) + noise
+    return cv2.GaussianBlur(image.clip(0, 255).astype(np.uint8), (7, 7), 0)
+
+
+def synthetic_caps_image(
+    n_caps: int, size: tuple[int, int] = (1000, 1000), seed: int = 0, background: str = "noise"
+) -> tuple[np.ndarray, list[tuple[int, int, int]]]:
+    """Draw a photo-like image of bottle caps over a textured background.
+
+    Every cap is a filled circle with a darker rim and a logo of another color, the caps don't
+    overlap and they have the same radius, as in a photo of a collection.
+
+    Args:
+    ----
+        n_caps: The number of caps, fewer are drawn if they don't fit.
+        size: The (height, width) of the image.
+        seed: The seed of the colors and the positions.
+        background: The kind of background, one of BACKGROUNDS.
+
+    Returns:
+    -------
+        The BGR image and the (x, y, radius) of every cap.
+
+    """
+    rng = np.random.default_rng(seed)
+    height, width = size
+    image = synthetic_background(size, background, rng)
+
+    radius = int(min(height, width) / (2.6 * max(1, np.sqrt(n_caps))))
+    caps: list[tuple[int, int, int]] = []
+    for _ in range(50 * n_caps):
+        if len(caps) == n_caps:
+            break
+        x = int(rng.integers(radius, width - radius))
+        y = int(rng.integers(radius, height - radius))
+        if any((x - cx) ** 2 + (y - cy) ** 2 < (2.1 * radius) ** 2 for cx, cy, _ in caps):
+            continue
+        color = rng.integers(0, 256, 3)
+        rim = tuple(int(c) for c in color * 0.6)
+        cv2.circle(image, (x, y), radius, rim, -1, lineType=cv2.LINE_AA)
+        cv2.circle(image, (x, y), int(radius * 0.85), tuple(int(c) for c in color), -1)
+        logo = tuple(int(c) for c in rng.integers(0, 256, 3))
+        cv2.circle(image, (x, y), int(radius * 0.35), logo, -1, lineType=cv2.LINE_AA)
+        caps.append((x, y, radius))
+    return image, caps
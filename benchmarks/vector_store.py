@@ -0,0 +1,121 @@
+import argparse
+import json
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+from loguru import logger
+
+from app.services.local_vector_store import LocalIndex
+from app.services.vector_store import TOP_K, VECTOR_SIZE
+
+DEFAULT_SIZES: list[int] = [10_000, 100_000, 1_000_000]
+VECTORS_PER_USER: int = 1_000
+N_CLUSTERS: int = 512
+UPSERT_BATCH: int = 10_000
+
+
+def _synthetic_vectors(n: int, rng: np.random.Generator, centers: np.ndarray) -> np.ndarray:
+    """Clustered vectors, closer to the MobileNet embeddings than uniform noise."""
+    labels = rng.integers(0, len(centers), size=n)
+    noise = rng.normal(scale=0.5, size=(n, VECTOR_SIZE)).astype(np.float32)
+    return centers[labels] + noise
+
+
+def _percentiles(samples: list[float]) -> dict:
+    values = 1000 * np.asarray(samples)
+    return {"p50_ms": float(np.percentile(values, 50)), "p95_ms": float(np.percentile(values, 95))}
+
+
+def benchmark_size(n: int, n_queries: int, nprobe: int, seed: int = 0) -> dict:
+    """Build, query, persist and reload a local index of n vectors."""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(N_CLUSTERS, VECTOR_SIZE)).astype(np.float32)
+    index = LocalIndex(nprobe=nprobe)
+
+    started = time.perf_counter()
+    for start in range(0, n, UPSERT_BATCH):
+        size = min(UPSERT_BATCH, n - start)
+        index.upsert(
+            ids=[str(i) for i in range(start, start + size)],
+            vectors=_synthetic_vectors(size, rng, centers),
+            metadata=[
+                {"user_id": f"user-{i // VECTORS_PER_USER}", "name": f"{i}.jpg"}
+                for i in range(start, start + size)
+            ],
+        )
+    upsert_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    index.train()
+    train_seconds = time.perf_counter() - started
+
+    queries = _synthetic_vectors(n_queries, rng, centers)
+    users = [f"user-{u}" for u in rng.integers(0, max(1, n // VECTORS_PER_USER), n_queries)]
+
+    filtered = []
+    for query, user_id in zip(queries, users, strict=True):
+        started = time.perf_counter()
+        index.query(query, top_k=TOP_K, metadata_filter={"user_id": user_id})
+        filtered.append(time.perf_counter() - started)
+
+    unfiltered, recall = [], []
+    exact = LocalIndex(exact_threshold=n)
+    exact._vectors, exact._size, exact._ids = index._vectors, index._size, index._ids
+    exact._metadata, exact._alive, exact._row_of = index._metadata, index._alive, index._row_of
+    for query in queries:
+        started = time.perf_counter()
+        approximate = index.query(query, top_k=TOP_K)[0]
+        unfiltered.append(time.perf_counter() - started)
+        expected = {match["id"] for match in exact.query(query, top_k=TOP_K)[0]}
+        recall.append(len(expected & {match["id"] for match in approximate}) / TOP_K)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        started = time.perf_counter()
+        index.save(Path(tmp_dir))
+        save_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        loaded = LocalIndex.load(Path(tmp_dir), nprobe=nprobe)
+        load_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        loaded.query(queries[0], top_k=TOP_K, metadata_filter={"user_id": users[0]})
+        first_query_seconds = time.perf_counter() - started
+        del loaded
+
+    return {
+        "vectors": n,
+        "upsert_s": upsert_seconds,
+        "train_s": train_seconds,
+        "filtered_query": _percentiles(filtered),
+        "ann_query": _percentiles(unfiltered),
+        "ann_recall_at_k": float(np.mean(recall)),
+        "save_s": save_seconds,
+        "mmap_load_s": load_seconds,
+        "first_query_after_load_ms": 1000 * first_query_seconds,
+    }
+
+
+def main() -> None:
+    """Run the scaling benchmark of the local vector store."""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--nprobe", type=int, default=8)
+    parser.add_argument("--output", type=Path, default=None, help="Save the results as JSON.")
+    args = parser.parse_args()
+
+    results = []
+    for n in args.sizes:
+        result = benchmark_size(n, n_queries=args.queries, nprobe=args.nprobe)
+        logger.info(json.dumps(result))
+        results.append(result)
+
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
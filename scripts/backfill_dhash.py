@@ -0,0 +1,85 @@
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+from fastapi import HTTPException
+from loguru import logger
+
+load_dotenv()
+
+from app.config import Settings
+from app.services.firebase_container import FirebaseContainer
+from app.services.pinecone_container import PineconeContainer
+from app.services.saver.manager import stored_file_name
+from app.shared.decoded_image import DecodedImage
+from app.shared.perceptual_hash import dhash
+
+settings = Settings()
+
+NAMESPACE: str = "bottle-caps"
+
+
+def _hash_stored_image(metadata: dict) -> str | None:
+    file_name = stored_file_name(metadata["name"], metadata)
+    try:
+        data = FirebaseContainer().get_image(file_name, metadata["user_id"])
+        return dhash(DecodedImage(data).masked())
+    except (HTTPException, TypeError) as e:
+        logger.warning(f"Skipping {metadata['user_id']}/{file_name}: {e!s}")
+        return None
+
+
+def backfill_dhash(*, dry_run: bool = False) -> int:
+    """Add the perceptual hash to the metadata of the vectors saved before it existed.
+
+    Every page of ids is fetched, the images of the vectors without a hash are downloaded from
+    Firebase in parallel and hashed, and the vectors are upserted again with the hash. The
+    vectors that have one are skipped, so running it again after a crash is safe. The servers
+    see the hashes once their user working sets expire.
+
+    Args:
+    ----
+        dry_run: Only log how many vectors would be updated.
+
+    Returns:
+    -------
+        The number of vectors updated.
+
+    """
+    pinecone_container: PineconeContainer = PineconeContainer()
+    index = pinecone_container.index
+    updated = 0
+    with ThreadPoolExecutor(max_workers=settings.storage_workers) as executor:
+        for page in index.list(namespace=NAMESPACE):
+            fetched = index.fetch(ids=page, namespace=NAMESPACE)
+            missing = [
+                (vector_id, vector)
+                for vector_id, vector in fetched.vectors.items()
+                if "dhash" not in (vector.metadata or {})
+                and {"user_id", "name"} <= (vector.metadata or {}).keys()
+            ]
+            if dry_run:
+                updated += len(missing)
+                continue
+
+            hashes = executor.map(_hash_stored_image, [vector.metadata for _, vector in missing])
+            vectors = [
+                {
+                    "id": vector_id,
+                    "values": vector.values,  # noqa: PD011
+                    "metadata": {**vector.metadata, "dhash": image_hash},
+                }
+                for (vector_id, vector), image_hash in zip(missing, hashes, strict=True)
+                if image_hash is not None
+            ]
+            if vectors:
+                pinecone_container.upsert_multiple_pinecone(vectors)
+            updated += len(vectors)
+            logger.info(f"{updated} vectors updated.")
+    return updated
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Add the perceptual hash to the old vectors.")
+    parser.add_argument("--dry-run", action="store_true")
+    backfill_dhash(dry_run=parser.parse_args().dry_run)
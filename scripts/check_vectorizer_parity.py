@@ -0,0 +1,55 @@
+import argparse
+import os
+import sys
+from pathlib import Path
+
+from dotenv import load_dotenv
+from loguru import logger
+
+load_dotenv()
+
+from app.services.identify.backends import compare_vectors, load_backend
+from app.services.identify.preprocess import preprocess_batch
+from app.shared.utils import read_img_from_path_with_mask
+
+IMAGES_FOLDER: str = "tests/services/identify/images"
+BACKENDS: list[str] = ["torchscript", "compile", "onnx", "int8"]
+
+
+def check_vectorizer_parity(backends: list[str], folder: str, min_cosine: float) -> bool:
+    """Compare the vectors of every backend with the eager ones, the ones stored in Pinecone.
+
+    Args:
+    ----
+        backends: The backends to check.
+        folder: The folder with the images of the caps.
+        min_cosine: The minimum cosine similarity between a vector and its eager vector.
+
+    Returns:
+    -------
+        If all the backends are within the tolerance.
+
+    """
+    imgs = [read_img_from_path_with_mask(str(Path(folder) / img)) for img in os.listdir(folder)]
+    batch = preprocess_batch(imgs)
+    reference = load_backend("eager")(batch)
+
+    passed = True
+    for backend in backends:
+        cosine, max_diff = compare_vectors(reference, load_backend(backend)(batch))
+        ok = cosine >= min_cosine
+        passed &= ok
+        logger.info(
+            f"{backend}: min cosine {cosine:.6f}, max abs diff {max_diff:.6f} "
+            f"{'OK' if ok else 'FAILED'}"
+        )
+    return passed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check the backends against the eager model.")
+    parser.add_argument("--backends", nargs="+", default=BACKENDS, choices=BACKENDS)
+    parser.add_argument("--images", default=IMAGES_FOLDER)
+    parser.add_argument("--min-cosine", type=float, default=0.99)
+    args = parser.parse_args()
+    sys.exit(0 if check_vectorizer_parity(args.backends, args.images, args.min_cosine) else 1)
@@ -0,0 +1,32 @@
+import argparse
+
+from dotenv import load_dotenv
+from loguru import logger
+
+load_dotenv()
+
+from app.services.identify.backends import bundle_weights, export_artifacts
+
+
+def export_vectorizer(directory: str | None = None, *, weights_only: bool = False) -> None:
+    """Bundle the weights of MobileNet and export the artifacts of the backends of the vectorizer.
+
+    Args:
+    ----
+        directory: The folder of the artifacts, `vectorizer_artifacts_dir` by default.
+        weights_only: Only bundle the weights, enough for the eager backend.
+
+    """
+    logger.info(f"Bundled the weights of MobileNet in {bundle_weights()}")
+    if weights_only:
+        return
+    for backend, path in export_artifacts(directory).items():
+        logger.info(f"Exported the {backend} backend to {path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the artifacts of the vectorizer.")
+    parser.add_argument("--output", default=None, help="vectorizer_artifacts_dir by default")
+    parser.add_argument("--weights-only", action="store_true")
+    args = parser.parse_args()
+    export_vectorizer(args.output, weights_only=args.weights_only)
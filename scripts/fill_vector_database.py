@@ -1,46 +1,208 @@
+import argparse
 import asyncio
-import os
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import TYPE_CHECKING
 
+import cv2
+import numpy as np
+import starlette.status
 from dotenv import load_dotenv
+from fastapi import HTTPException
 from loguru import logger
 
 load_dotenv()
 
-from app.services.firebase_container import FirebaseContainer
+from app.config import Settings
 from app.services.identify.image_vectorizer import ImageVectorizer
-from app.services.pinecone_container import PineconeContainer
-from app.shared.utils import read_img_from_path_with_mask, upload_file
+from app.services.saver.manager import build_file_name, build_metadata, store_image
+from app.services.vector_store import get_vector_store
+from app.shared.decoded_image import DecodedImage
+from app.shared.executors import run_in_thread, run_io
+from app.shared.perceptual_hash import dhash
 
-if TYPE_CHECKING:
-    from fastapi import UploadFile
+settings = Settings()
 
-PROJECT_PATH = Path.cwd()
+ROOT_DIR: Path = Path("database") / "caps"
+USER_ID: str = "test_user"
+BATCH_SIZE: int = 32
 
 
-async def fill_vector_database() -> None:
-    """Fill the Pinecone database with the images that are inside the caps folder."""
-    pinecone_container = PineconeContainer()
-    firebase_container = FirebaseContainer()
+class Checkpoint:
+    """The names already ingested, one per line, appended after every batch is upserted.
 
-    # pinecone_container.empty_index() noqa: ERA001
-    root_dir = str(Path("database") / "caps")
-    folders = os.listdir(root_dir)
+    An interrupted run loses at most the batch in progress: its images may be in Firebase
+    already, uploading them again is a conflict that is ignored.
+    """
+
+    def __init__(self, path: Path, *, restart: bool = False):
+        self.path = path
+        if restart:
+            self.path.unlink(missing_ok=True)
+        self.done: set[str] = (
+            set(self.path.read_text().splitlines()) if self.path.exists() else set()
+        )
+
+    def add(self, names: list[str]) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self.path.open("a") as file:
+            file.writelines(f"{name}\n" for name in names)
+        self.done.update(names)
+
+
+def _init_worker() -> None:
+    # Every process already runs in parallel, avoid oversubscribing the cores
+    cv2.setNumThreads(1)
+
+
+def _prepare(path: Path) -> tuple[str, np.ndarray, np.ndarray, str]:
+    """Read an image in a worker process, return what is embedded, stored and its hash."""
+    image = DecodedImage(path.read_bytes())
+    return path.name, image.masked(), image.resized(), dhash(image.masked())
+
+
+async def _upload(
+    semaphore: asyncio.Semaphore, resized: np.ndarray, name: str, user_id: str
+) -> None:
+    async with semaphore:
+        try:
+            await store_image(resized, build_file_name(name), user_id)
+        except HTTPException as e:
+            # Uploaded by the run that was interrupted, before its batch was upserted
+            if e.status_code != starlette.status.HTTP_409_CONFLICT:
+                raise
+
+
+async def fill_vector_database(
+    root_dir: Path = ROOT_DIR,
+    user_id: str = USER_ID,
+    checkpoint_path: Path | None = None,
+    batch_size: int = BATCH_SIZE,
+    workers: int = settings.detect_workers,
+    upload_concurrency: int = settings.bulk_save_upload_concurrency,
+    *,
+    restart: bool = False,
+) -> int:
+    """Fill the vector database with the images that are inside the caps folder.
+
+    The images are read and masked in a process pool, embedded a batch at a time and the batch
+    is uploaded to Firebase concurrently and upserted in one call, while the pool already
+    prepares the next batch. The names of the upserted batches are kept in a checkpoint file,
+    so a run that is started again skips them.
+
+    Args:
+    ----
+        root_dir: The folder of the images.
+        user_id: The user that owns the images.
+        checkpoint_path: The checkpoint file, next to the folder by default.
+        batch_size: The images embedded and upserted together.
+        workers: The processes that read and mask the images.
+        upload_concurrency: The uploads to Firebase at the same time.
+        restart: Ignore the checkpoint and ingest every image.
+
+    Returns:
+    -------
+        The number of images ingested by this run.
+
+    """
+    checkpoint = Checkpoint(
+        checkpoint_path or root_dir.parent / f"{root_dir.name}-{user_id}.checkpoint",
+        restart=restart,
+    )
+    paths = [path for path in sorted(root_dir.iterdir()) if path.name not in checkpoint.done]
+    logger.info(f"{len(checkpoint.done)} images already ingested, {len(paths)} left.")
+    if not paths:
+        return 0
+
+    vector_store = get_vector_store()
     img_vectorizer = ImageVectorizer()
-    for indx, img_path in enumerate(folders):
-        file_path: Path = Path(root_dir) / img_path
+    semaphore = asyncio.Semaphore(upload_concurrency)
+    loop = asyncio.get_running_loop()
+    total = len(checkpoint.done) + len(paths)
+    batches = [paths[start : start + batch_size] for start in range(0, len(paths), batch_size)]
+    ingested, started = 0, time.perf_counter()
 
-        img = read_img_from_path_with_mask(str(file_path))
-        vector = img_vectorizer.numpy_to_vector(img=img)
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+    ) as pool:
 
-        file: UploadFile = await upload_file(file_path)
-        firebase_container.add_image_to_container(file, img_path, "test_user")
-        pinecone_container.upsert_into_pinecone(
-            vector_id=img_path, values=vector, metadata={"user_id": "test_user", "name": img_path}
-        )
-        logger.info(f"A total of {indx}/{len(folders)} have been uploaded.")
+        def prepare(batch: list[Path]) -> asyncio.Future:
+            return asyncio.gather(
+                *[loop.run_in_executor(pool, _prepare, path) for path in batch],
+                return_exceptions=True,
+            )
+
+        next_batch = prepare(batches[0])
+        for index, batch in enumerate(batches):
+            batch_started = time.perf_counter()
+            prepared = []
+            for path, result in zip(batch, await next_batch, strict=True):
+                if isinstance(result, Exception):
+                    logger.warning(f"Skipping {path.name}: {result!s}")
+                    continue
+                prepared.append(result)
+            if index + 1 < len(batches):
+                next_batch = prepare(batches[index + 1])
+            if not prepared:
+                continue
+
+            names, masked, resized, hashes = zip(*prepared, strict=True)
+            vectors = await run_in_thread(img_vectorizer.numpy_to_vectors, list(masked))
+            await asyncio.gather(
+                *[
+                    _upload(semaphore, image, name, user_id)
+                    for image, name in zip(resized, names, strict=True)
+                ]
+            )
+            await run_io(
+                vector_store.upsert_multiple_pinecone,
+                [
+                    {
+                        "id": vector_store.build_vector_id(user_id, name),
+                        "values": vector.tolist(),
+                        "metadata": build_metadata(
+                            user_id, name, image_hash, file_name=build_file_name(name)
+                        ),
+                    }
+                    for name, vector, image_hash in zip(names, vectors, hashes, strict=True)
+                ],
+            )
+            checkpoint.add(list(names))
+
+            ingested += len(names)
+            now = time.perf_counter()
+            logger.info(
+                f"A total of {len(checkpoint.done)}/{total} have been uploaded,"
+                f" {len(names) / (now - batch_started):.1f} images/s"
+                f" ({ingested / (now - started):.1f} images/s overall)."
+            )
+    vector_store.persist()
+    return ingested
 
 
 if __name__ == "__main__":
-    asyncio.run(fill_vector_database())
+    parser = argparse.ArgumentParser(description=fill_vector_database.__doc__)
+    parser.add_argument("--root-dir", type=Path, default=ROOT_DIR)
+    parser.add_argument("--user-id", default=USER_ID)
+    parser.add_argument("--checkpoint", type=Path, default=None)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=settings.detect_workers)
+    parser.add_argument(
+        "--upload-concurrency", type=int, default=settings.bulk_save_upload_concurrency
+    )
+    parser.add_argument("--restart", action="store_true")
+    args = parser.parse_args()
+    asyncio.run(
+        fill_vector_database(
+            args.root_dir,
+            args.user_id,
+            args.checkpoint,
+            args.batch_size,
+            args.workers,
+            args.upload_concurrency,
+            restart=args.restart,
+        )
+    )
@@ -0,0 +1,209 @@
+import argparse
+import asyncio
+import itertools
+import json
+import time
+import uuid
+from collections import Counter
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import httpx
+import numpy as np
+from loguru import logger
+
+ENDPOINTS: list[str] = ["detect", "identify", "detect_and_identify", "saver", "saver_bulk"]
+IMAGES_FOLDER: Path = Path("tests/services/identify/images")
+LOAD_TEST_USER: str = "load_test_user"
+HTTP_ERROR: int = 400
+
+
+@dataclass
+class EndpointStats:
+    latencies: list[float] = field(default_factory=list)
+    statuses: Counter = field(default_factory=Counter)
+    failures: int = 0
+
+    def summary(self, elapsed: float) -> dict:
+        values = 1000 * np.asarray(self.latencies or [np.nan])
+        return {
+            "requests": len(self.latencies),
+            "failures": self.failures,
+            "throughput_rps": len(self.latencies) / elapsed,
+            "p50_ms": float(np.percentile(values, 50)),
+            "p95_ms": float(np.percentile(values, 95)),
+            "p99_ms": float(np.percentile(values, 99)),
+            "statuses": dict(self.statuses),
+        }
+
+
+def _bulk_failed(body: str) -> bool:
+    """Check whether an event of a bulk upload is not a JSON progress update or has an error."""
+    for line in body.splitlines():
+        if not line.startswith("data:"):
+            continue
+        try:
+            event = json.loads(line.removeprefix("data:"))
+        except json.JSONDecodeError:
+            return True
+        if not isinstance(event, dict) or event.get("error"):
+            return True
+    return False
+
+
+async def send_request(
+    client: httpx.AsyncClient,
+    endpoint: str,
+    images: list[tuple[str, bytes]],
+    user_id: str,
+) -> tuple[int, bool]:
+    """Send one request to an endpoint.
+
+    Args:
+    ----
+        client: The client, with the base url and the API key.
+        endpoint: One of ENDPOINTS.
+        images: The (filename, contents) of the images to send, the bulk upload sends all.
+        user_id: The user of the requests.
+
+    Returns:
+    -------
+        The status code and whether the request failed.
+
+    """
+    filename, contents = images[0]
+    file = {"file": (filename, contents, "image/jpeg")}
+    if endpoint == "detect":
+        response = await client.post("/detect", files=file)
+    elif endpoint in ("identify", "detect_and_identify"):
+        response = await client.post(f"/{endpoint}", params={"user_id": user_id}, files=file)
+    elif endpoint == "saver":
+        # A new name every time, saving an existing image is a conflict
+        params = {"user_id": user_id, "name": f"{uuid.uuid4()}_{filename}"}
+        response = await client.post("/saver", params=params, files=file)
+    elif endpoint == "saver_bulk":
+        files = [("files", (f"{uuid.uuid4()}_{name}", data, "image/jpeg")) for name, data in images]
+        response = await client.post("/saver/bulk", params={"user_id": user_id}, files=files)
+        return response.status_code, response.is_error or _bulk_failed(response.text)
+    else:
+        raise ValueError(f"Unknown endpoint: {endpoint}")
+    return response.status_code, response.status_code >= HTTP_ERROR
+
+
+async def run_load(
+    base_url: str,
+    api_key: str,
+    endpoints: list[str],
+    images: list[tuple[str, bytes]],
+    concurrency: int,
+    requests: int | None = None,
+    duration: float | None = None,
+    bulk_size: int = 4,
+    user_id: str = LOAD_TEST_USER,
+    request_timeout: float = 60.0,
+) -> dict:
+    """Send requests from `concurrency` workers until `requests` are sent or `duration` passes.
+
+    Every worker sends its next request as soon as the previous one answered, visiting the
+    endpoints and the images in turns, so the server always has `concurrency` requests.
+
+    Returns
+    -------
+        The elapsed seconds and the summary of every endpoint.
+
+    """
+    stats = {endpoint: EndpointStats() for endpoint in endpoints}
+    schedule = itertools.count()
+    deadline = time.perf_counter() + duration if duration else None
+
+    async def worker(client: httpx.AsyncClient) -> None:
+        while True:
+            n = next(schedule)
+            if requests is not None and n >= requests:
+                return
+            if deadline is not None and time.perf_counter() >= deadline:
+                return
+            endpoint = endpoints[n % len(endpoints)]
+            size = bulk_size if endpoint == "saver_bulk" else 1
+            batch = [images[(n + i) % len(images)] for i in range(size)]
+            started = time.perf_counter()
+            try:
+                status, failed = await send_request(client, endpoint, batch, user_id)
+            except httpx.HTTPError as e:
+                status, failed = type(e).__name__, True
+            stats[endpoint].latencies.append(time.perf_counter() - started)
+            stats[endpoint].statuses[status] += 1
+            stats[endpoint].failures += failed
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(
+        base_url=base_url, headers={"X-API-KEY": api_key}, timeout=request_timeout, limits=limits
+    ) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*[worker(client) for _ in range(concurrency)])
+        elapsed = time.perf_counter() - started
+
+    return {
+        "elapsed_seconds": elapsed,
+        "concurrency": concurrency,
+        "endpoints": {endpoint: s.summary(elapsed) for endpoint, s in stats.items()},
+    }
+
+
+def load_images(folder: Path) -> list[tuple[str, bytes]]:
+    """Read the (filename, contents) of the JPEG and PNG images of a folder."""
+    paths = sorted(p for p in folder.iterdir() if p.suffix.lower() in (".jpg", ".jpeg", ".png"))
+    if not paths:
+        raise FileNotFoundError(f"No images in {folder}")
+    return [(path.name, path.read_bytes()) for path in paths]
+
+
+def main() -> None:
+    """Drive the API at a target concurrency and report the throughput and latency percentiles.
+
+    Start the server with PINECONE_BACKEND=fake FIREBASE_BACKEND=fake RATE_LIMIT_ENABLED=false
+    to load test it without the remote services, FAKE_LATENCY_MS and FAKE_ERROR_RATE simulate
+    slow or failing ones.
+    """
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--url", default="http://localhost:8080")
+    parser.add_argument("--api-key", default="dumb_key")
+    parser.add_argument("--endpoints", nargs="+", choices=ENDPOINTS, default=ENDPOINTS)
+    parser.add_argument("--images", type=Path, default=IMAGES_FOLDER)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=None)
+    parser.add_argument("--duration", type=float, default=None, help="Seconds, default 30")
+    parser.add_argument("--bulk-size", type=int, default=4)
+    parser.add_argument("--user-id", default=LOAD_TEST_USER)
+    parser.add_argument("--output", type=Path, default=None, help="Write the report as JSON")
+    args = parser.parse_args()
+
+    duration = args.duration if args.duration or args.requests else 30.0
+    report = asyncio.run(
+        run_load(
+            args.url,
+            args.api_key,
+            args.endpoints,
+            load_images(args.images),
+            args.concurrency,
+            requests=args.requests,
+            duration=duration,
+            bulk_size=args.bulk_size,
+            user_id=args.user_id,
+        )
+    )
+
+    logger.info(f"{report['elapsed_seconds']:.1f}s at concurrency {report['concurrency']}")
+    for endpoint, summary in report["endpoints"].items():
+        logger.info(
+            f"{endpoint:<20} {summary['requests']:>6} req {summary['throughput_rps']:>7.1f} req/s "
+            f"p50 {summary['p50_ms']:>8.1f} ms p95 {summary['p95_ms']:>8.1f} ms "
+            f"p99 {summary['p99_ms']:>8.1f} ms failures {summary['failures']} "
+            f"{summary['statuses']}"
+        )
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+import argparse
+
+from dotenv import load_dotenv
+from loguru import logger
+
+load_dotenv()
+
+from app.config import Settings
+from app.services.firebase_container import FirebaseContainer
+
+settings = Settings()
+
+PUBLIC_ROLE: str = "roles/storage.objectViewer"
+PUBLIC_MEMBER: str = "allUsers"
+
+
+def make_bucket_public(*, uniform_access: bool = False, dry_run: bool = False) -> dict:
+    """Let anyone read every object of the bucket with one IAM binding, instead of per blob.
+
+    IAM rejects conditions on allUsers, so the binding can't be limited to a prefix and the
+    whole bucket becomes public. It works next to the ACLs of the objects. Once it has run,
+    the uploads can stop making their blobs public with FIREBASE_PUBLIC_ACL=false. Running it
+    again does nothing.
+
+    Args:
+    ----
+        uniform_access: Also turn on uniform bucket-level access, which turns off every ACL of
+            the bucket. FIREBASE_PUBLIC_ACL must be false before, or the uploads fail.
+        dry_run: Only log the changes.
+
+    Returns:
+    -------
+        The binding of the public role.
+
+    """
+    bucket = FirebaseContainer().client.get_bucket(settings.firebase_bucket)
+    binding: dict = {"role": PUBLIC_ROLE, "members": {PUBLIC_MEMBER}}
+    logger.info(f"Binding of {bucket.name}: {binding}")
+    enable_uniform_access = (
+        uniform_access and not bucket.iam_configuration.uniform_bucket_level_access_enabled
+    )
+    if enable_uniform_access:
+        logger.warning(f"Uniform bucket-level access of {bucket.name} turns off its ACLs.")
+    if dry_run:
+        return binding
+
+    policy = bucket.get_iam_policy(requested_policy_version=3)
+    if binding not in policy.bindings:
+        policy.bindings.append(binding)
+        bucket.set_iam_policy(policy)
+    if enable_uniform_access:
+        bucket.iam_configuration.uniform_bucket_level_access_enabled = True
+        bucket.patch()
+    return binding
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=make_bucket_public.__doc__)
+    parser.add_argument(
+        "--confirm", action="store_true", help="Make the whole bucket public, a dry run without it."
+    )
+    parser.add_argument(
+        "--uniform-access",
+        action="store_true",
+        help="Also turn on uniform bucket-level access, it turns off every ACL of the bucket.",
+    )
+    args = parser.parse_args()
+    make_bucket_public(uniform_access=args.uniform_access, dry_run=not args.confirm)
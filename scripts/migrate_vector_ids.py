@@ -0,0 +1,89 @@
+import argparse
+
+from dotenv import load_dotenv
+from loguru import logger
+
+load_dotenv()
+
+from app.services.pinecone_container import PineconeContainer
+from app.services.saver.manager import migrate_legacy_metadata
+
+NAMESPACE: str = "bottle-caps"
+
+
+def _migrate_page(
+    pinecone_container: PineconeContainer, page: list[str], taken: set[str]
+) -> tuple[list[dict], list[str]]:
+    """Return the vectors of a page to upsert and the old ids to delete."""
+    index = pinecone_container.index
+    fetched = index.fetch(ids=page, namespace=NAMESPACE)
+    vectors, old_ids = [], []
+    for vector_id, vector in fetched.vectors.items():
+        metadata = vector.metadata or {}
+        if "user_id" not in metadata or "name" not in metadata:
+            logger.warning(f"Skipping {vector_id}, it has no user_id or name.")
+            continue
+        new_metadata = migrate_legacy_metadata(metadata)
+        new_id = pinecone_container.build_vector_id(new_metadata["user_id"], new_metadata["name"])
+        if new_id == vector_id and new_metadata == metadata:
+            continue
+        if new_id != vector_id:
+            existing = index.fetch(ids=[new_id], namespace=NAMESPACE).vectors.get(new_id)
+            if existing is not None and existing.metadata == new_metadata:
+                # Upserted by a run that crashed before deleting the old id
+                old_ids.append(vector_id)
+                continue
+            if existing is not None or new_id in taken:
+                logger.warning(f"Skipping {vector_id}, {new_metadata['name']} already exists.")
+                continue
+            old_ids.append(vector_id)
+        vectors.append(
+            {"id": new_id, "values": vector.values, "metadata": new_metadata}  # noqa: PD011
+        )
+        taken.add(new_id)
+
+    return vectors, old_ids
+
+
+def migrate_vector_ids(*, dry_run: bool = False) -> int:
+    """Rewrite the ids of the vectors in Pinecone to the deterministic ids of (user_id, name).
+
+    The vectors saved before they kept the name of their file get it, and their name loses
+    the extension like the new ones. Every page of ids is fetched, the vectors with an old id
+    or metadata are upserted with the new ones and then the old ids are deleted, so running it
+    again after a crash is safe. A vector whose new id is already taken by an image saved
+    since is skipped and logged.
+
+    Args:
+    ----
+        dry_run: Only log how many vectors would be migrated.
+
+    Returns:
+    -------
+        The number of vectors migrated.
+
+    """
+    pinecone_container: PineconeContainer = PineconeContainer()
+    index = pinecone_container.index
+    migrated = 0
+    taken: set[str] = set()
+    # Materialize the ids first, the pagination would be affected by the upserts and deletes
+    pages: list[list[str]] = list(index.list(namespace=NAMESPACE))
+    for page in pages:
+        vectors, old_ids = _migrate_page(pinecone_container, page, taken)
+        if not dry_run:
+            if vectors:
+                pinecone_container.upsert_multiple_pinecone(vectors)
+            if old_ids:
+                index.delete(ids=old_ids, namespace=NAMESPACE)
+        migrated += len(vectors)
+        logger.info(f"{migrated} vectors migrated.")
+    return migrated
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Migrate the Pinecone ids and names of the old vectors."
+    )
+    parser.add_argument("--dry-run", action="store_true")
+    migrate_vector_ids(dry_run=parser.parse_args().dry_run)
@@ -0,0 +1,45 @@
+import cv2
+import numpy as np
+
+from app.services.detect.blobs import reduce_colors_images
+
+N_COLORS: int = 3
+MAX_CENTER_DIFF: int = 3
+MIN_AGREEMENT: float = 0.99
+
+
+def _three_colors_image() -> np.ndarray:
+    rng = np.random.default_rng(0)
+    image = np.full((400, 600, 3), (40, 160, 220), dtype=np.uint8)
+    cv2.circle(image, (150, 200), 100, (200, 30, 30), -1)
+    cv2.circle(image, (420, 200), 120, (20, 220, 60), -1)
+    noise = rng.normal(0, 4, image.shape)
+    return (image + noise).clip(0, 255).astype(np.uint8)
+
+
+class TestReduceColors:
+    def test_fast_mode_is_deterministic(self):
+        image = _three_colors_image()
+
+        first = reduce_colors_images(image, N_COLORS, mode="fast")
+        second = reduce_colors_images(image, N_COLORS, mode="fast")
+
+        assert np.array_equal(first, second)
+        assert len(np.unique(first.reshape(-1, 3), axis=0)) == N_COLORS
+
+    def test_fast_mode_keeps_the_global_rng(self):
+        cv2.setRNGSeed(1)
+        expected = cv2.randu(np.zeros(8, dtype=np.float32), 0, 1)
+        cv2.setRNGSeed(1)
+        reduce_colors_images(_three_colors_image(), N_COLORS, mode="fast")
+
+        assert np.array_equal(cv2.randu(np.zeros(8, dtype=np.float32), 0, 1), expected)
+
+    def test_fast_mode_agrees_with_exact(self):
+        image = _three_colors_image()
+
+        exact = reduce_colors_images(image, N_COLORS, mode="exact").astype(np.int32)
+        fast = reduce_colors_images(image, N_COLORS, mode="fast").astype(np.int32)
+
+        # Same clusters, the centers may differ by a few levels
+        assert np.mean(np.abs(exact - fast).max(axis=2) <= MAX_CENTER_DIFF) >= MIN_AGREEMENT
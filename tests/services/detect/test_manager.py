@@ -0,0 +1,69 @@
+import threading
+
+import numpy as np
+import pytest
+
+from app.services.detect import manager
+from app.services.detect.manager import (
+    detect_caps,
+    detect_caps_async,
+    detect_original_rectangles,
+    preprocess_image_size,
+    scale_rectangles,
+)
+from app.shared import executors
+from app.shared.executors import run_in_thread
+from benchmarks.synthetic import synthetic_caps_image
+
+MAX_ANALYSIS_PIXELS: int = 1000 * 1000
+MAX_CENTER_ERROR: int = 30
+
+
+class TestDetectCaps:
+    def test_analysis_image_is_resized_once(self):
+        image, _ = synthetic_caps_image(n_caps=4, size=(2400, 2400))
+
+        analysis = preprocess_image_size(image)
+
+        assert analysis.shape[0] * analysis.shape[1] <= MAX_ANALYSIS_PIXELS
+        assert preprocess_image_size(analysis) is analysis
+
+    def test_scale_rectangles(self):
+        assert scale_rectangles([(10, 20, 30, 30)], 2.4) == [(24, 48, 72, 72)]
+
+    def test_crops_are_full_resolution(self):
+        image, caps = synthetic_caps_image(n_caps=9, size=(2400, 2400), seed=3)
+
+        detected = detect_caps(image)
+
+        assert len(detected) == len(caps)
+        for crop, (x, y, w, h) in detected:
+            assert crop.shape[:2] == (h, w)
+            center = (x + w // 2, y + h // 2)
+            errors = [np.hypot(center[0] - cx, center[1] - cy) for cx, cy, _ in caps]
+            assert min(errors) < MAX_CENTER_ERROR
+
+    @pytest.mark.asyncio
+    async def test_resize_is_offloaded(self, monkeypatch: pytest.MonkeyPatch):
+        image, _ = synthetic_caps_image(n_caps=4, size=(2400, 2400))
+        calls = []
+
+        async def run_on_image(func, img, *args):
+            calls.append((func, img, *args))
+            return []
+
+        monkeypatch.setattr(manager, "run_on_image", run_on_image)
+
+        assert await detect_caps_async(image) == []
+        # The original image goes to the executor, which resizes it
+        assert calls == [(detect_original_rectangles, image)]
+
+    @pytest.mark.asyncio
+    async def test_inline_detection_keeps_the_thread_executor(
+        self, monkeypatch: pytest.MonkeyPatch
+    ):
+        monkeypatch.setattr(executors.settings, "detect_executor", "inline")
+
+        name = await run_in_thread(lambda: threading.current_thread().name)
+
+        assert name.startswith("cpu")
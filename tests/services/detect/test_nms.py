@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+from app.services.detect import nms
+from app.services.detect.nms import nms_boxes, nms_circles
+
+
+def _reference_circles(circles: np.ndarray) -> list[tuple]:
+    """Run the nested loop `combine_overlapping_circles` used before."""
+    combined_circles: list[tuple] = []
+    for x, y, r in circles:
+        if not any(
+            (x - cx) ** 2 + (y - cy) ** 2 < (r + cr) ** 2 for cx, cy, cr in combined_circles
+        ):
+            combined_circles.append((x, y, r))
+    return combined_circles
+
+
+def _reference_boxes(boxes: np.ndarray) -> list[int]:
+    """Run the nested loop `_remove_overlapping_blobs` used before."""
+    overlapping = [False] * len(boxes)
+    for i, box in enumerate(boxes):
+        if overlapping[i]:
+            continue
+        for j, other in enumerate(boxes[i + 1 :]):
+            if box[0] < other[2] and box[2] > other[0] and box[1] < other[3] and box[3] > other[1]:
+                overlapping[i + j + 1] = True
+    return [i for i in range(len(boxes)) if not overlapping[i]]
+
+
+def _candidates(n: int, seed: int) -> tuple[np.ndarray, np.ndarray]:
+    rng = np.random.default_rng(seed)
+    circles = np.column_stack((rng.integers(0, 3000, (n, 2)), rng.integers(5, 60, n))).astype(
+        np.int64
+    )
+    x, y, r = circles.T
+    return circles, np.column_stack((x - r, y - r, x + r, y + r))
+
+
+class TestNms:
+    @pytest.mark.parametrize("grid", [False, True])
+    @pytest.mark.parametrize("n", [0, 1, 50, 2000])
+    def test_compatibility_mode(self, n: int, grid: bool, monkeypatch: pytest.MonkeyPatch):
+        if grid:
+            monkeypatch.setattr(nms, "GRID_MIN_CANDIDATES", 0)
+        circles, boxes = _candidates(n, seed=n)
+
+        kept_circles = [tuple(circle) for circle in circles[nms_circles(circles)]]
+
+        assert kept_circles == _reference_circles(circles)
+        assert nms_boxes(boxes) == _reference_boxes(boxes)
+
+    def test_scores_keep_the_strongest_first(self):
+        boxes = np.array([[0, 0, 10, 10], [5, 5, 30, 30], [40, 40, 50, 50]])
+
+        assert nms_boxes(boxes) == [0, 2]
+        assert nms_boxes(boxes, scores=np.array([1.0, 5.0, 2.0])) == [1, 2]
+
+    def test_touching_boxes_are_kept(self):
+        boxes = np.array([[0, 0, 10, 10], [10, 0, 20, 10]])
+
+        assert nms_boxes(boxes) == [0, 1]
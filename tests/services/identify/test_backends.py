@@ -0,0 +1,27 @@
+import numpy as np
+import pytest
+
+from app.services.identify.backends import compare_vectors, load_backend
+
+MIN_COSINE: float = 0.99
+
+
+class TestBackends:
+    def test_compare_vectors(self):
+        reference = np.array([[1.0, 0.0], [0.0, 2.0]], dtype=np.float32)
+        candidate = np.array([[1.0, 0.0], [0.0, 1.0]], dtype=np.float32)
+
+        cosine, max_diff = compare_vectors(reference, candidate)
+
+        assert cosine == pytest.approx(1.0)
+        assert max_diff == pytest.approx(1.0)
+
+    @pytest.mark.parametrize("backend", ["torchscript", "compile"])
+    def test_backend_parity_with_eager(self, backend: str):
+        batch = np.random.default_rng(0).normal(size=(4, 3, 224, 224)).astype(np.float32)
+
+        reference = load_backend("eager")(batch)
+        vectors = load_backend(backend)(batch)
+
+        assert vectors.shape == reference.shape
+        assert compare_vectors(reference, vectors)[0] >= MIN_COSINE
@@ -0,0 +1,94 @@
+import asyncio
+from unittest.mock import MagicMock, patch
+
+import numpy as np
+import pytest
+
+from app.services.identify.batcher import EmbeddingBatcher
+from app.services.vector_store import VECTOR_SIZE
+
+
+def _fake_numpy_to_vectors(imgs: list[np.ndarray]) -> np.ndarray:
+    return np.stack([np.full(4, img.mean(), dtype=np.float32) for img in imgs])
+
+
+@pytest.mark.asyncio
+async def test_embed_concurrent_requests_are_batched():
+    """Crops from concurrent calls should share one forward pass and keep their order."""
+    batcher = EmbeddingBatcher()
+    batcher._initialize()
+    batcher.max_wait = 0.05
+
+    vectorizer = MagicMock()
+    vectorizer.numpy_to_vectors.side_effect = _fake_numpy_to_vectors
+    imgs = [np.full((8, 8, 3), value, dtype=np.uint8) for value in range(6)]
+
+    with patch("app.services.identify.batcher.ImageVectorizer", return_value=vectorizer):
+        results = await asyncio.gather(
+            batcher.embed(imgs[0]), batcher.embed_many(imgs[1:4]), batcher.embed_many(imgs[4:])
+        )
+        await batcher.close()
+
+    assert results[0] == [0.0] * 4
+    assert results[1][:, 0].tolist() == [1.0, 2.0, 3.0]
+    assert results[2][:, 0].tolist() == [4.0, 5.0]
+    assert vectorizer.numpy_to_vectors.call_count == 1
+    assert batcher.get_stats()["max_batch_size"] == len(imgs)
+
+
+@pytest.mark.asyncio
+async def test_embed_broken_crop_only_fails_its_request():
+    """A crop that breaks the model should not fail the rest of the batch."""
+    batcher = EmbeddingBatcher()
+    batcher._initialize()
+
+    def numpy_to_vectors(imgs: list[np.ndarray]) -> np.ndarray:
+        if any(img.size == 0 for img in imgs):
+            raise ValueError("Empty crop")
+        return _fake_numpy_to_vectors(imgs)
+
+    vectorizer = MagicMock()
+    vectorizer.numpy_to_vectors.side_effect = numpy_to_vectors
+
+    with patch("app.services.identify.batcher.ImageVectorizer", return_value=vectorizer):
+        ok, broken = await asyncio.gather(
+            batcher.embed(np.ones((8, 8, 3), dtype=np.uint8)),
+            batcher.embed(np.empty((0, 0, 3), dtype=np.uint8)),
+            return_exceptions=True,
+        )
+        await batcher.close()
+
+    assert ok == [1.0] * 4
+    assert isinstance(broken, ValueError)
+
+
+@pytest.mark.asyncio
+async def test_embed_recovers_from_a_dead_worker():
+    """A worker that dies should fail its batch and the next requests should still work."""
+    batcher = EmbeddingBatcher()
+    batcher._initialize()
+    batcher.stats = MagicMock()
+    batcher.stats.record.side_effect = [RuntimeError("Broken stats"), None]
+
+    vectorizer = MagicMock()
+    vectorizer.numpy_to_vectors.side_effect = _fake_numpy_to_vectors
+    img = np.ones((8, 8, 3), dtype=np.uint8)
+
+    with patch("app.services.identify.batcher.ImageVectorizer", return_value=vectorizer):
+        with pytest.raises(RuntimeError):
+            await asyncio.wait_for(batcher.embed(img), timeout=5)
+        vector = await asyncio.wait_for(batcher.embed(img), timeout=5)
+        await batcher.close()
+
+    assert vector == [1.0] * 4
+
+
+@pytest.mark.asyncio
+async def test_embed_many_without_images():
+    """No images should give an empty batch of vectors of the right size."""
+    batcher = EmbeddingBatcher()
+    batcher._initialize()
+
+    vectors = await batcher.embed_many([])
+
+    assert vectors.shape == (0, VECTOR_SIZE)
@@ -0,0 +1,61 @@
+import io
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+from fastapi import HTTPException, UploadFile
+from starlette import status
+from starlette.requests import Request
+
+from app.services.identify import router
+from app.services.identify.manager import identify_many
+from app.services.limiter import request_limiter
+
+TEST_USER: str = "test_user"
+MATCHES: list[dict] = [{"id": "test_user-cap", "score": 0.9, "metadata": {"name": "cap"}}]
+
+
+async def _fake_identify(file_contents: bytes, user_id: str) -> list[dict]:  # noqa: ARG001
+    if file_contents == b"broken":
+        raise TypeError("Failed to load image.")
+    return MATCHES
+
+
+async def _no_cache(_endpoint: str, _data: bytes, compute, **_) -> list[dict]:
+    return await compute()
+
+
+@pytest.mark.asyncio
+async def test_identify_many_yields_one_result_per_file():
+    """Every file should get its matches or its error, and every file should be closed."""
+    files = [(f"cap_{i}", io.BytesIO(f"image {i}".encode())) for i in range(4)]
+    files.append(("broken", io.BytesIO(b"broken")))
+
+    with (
+        patch("app.services.identify.manager.post_identify", AsyncMock(side_effect=_fake_identify)),
+        patch("app.services.identify.manager.ResultCache") as result_cache,
+    ):
+        result_cache.return_value.get_or_compute = AsyncMock(side_effect=_no_cache)
+        results = [result async for result in identify_many(files, TEST_USER)]
+
+    assert sorted(result["index"] for result in results) == list(range(5))
+    by_filename = {result["filename"]: result for result in results}
+    assert all(by_filename[f"cap_{i}"]["matches"] == MATCHES for i in range(4))
+    assert by_filename["broken"]["error"] == "TypeError: Failed to load image."
+    assert all(file.closed for _, file in files)
+
+
+@pytest.mark.asyncio
+async def test_identify_bulk_rejects_too_many_files(monkeypatch: pytest.MonkeyPatch):
+    """A request with more files than the limit should be rejected before reading them."""
+    monkeypatch.setattr(router.settings, "bulk_identify_max_files", 2)
+    monkeypatch.setattr(request_limiter, "enabled", False)
+    files = [UploadFile(io.BytesIO(b"image"), filename=f"cap_{i}") for i in range(3)]
+
+    with (
+        patch("app.services.identify.router.identify_many") as identify,
+        pytest.raises(HTTPException) as exc_info,
+    ):
+        await router.identify_bulk(files, TEST_USER, request=MagicMock(spec=Request))
+
+    assert exc_info.value.status_code == status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    identify.assert_not_called()
@@ -0,0 +1,42 @@
+from unittest.mock import MagicMock
+
+import numpy as np
+
+from app.services.identify.image_vectorizer import ImageVectorizer
+from app.services.identify.preprocess import INPUT_SIZE
+from app.services.vector_store import VECTOR_SIZE
+
+
+def _vectorizer() -> ImageVectorizer:
+    vectorizer = object.__new__(ImageVectorizer)
+    # One vector per image, filled with the mean of its first channel
+    vectorizer.backend = MagicMock(
+        side_effect=lambda batch: np.repeat(
+            batch[:, 0].mean(axis=(1, 2))[:, None], VECTOR_SIZE, axis=1
+        ).astype(np.float32)
+    )
+    return vectorizer
+
+
+class TestImageVectorizer:
+    def test_batch_is_one_forward_pass(self):
+        vectorizer = _vectorizer()
+        imgs = [np.full((100 + 20 * i, 150, 3), 40 * i, dtype=np.uint8) for i in range(4)]
+
+        vectors = vectorizer.numpy_to_vectors(imgs)
+
+        assert vectorizer.backend.call_count == 1
+        assert vectorizer.backend.call_args.args[0].shape == (len(imgs), 3, INPUT_SIZE, INPUT_SIZE)
+        assert vectors.shape == (len(imgs), VECTOR_SIZE)
+        # The vectors keep the order of the images
+        assert np.all(np.diff(vectors[:, 0]) > 0)
+        assert vectorizer.numpy_to_vector(imgs[2]) == vectors[2].tolist()
+
+    def test_empty_batch(self):
+        vectorizer = _vectorizer()
+
+        vectors = vectorizer.numpy_to_vectors([])
+
+        assert vectors.shape == (0, VECTOR_SIZE)
+        assert vectors.dtype == np.float32
+        vectorizer.backend.assert_not_called()
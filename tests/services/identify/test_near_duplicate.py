@@ -0,0 +1,60 @@
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import numpy as np
+import pytest
+
+from app.services.identify import manager
+
+TEST_USER: str = "test_user"
+
+DUPLICATE_MATCHES: list[dict] = [
+    {"id": "test_user-cap", "score": 1.0, "metadata": {"user_id": TEST_USER, "name": "cap"}},
+    {"id": "test_user-other", "score": 0.4, "metadata": {"user_id": TEST_USER, "name": "other"}},
+]
+
+
+def _cap(value: int) -> np.ndarray:
+    return np.full((64, 64, 3), value, np.uint8)
+
+
+@pytest.mark.asyncio
+async def test_near_duplicate_skips_the_model():
+    """A photo of a saved cap should be answered from its hash, without embedding it."""
+    cache = MagicMock()
+    cache.find_near_duplicates.return_value = [DUPLICATE_MATCHES]
+    batcher = MagicMock()
+    batcher.embed_many = AsyncMock()
+
+    with (
+        patch.object(manager, "UserVectorCache", return_value=cache),
+        patch.object(manager, "EmbeddingBatcher", return_value=batcher),
+    ):
+        matches = await manager.identify_cap(_cap(128), TEST_USER)
+
+    assert matches == [{"name": "cap", "score": 1.0}, {"name": "other", "score": 0.4}]
+    batcher.embed_many.assert_not_called()
+    cache.query_many.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_detect_and_identify_embeds_only_the_new_caps():
+    """The caps of a detection should take the shortcut too, the others are embedded."""
+    cache = MagicMock()
+    cache.find_near_duplicates.return_value = [None, DUPLICATE_MATCHES]
+    cache.query_many.return_value = [[{"score": 0.7, "metadata": {"name": "new"}}]]
+    batcher = MagicMock()
+    batcher.embed_many = AsyncMock(return_value=np.zeros((1, 4), np.float32))
+    caps = [_cap(10), _cap(200)]
+
+    with (
+        patch.object(manager, "UserVectorCache", return_value=cache),
+        patch.object(manager, "EmbeddingBatcher", return_value=batcher),
+    ):
+        matches = await manager.identify_caps(caps, TEST_USER)
+
+    assert matches == [
+        [{"name": "new", "score": 0.7}],
+        [{"name": "cap", "score": 1.0}, {"name": "other", "score": 0.4}],
+    ]
+    assert len(batcher.embed_many.await_args.args[0]) == 1
+    cache.query_many.assert_called_once()
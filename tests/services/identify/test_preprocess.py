@@ -0,0 +1,45 @@
+import cv2
+import numpy as np
+import pytest
+
+from app.services.identify.preprocess import (
+    INPUT_SIZE,
+    MEAN,
+    STD,
+    preprocess_batch,
+    resized_shape,
+)
+
+MAX_MEAN_ABS_DIFF: float = 0.01
+
+
+def _reference(img: np.ndarray) -> np.ndarray:
+    """Resize of the shorter side to 256, 224 center crop and ImageNet normalization."""
+    height, width = resized_shape(*img.shape[:2])
+    interpolation = cv2.INTER_AREA if height < img.shape[0] else cv2.INTER_LINEAR
+    resized = cv2.resize(img, (width, height), interpolation=interpolation)
+    top, left = round((height - INPUT_SIZE) / 2), round((width - INPUT_SIZE) / 2)
+    crop = resized[top : top + INPUT_SIZE, left : left + INPUT_SIZE, ::-1] / 255
+    return ((crop - MEAN) / STD).transpose(2, 0, 1)
+
+
+class TestPreprocess:
+    @pytest.mark.parametrize("shape", [(120, 90), (224, 224), (300, 700), (1000, 900)])
+    def test_matches_resize_and_center_crop(self, shape: tuple[int, int]):
+        rng = np.random.default_rng(0)
+        img = cv2.GaussianBlur(rng.integers(0, 256, (*shape, 3), dtype=np.uint8), (9, 9), 3)
+
+        batch = preprocess_batch([img])
+
+        assert batch.shape == (1, 3, INPUT_SIZE, INPUT_SIZE)
+        assert batch.dtype == np.float32
+        assert np.abs(batch[0] - _reference(img)).mean() < MAX_MEAN_ABS_DIFF
+
+    def test_buffer_is_reused(self):
+        imgs = [np.full((200, 250, 3), i, dtype=np.uint8) for i in range(4)]
+
+        first = preprocess_batch(imgs)
+        second = preprocess_batch(imgs[:2])
+
+        assert np.shares_memory(first, second)
+        assert second[1, 0, 0, 0] == pytest.approx((1 / 255 - MEAN[0]) / STD[0], abs=1e-5)
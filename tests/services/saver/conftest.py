@@ -0,0 +1,29 @@
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from app.services import firebase_container, pinecone_container
+from app.services.firebase_container import FirebaseContainer
+from app.services.pinecone_container import PineconeContainer
+from app.services.saver import manager
+
+
+@pytest.fixture
+def fake_container(monkeypatch: pytest.MonkeyPatch):
+    """Use a FirebaseContainer on the in-memory bucket and a spied in-memory vector store."""
+    monkeypatch.setattr(firebase_container.settings, "firebase_backend", "fake")
+    monkeypatch.setattr(pinecone_container.settings, "pinecone_backend", "fake")
+    monkeypatch.setattr(manager.settings, "storage_thumbnail_sizes", [64, 128])
+    container = object.__new__(FirebaseContainer)
+    container._initialize()
+    vector_store = object.__new__(PineconeContainer)
+    vector_store._initialize()
+    with (
+        patch.object(FirebaseContainer, "_instance", container),
+        patch(
+            "app.services.saver.manager.get_vector_store",
+            return_value=MagicMock(wraps=vector_store),
+        ),
+        patch("app.services.saver.manager.UserVectorCache", MagicMock()),
+    ):
+        yield container
@@ -0,0 +1,116 @@
+import asyncio
+import io
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import cv2
+import numpy as np
+import pytest
+
+from app.services.firebase_container import FirebaseContainer
+from app.services.saver.bulk import BulkSaver
+from app.services.vector_store import VECTOR_SIZE, VectorStore
+
+TEST_USER: str = "test_user"
+N_IMAGES: int = 6
+
+
+def _uploads() -> list[tuple[str, io.BytesIO]]:
+    rng = np.random.default_rng(0)
+    uploads = [
+        (f"cap_{i}", io.BytesIO(cv2.imencode(".png", rng.integers(0, 256, (120, 90, 3)))[1]))
+        for i in range(N_IMAGES - 1)
+    ]
+    return [*uploads, ("broken", io.BytesIO(b"not an image"))]
+
+
+def _vector_store(upsert: MagicMock) -> MagicMock:
+    vector_store = MagicMock()
+    vector_store.build_vector_id = VectorStore.build_vector_id
+    vector_store.upsert_multiple_pinecone = upsert
+    return vector_store
+
+
+def _embed(img: np.ndarray) -> list[float]:
+    if not img.any():
+        raise ValueError("blank")
+    return [1.0] * VECTOR_SIZE
+
+
+async def _run(
+    uploads: list, vector_store: MagicMock, embed_many: AsyncMock | None = None
+) -> list[dict]:
+    with (
+        patch("app.services.saver.bulk.get_vector_store", return_value=vector_store),
+        patch("app.services.saver.bulk.UserVectorCache", MagicMock()),
+        patch("app.services.saver.bulk.EmbeddingBatcher") as batcher,
+    ):
+        batcher.return_value.embed_many = embed_many or AsyncMock(
+            side_effect=lambda imgs: np.ones((len(imgs), VECTOR_SIZE), dtype=np.float32)
+        )
+        batcher.return_value.embed = AsyncMock(side_effect=_embed)
+        return [event async for event in BulkSaver(uploads, TEST_USER).run()]
+
+
+@pytest.mark.asyncio
+async def test_bulk_saver_reports_every_file(fake_container: FirebaseContainer):
+    """Every file gets one event, the broken one with its error, the vectors are batched."""
+    upsert = MagicMock()
+    uploads = _uploads()
+
+    events = await _run(uploads, _vector_store(upsert))
+
+    assert sorted(event["processed"] for event in events) == list(range(N_IMAGES))
+    errors = [event for event in events if "error" in event]
+    assert [event["filename"] for event in errors] == ["broken"]
+    assert all(event["url"] for event in events if "error" not in event)
+    upserted = [record for call in upsert.call_args_list for record in call.args[0]]
+    assert len(upserted) == N_IMAGES - 1
+    assert upsert.call_count < N_IMAGES - 1
+    assert all(file.closed for _, file in uploads)
+    blob = FirebaseContainer.build_blob_path(TEST_USER, "cap_0.jpg")
+    assert blob in fake_container.bucket.objects
+
+
+@pytest.mark.asyncio
+async def test_bulk_saver_removes_the_images_when_the_upsert_fails(
+    fake_container: FirebaseContainer,
+):
+    """The images whose vectors could not be saved are removed from the storage."""
+    events = await _run(_uploads(), _vector_store(MagicMock(side_effect=ConnectionError)))
+
+    assert len(events) == N_IMAGES
+    assert all("error" in event for event in events)
+    assert fake_container.bucket.objects == {}
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("fake_container")
+async def test_bulk_saver_embeds_one_by_one_when_the_batch_fails():
+    """A failed batch falls back to single embeds, only the file that fails alone errors."""
+    blank = ("blank", io.BytesIO(cv2.imencode(".png", np.zeros((60, 60, 3), np.uint8))[1]))
+    upsert = MagicMock()
+
+    events = await asyncio.wait_for(
+        _run(
+            [*_uploads()[:2], blank],
+            _vector_store(upsert),
+            embed_many=AsyncMock(side_effect=RuntimeError("batch failed")),
+        ),
+        timeout=10,
+    )
+
+    errors = {event["filename"]: event["error"] for event in events if "error" in event}
+    assert len(events) == 3  # noqa: PLR2004
+    assert errors == {"blank": "ValueError: blank"}
+    assert all(len(record["values"]) == VECTOR_SIZE for record in upsert.call_args.args[0])
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("fake_container")
+async def test_bulk_saver_finishes_when_a_stage_dies():
+    """The files still in the pipeline fail with the stage instead of waiting forever."""
+    with patch("app.services.saver.bulk.BulkSaver._take_batch", side_effect=KeyError("stage")):
+        events = await asyncio.wait_for(_run(_uploads(), _vector_store(MagicMock())), timeout=10)
+
+    assert len(events) == N_IMAGES
+    assert all("error" in event for event in events)
@@ -0,0 +1,134 @@
+from unittest.mock import AsyncMock, patch
+
+import cv2
+import numpy as np
+import pytest
+
+from app.services import firebase_container
+from app.services.firebase_container import FirebaseContainer
+from app.services.saver import manager
+from app.services.saver.manager import remove_image, remove_images, save_image
+from app.services.vector_store import EMPTY_VECTOR
+
+TEST_USER: str = "test_user"
+IMAGE_SIZE: int = 256
+
+
+@pytest.mark.asyncio
+async def test_save_image_uploads_jpeg_and_thumbnails(fake_container: FirebaseContainer):
+    """The image is stored as JPEG with its content type, next to its thumbnails."""
+    image = np.random.default_rng(0).integers(0, 256, (300, 400, 3), dtype=np.uint8)
+    file = cv2.imencode(".png", image)[1].tobytes()
+
+    await save_image(file, "cap", TEST_USER, vector=EMPTY_VECTOR)
+
+    objects = fake_container.bucket.objects
+    data, content_type = objects[FirebaseContainer.build_blob_path(TEST_USER, "cap.jpg")]
+    assert content_type == "image/jpeg"
+    assert max(cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR).shape) == IMAGE_SIZE
+    for size in (64, 128):
+        data, _ = objects[FirebaseContainer.build_thumbnail_path(TEST_USER, "cap.jpg", size)]
+        assert max(cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR).shape) == size
+
+    await remove_image("cap", TEST_USER)
+    assert objects == {}
+
+
+@pytest.mark.asyncio
+async def test_file_name_follows_the_storage_format(
+    fake_container: FirebaseContainer, monkeypatch: pytest.MonkeyPatch
+):
+    """The extension matches the content type, the vector keeps the name without it."""
+    file = cv2.imencode(".png", np.zeros((50, 50, 3), dtype=np.uint8))[1].tobytes()
+    await save_image(file, "old", TEST_USER, vector=EMPTY_VECTOR)
+    for module in (manager, firebase_container):
+        monkeypatch.setattr(module.settings, "storage_image_format", "webp")
+    await save_image(file, "new", TEST_USER, vector=EMPTY_VECTOR)
+
+    objects = fake_container.bucket.objects
+    assert objects[FirebaseContainer.build_blob_path(TEST_USER, "new.webp")][1] == "image/webp"
+    upserted = manager.get_vector_store().upsert_into_pinecone.call_args.kwargs
+    assert upserted["metadata"]["name"] == "new"
+
+    # Saved as JPEG before the format changed
+    await remove_image("old", TEST_USER)
+    assert FirebaseContainer.build_blob_path(TEST_USER, "old.jpg") not in objects
+
+
+@pytest.mark.asyncio
+async def test_save_image_decodes_once(fake_container: FirebaseContainer):
+    """The embedding and the storage share the pixels of a single decode."""
+    image = np.random.default_rng(0).integers(0, 256, (300, 400, 3), dtype=np.uint8)
+    file = cv2.imencode(".png", image)[1].tobytes()
+
+    with (
+        patch("app.shared.decoded_image.cv2.imdecode", wraps=cv2.imdecode) as imdecode,
+        patch("app.services.saver.manager.EmbeddingBatcher") as batcher,
+    ):
+        batcher.return_value.embed = AsyncMock(return_value=EMPTY_VECTOR)
+        await save_image(file, "cap", TEST_USER)
+
+    imdecode.assert_called_once()
+    embedded = batcher.return_value.embed.await_args.args[0]
+    assert embedded.shape == image.shape
+    assert fake_container.bucket.objects
+
+
+@pytest.mark.asyncio
+async def test_remove_images_reports_every_name(fake_container: FirebaseContainer):
+    """The vectors are removed in one call, also the one of an image that was not stored."""
+    image = np.zeros((50, 50, 3), dtype=np.uint8)
+    file = cv2.imencode(".png", image)[1].tobytes()
+    await save_image(file, "cap", TEST_USER, vector=EMPTY_VECTOR)
+
+    results = await remove_images(["cap", "missing"], TEST_USER)
+
+    assert results == [
+        {"name": "cap", "deleted": True, "error": None},
+        {"name": "missing", "deleted": False, "error": "Image does not exist."},
+    ]
+    assert fake_container.bucket.objects == {}
+    manager.get_vector_store().remove_vectors.assert_called_once_with(["cap", "missing"], TEST_USER)
+
+
+@pytest.mark.asyncio
+async def test_remove_image_uses_the_file_of_its_vector(fake_container: FirebaseContainer):
+    """Removing cap.jpg doesn't remove cap.jpg the file of the image named cap."""
+    file = cv2.imencode(".png", np.zeros((50, 50, 3), dtype=np.uint8))[1].tobytes()
+    await save_image(file, "cap", TEST_USER, vector=EMPTY_VECTOR)
+    await save_image(file, "cap.jpg", TEST_USER, vector=EMPTY_VECTOR)
+
+    await remove_image("cap.jpg", TEST_USER)
+
+    objects = fake_container.bucket.objects
+    assert FirebaseContainer.build_blob_path(TEST_USER, "cap.jpg") in objects
+    assert FirebaseContainer.build_blob_path(TEST_USER, "cap.jpg.jpg") not in objects
+    assert list(manager.get_vector_store().fetch_metadata(["cap", "cap.jpg"], TEST_USER)) == ["cap"]
+
+
+@pytest.mark.asyncio
+async def test_remove_legacy_image(fake_container: FirebaseContainer):
+    """A vector saved before it kept its file_name is named after its file."""
+    image = np.zeros((50, 50, 3), dtype=np.uint8)
+    fake_container.add_image_to_container(image, name="old.jpg", user_id=TEST_USER)
+    vector_store = manager.get_vector_store()
+    vector_store.upsert_into_pinecone(
+        vector_id=vector_store.build_vector_id(TEST_USER, "old.jpg"),
+        values=EMPTY_VECTOR,
+        metadata={"user_id": TEST_USER, "name": "old.jpg"},
+    )
+
+    await remove_image("old.jpg", TEST_USER)
+
+    assert fake_container.bucket.objects == {}
+    assert vector_store.fetch_metadata(["old.jpg"], TEST_USER) == {}
+
+
+def test_migrate_legacy_metadata():
+    """The old vectors get their file_name and lose the extension of their name."""
+    legacy = {"user_id": TEST_USER, "name": "cap.jpg", "dhash": "00"}
+
+    migrated = manager.migrate_legacy_metadata(legacy)
+
+    assert migrated == {**legacy, "name": "cap", "file_name": "cap.jpg"}
+    assert manager.migrate_legacy_metadata(migrated) == migrated
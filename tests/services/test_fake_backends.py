@@ -0,0 +1,177 @@
+import io
+from unittest.mock import MagicMock, call
+
+import numpy as np
+import pytest
+from fastapi import HTTPException
+from google.api_core.exceptions import NotFound, PreconditionFailed
+from prometheus_client import REGISTRY
+from starlette import status
+
+from app.services import firebase_container, pinecone_container
+from app.services.fake_backends import (
+    FakeBucket,
+    FakePineconeIndex,
+    FaultInjector,
+    InjectedFaultError,
+)
+from app.services.firebase_container import FirebaseContainer
+from app.services.pinecone_container import PineconeContainer
+from app.services.vector_store import VECTOR_SIZE, VectorStore
+
+TEST_USER: str = "test_user"
+NAMESPACE: str = "bottle-caps"
+PAGES: int = 2
+
+
+def _firebase_calls(operation: str) -> float:
+    return (
+        REGISTRY.get_sample_value(
+            "bottle_caps_external_call_seconds_count",
+            {"service": "firebase", "operation": operation},
+        )
+        or 0.0
+    )
+
+
+def _vectors(n: int) -> np.ndarray:
+    return np.random.default_rng(0).normal(size=(n, VECTOR_SIZE)).astype(np.float32)
+
+
+class TestFakePineconeIndex:
+    def test_upsert_query_list_fetch_delete(self):
+        index = FakePineconeIndex()
+        vectors = _vectors(150)
+        ids = [VectorStore.build_vector_id(TEST_USER, f"{i}.jpg") for i in range(len(vectors))]
+        index.upsert(
+            vectors=[
+                {"id": i, "values": v.tolist(), "metadata": {"user_id": TEST_USER}}
+                for i, v in zip(ids, vectors, strict=True)
+            ],
+            namespace=NAMESPACE,
+        )
+
+        result = index.query(
+            vector=vectors[7].tolist(),
+            filter={"user_id": TEST_USER},
+            top_k=3,
+            include_metadata=True,
+            namespace=NAMESPACE,
+        )
+        assert result["matches"][0]["id"] == ids[7]
+        assert result["matches"][0]["metadata"] == {"user_id": TEST_USER}
+
+        pages = list(
+            index.list(prefix=VectorStore.build_vector_prefix(TEST_USER), namespace=NAMESPACE)
+        )
+        assert sorted(i for page in pages for i in page) == sorted(ids)
+        assert len(pages) == PAGES
+
+        fetched = index.fetch(ids=[ids[0], "missing"], namespace=NAMESPACE)
+        assert list(fetched.vectors) == [ids[0]]
+        assert fetched.vectors[ids[0]].metadata == {"user_id": TEST_USER}
+
+        index.delete(ids=[ids[7]], namespace=NAMESPACE)
+        result = index.query(vector=[vectors[7].tolist()], top_k=3, namespace=NAMESPACE)
+        assert ids[7] not in [match["id"] for match in result["matches"]]
+        assert index.query(vector=vectors[7].tolist(), namespace="other")["matches"] == []
+
+        index.delete(delete_all=True, namespace=NAMESPACE)
+        assert list(index.list(namespace=NAMESPACE)) == []
+
+
+class TestFakeBucket:
+    def test_upload_exists_delete(self):
+        bucket = FakeBucket("bucket")
+        blob = bucket.blob("users/test_user/collection/cap.png")
+        assert not blob.exists()
+
+        blob.upload_from_file(io.BytesIO(b"image"), content_type="image/png")
+        assert blob.exists()
+        assert bucket.blob(blob.name).download_as_bytes() == b"image"
+        assert blob.public_url.endswith("/bucket/users/test_user/collection/cap.png")
+        with pytest.raises(PreconditionFailed):
+            blob.upload_from_string(b"other", if_generation_match=0)
+
+        blob.delete()
+        assert not blob.exists()
+        with pytest.raises(NotFound):
+            blob.delete()
+
+    def test_fault_injection(self):
+        bucket = FakeBucket(faults=FaultInjector(error_rate=1.0))
+        with pytest.raises(InjectedFaultError):
+            bucket.blob("cap.png").exists()
+
+        faults = FaultInjector(error_rate=0.5, seed=0)
+        failures = 0
+        for _ in range(200):
+            try:
+                faults("query")
+            except InjectedFaultError:
+                failures += 1
+        assert 60 < failures < 140  # noqa: PLR2004
+
+
+class TestFirebaseContainerOnFakeBucket:
+    def test_one_call_per_save_and_remove(self, monkeypatch: pytest.MonkeyPatch):
+        monkeypatch.setattr(firebase_container.settings, "firebase_backend", "fake")
+        container = object.__new__(FirebaseContainer)
+        container._initialize()
+        container.bucket.faults = MagicMock()
+        image = np.zeros((8, 8, 3), dtype=np.uint8)
+        before = {operation: _firebase_calls(operation) for operation in ["upload", "delete"]}
+
+        url = container.add_image_to_container(image, name="cap.jpg", user_id=TEST_USER)
+        assert url.endswith(FirebaseContainer.build_blob_path(TEST_USER, "cap.jpg"))
+        assert container.bucket.faults.call_args_list == [call("upload"), call("make_public")]
+
+        with pytest.raises(HTTPException) as exc_info:
+            container.add_image_to_container(image, name="cap.jpg", user_id=TEST_USER)
+        assert exc_info.value.status_code == status.HTTP_409_CONFLICT
+
+        assert container.remove_image(name="cap.jpg", user_id=TEST_USER) is True
+        with pytest.raises(HTTPException) as exc_info:
+            container.remove_image(name="cap.jpg", user_id=TEST_USER)
+        assert exc_info.value.status_code == status.HTTP_404_NOT_FOUND
+
+        assert _firebase_calls("upload") == before["upload"] + 2
+        assert _firebase_calls("delete") == before["delete"] + 2
+
+    def test_public_bucket_skips_the_acl(self, monkeypatch: pytest.MonkeyPatch):
+        monkeypatch.setattr(firebase_container.settings, "firebase_backend", "fake")
+        monkeypatch.setattr(firebase_container.settings, "firebase_public_acl", False)
+        container = object.__new__(FirebaseContainer)
+        container._initialize()
+        container.bucket.faults = MagicMock()
+
+        container.add_image_to_container(
+            np.zeros((8, 8, 3), dtype=np.uint8), name="cap.jpg", user_id=TEST_USER
+        )
+
+        assert container.bucket.faults.call_args_list == [call("upload")]
+
+
+class TestPineconeContainerOnFakeIndex:
+    def test_fetch_user_vectors(self, monkeypatch: pytest.MonkeyPatch):
+        monkeypatch.setattr(pinecone_container.settings, "pinecone_backend", "fake")
+        container = object.__new__(PineconeContainer)
+        container._initialize()
+        vectors = _vectors(250)
+        container.upsert_multiple_pinecone(
+            [
+                {
+                    "id": container.build_vector_id(TEST_USER, f"{i}.jpg"),
+                    "values": vector.tolist(),
+                    "metadata": {"user_id": TEST_USER, "name": f"{i}.jpg"},
+                }
+                for i, vector in enumerate(vectors)
+            ]
+        )
+
+        ids, metadata, values = container.fetch_user_vectors(TEST_USER)
+        assert len(ids) == len(vectors)
+        assert sorted(m["name"] for m in metadata) == sorted(f"{i}.jpg" for i in range(250))
+        assert all(len(vector) == VECTOR_SIZE for vector in values)
+
+        assert container.fetch_user_vectors("unknown") == ([], [], [])
@@ -0,0 +1,113 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from app.services import local_vector_store
+from app.services.local_vector_store import LocalIndex, LocalVectorStore
+from app.services.vector_store import VECTOR_SIZE
+
+TEST_USER: str = "test_user"
+OTHER_USER: str = "other_user"
+DIMENSION: int = 16
+
+
+def _random_vectors(n: int, seed: int = 0) -> np.ndarray:
+    return np.random.default_rng(seed).normal(size=(n, DIMENSION)).astype(np.float32)
+
+
+def _open_store(path: Path, monkeypatch: pytest.MonkeyPatch) -> LocalVectorStore:
+    monkeypatch.setattr(local_vector_store.settings, "local_vector_store_path", str(path))
+    monkeypatch.setattr(local_vector_store.settings, "local_vector_store_persist_delay_seconds", 0)
+    store = object.__new__(LocalVectorStore)
+    store._initialize()
+    return store
+
+
+def _filled_index(vectors: np.ndarray, **kwargs) -> LocalIndex:
+    index = LocalIndex(dimension=DIMENSION, **kwargs)
+    index.upsert(
+        ids=[f"id-{i}" for i in range(len(vectors))],
+        vectors=vectors,
+        metadata=[
+            {"user_id": TEST_USER if i % 2 == 0 else OTHER_USER, "name": f"{i}.jpg"}
+            for i in range(len(vectors))
+        ],
+    )
+    return index
+
+
+class TestLocalIndex:
+    def test_query_filters_by_user(self):
+        vectors = _random_vectors(50)
+        index = _filled_index(vectors)
+
+        matches = index.query(vectors[3], top_k=5, metadata_filter={"user_id": OTHER_USER})[0]
+
+        assert matches[0]["id"] == "id-3"
+        assert matches[0]["score"] == pytest.approx(1.0)
+        assert all(match["metadata"]["user_id"] == OTHER_USER for match in matches)
+        assert [m["score"] for m in matches] == sorted([m["score"] for m in matches], reverse=True)
+
+    def test_upsert_overwrites_and_delete_removes(self):
+        vectors = _random_vectors(10)
+        index = _filled_index(vectors)
+
+        index.upsert(["id-0"], vectors[1:2], [{"user_id": OTHER_USER, "name": "moved.jpg"}])
+        assert index.find_ids({"user_id": OTHER_USER, "name": "moved.jpg"}) == ["id-0"]
+        assert index.find_ids({"user_id": TEST_USER, "name": "0.jpg"}) == []
+
+        assert index.delete(["id-0", "missing"]) == 1
+        assert len(index) == len(vectors) - 1
+        assert index.query(vectors[1], top_k=1, metadata_filter={"name": "moved.jpg"}) == [[]]
+
+    def test_approximate_search_finds_exact_neighbours(self):
+        vectors = _random_vectors(4000)
+        index = _filled_index(vectors, nlist=16, nprobe=16, exact_threshold=100)
+
+        results = index.query(vectors[:20], top_k=1)
+
+        assert index.is_trained
+        assert [matches[0]["id"] for matches in results] == [f"id-{i}" for i in range(20)]
+
+    def test_save_and_load_memory_mapped(self, tmp_path: Path):
+        vectors = _random_vectors(30)
+        index = _filled_index(vectors)
+        index.delete(["id-1"])
+        index.save(tmp_path)
+
+        loaded = LocalIndex.load(tmp_path, dimension=DIMENSION)
+        assert isinstance(loaded._vectors, np.memmap)
+        assert len(loaded) == len(vectors) - 1
+        assert loaded.query(vectors[4], top_k=1)[0][0]["id"] == "id-4"
+
+        loaded.upsert(["id-1"], vectors[1:2], [{"user_id": TEST_USER, "name": "1.jpg"}])
+        assert loaded.query(vectors[1], top_k=1)[0][0]["id"] == "id-1"
+
+
+class TestLocalVectorStore:
+    def test_writes_survive_a_crash(self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+        vector = np.random.default_rng(0).normal(size=VECTOR_SIZE).tolist()
+        store = _open_store(tmp_path, monkeypatch)
+        for name in ["0.jpg", "1.jpg"]:
+            vector_id = store.build_vector_id(TEST_USER, name)
+            store.upsert_into_pinecone(vector_id, vector, {"user_id": TEST_USER, "name": name})
+        store.remove_vector("1.jpg", TEST_USER)
+
+        # Killed without persist(), the lock goes away with the process
+        store._lock_file.close()
+        reopened = _open_store(tmp_path, monkeypatch)
+
+        assert reopened.fetch_user_vectors(TEST_USER)[0] == [
+            reopened.build_vector_id(TEST_USER, "0.jpg")
+        ]
+        assert reopened.fetch_metadata(["0.jpg", "1.jpg"], TEST_USER) == {
+            "0.jpg": {"user_id": TEST_USER, "name": "0.jpg"}
+        }
+
+    def test_single_writer(self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+        store = _open_store(tmp_path, monkeypatch)
+
+        with pytest.raises(RuntimeError, match="single worker"):
+            _open_store(tmp_path, monkeypatch)
+        store._lock_file.close()
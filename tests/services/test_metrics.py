@@ -0,0 +1,79 @@
+import asyncio
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import cv2
+import pytest
+
+from app.services.detect.manager import detect_caps, detect_caps_async
+from app.shared import executors
+from app.shared.metrics import render_metrics
+
+TEST_IMAGE: str = "tests/services/test_image.jpg"
+
+# Run in a new interpreter, prometheus_client reads PROMETHEUS_MULTIPROC_DIR when imported
+OBSERVE_IN_WORKER: str = """
+from app.shared.metrics import time_call
+with time_call("pinecone", "query"):
+    pass
+"""
+RENDER_METRICS: str = """
+from app.shared.metrics import render_metrics
+print(render_metrics()[0].decode())
+"""
+
+
+def _sample(body: str, name: str) -> float:
+    lines = [line for line in body.splitlines() if line.startswith(name)]
+    return float(lines[0].rsplit(" ", 1)[1]) if lines else 0.0
+
+
+def _stage_count(stage: str) -> float:
+    return _sample(
+        render_metrics()[0].decode(), f'bottle_caps_stage_seconds_count{{stage="{stage}"}}'
+    )
+
+
+class TestMetrics:
+    def test_detection_stages_are_timed(self):
+        stages = [
+            "preprocess_image_size",
+            "reduce_colors_images",
+            "blob_detection",
+            "hough_transform_circle",
+        ]
+        before = {stage: _stage_count(stage) for stage in stages}
+        detect_caps(cv2.imread(TEST_IMAGE))
+
+        assert all(_stage_count(stage) == before[stage] + 1 for stage in stages)
+
+    def test_process_pool_stages_are_timed(self, monkeypatch: pytest.MonkeyPatch):
+        monkeypatch.delenv("PROMETHEUS_MULTIPROC_DIR", raising=False)
+        monkeypatch.setattr(executors.settings, "detect_executor", "process")
+        monkeypatch.setattr(executors.settings, "detect_workers", 1)
+        executors.shutdown_executors()
+        stages = ["reduce_colors_images", "blob_detection", "hough_transform_circle"]
+        before = {stage: _stage_count(stage) for stage in stages}
+        try:
+            asyncio.run(detect_caps_async(cv2.imread(TEST_IMAGE)))
+        finally:
+            executors.shutdown_executors()
+
+        assert all(_stage_count(stage) == before[stage] + 1 for stage in stages)
+
+    def test_workers_are_aggregated(self, tmp_path: Path):
+        env = {**os.environ, "PROMETHEUS_MULTIPROC_DIR": str(tmp_path), "IS_SENTRY": "false"}
+        for _ in range(2):
+            subprocess.run([sys.executable, "-c", OBSERVE_IN_WORKER], env=env, check=True)  # noqa: S603
+        body = subprocess.run(  # noqa: S603
+            [sys.executable, "-c", RENDER_METRICS],
+            env=env,
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+
+        name = 'bottle_caps_external_call_seconds_count{operation="query",service="pinecone"}'
+        assert _sample(body, name) == 2  # noqa: PLR2004
@@ -1,12 +1,9 @@
 import time
-import uuid
 
-import pytest
 from dotenv import load_dotenv
-from fastapi import HTTPException
-from starlette import status
 
-from app.services.pinecone_container import EMPTY_VECTOR, PineconeContainer
+from app.services.pinecone_container import PineconeContainer
+from app.services.vector_store import EMPTY_VECTOR
 
 load_dotenv()
 
@@ -19,7 +16,7 @@ class TestFirebaseContainer:
     def test_remove_image_ok(self):
         image_name: str = "test_image.jpg"
         self.pinecone_container.upsert_into_pinecone(
-            vector_id=str(uuid.uuid4()),
+            vector_id=PineconeContainer.build_vector_id(TEST_USER, image_name),
             values=EMPTY_VECTOR,
             metadata={"user_id": TEST_USER, "name": image_name},
         )
@@ -31,8 +28,16 @@ class TestFirebaseContainer:
         )
         assert len(res) == 0
 
-    def test_remove_image_error_404(self):
+    def test_remove_image_not_existing(self):
         image_name: str = "non_existing.jpg"
-        with pytest.raises(HTTPException) as exc_info:
-            self.pinecone_container.remove_vector(name=image_name, user_id=TEST_USER)
-        assert exc_info.value.status_code == status.HTTP_404_NOT_FOUND
+        self.pinecone_container.remove_vector(name=image_name, user_id=TEST_USER)
+        res = self.pinecone_container.query_with_metadata(
+            vector=EMPTY_VECTOR, metadata={"name": image_name, "user_id": TEST_USER}
+        )
+        assert len(res) == 0
+
+    def test_build_vector_id_is_deterministic(self):
+        vector_id: str = PineconeContainer.build_vector_id(TEST_USER, "cap.jpg")
+        assert vector_id == PineconeContainer.build_vector_id(TEST_USER, "cap.jpg")
+        assert vector_id.startswith(PineconeContainer.build_vector_prefix(TEST_USER))
+        assert vector_id != PineconeContainer.build_vector_id("other_user", "cap.jpg")
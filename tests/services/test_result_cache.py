@@ -0,0 +1,131 @@
+import asyncio
+import os
+import time
+from pathlib import Path
+
+import pytest
+
+from app.services.result_cache import ResultCache
+
+TEST_USER: str = "test_user"
+
+
+def _cache(directory: Path | None = None) -> ResultCache:
+    cache = ResultCache()
+    cache._initialize()
+    cache.enabled = True
+    cache.directory = directory
+    return cache
+
+
+class _Counter:
+    def __init__(self):
+        self.calls = 0
+
+    async def compute(self) -> dict:
+        self.calls += 1
+        await asyncio.sleep(0.01)
+        return {"calls": self.calls}
+
+
+class TestResultCache:
+    @pytest.mark.asyncio
+    async def test_identical_concurrent_requests_are_coalesced(self):
+        cache = _cache()
+        counter = _Counter()
+
+        results = await asyncio.gather(
+            *[cache.get_or_compute("detect", b"image", counter.compute) for _ in range(5)]
+        )
+        again = await cache.get_or_compute("detect", b"image", counter.compute)
+
+        assert counter.calls == 1
+        assert results == [{"calls": 1}] * 5
+        assert again == {"calls": 1}
+
+    @pytest.mark.asyncio
+    async def test_user_invalidation(self, tmp_path: Path):
+        cache = _cache(tmp_path)
+        counter = _Counter()
+
+        await cache.get_or_compute("identify", b"image", counter.compute, user_id=TEST_USER)
+        await cache.get_or_compute("identify", b"image", counter.compute, user_id="other")
+        cache.invalidate_user(TEST_USER)
+        result = await cache.get_or_compute(
+            "identify", b"image", counter.compute, user_id=TEST_USER
+        )
+
+        assert result == {"calls": 3}
+
+    @pytest.mark.asyncio
+    async def test_disk_tier_is_shared(self, tmp_path: Path):
+        counter = _Counter()
+        await _cache(tmp_path).get_or_compute("identify", b"a", counter.compute, TEST_USER)
+
+        other_worker = _cache(tmp_path)
+        assert await other_worker.get_or_compute("identify", b"a", counter.compute, TEST_USER) == {
+            "calls": 1
+        }
+
+        other_worker.invalidate_user(TEST_USER)
+        result = await _cache(tmp_path).get_or_compute("identify", b"a", counter.compute, TEST_USER)
+        assert result == {"calls": 2}
+
+    @pytest.mark.asyncio
+    async def test_invalidation_reaches_the_other_workers(self, tmp_path: Path):
+        counter = _Counter()
+        worker, other_worker = _cache(tmp_path), _cache(tmp_path)
+        await worker.get_or_compute("identify", b"a", counter.compute, TEST_USER)
+
+        # A save handled by the other worker, the result is still in the memory of this one
+        other_worker.invalidate_user(TEST_USER)
+        result = await worker.get_or_compute("identify", b"a", counter.compute, TEST_USER)
+
+        assert result == {"calls": 2}
+
+    @pytest.mark.asyncio
+    async def test_user_results_need_a_shared_directory(self):
+        cache = _cache()
+        counter = _Counter()
+
+        for _ in range(2):
+            await cache.get_or_compute("identify", b"a", counter.compute, TEST_USER)
+        assert counter.calls == 2  # noqa: PLR2004
+
+        for _ in range(2):
+            await cache.get_or_compute("detect", b"a", counter.compute)
+        assert counter.calls == 3  # noqa: PLR2004
+
+    @pytest.mark.asyncio
+    async def test_cancelled_request_hands_over_to_the_waiters(self):
+        cache = _cache()
+        counter = _Counter()
+
+        first = asyncio.create_task(cache.get_or_compute("detect", b"a", counter.compute))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(cache.get_or_compute("detect", b"a", counter.compute))
+        await asyncio.sleep(0)
+        # The client of the first request disconnects while it computes
+        first.cancel()
+
+        assert await asyncio.wait_for(second, timeout=5) == {"calls": 2}
+        assert first.cancelled()
+
+    @pytest.mark.asyncio
+    async def test_sweep_removes_the_expired_and_the_oldest_entries(self, tmp_path: Path):
+        cache = _cache(tmp_path)
+        counter = _Counter()
+        for content in [b"expired", b"old", b"new"]:
+            await cache.get_or_compute("detect", content, counter.compute)
+        paths = {
+            content: cache._entry_path(cache.build_key("detect", content))
+            for content in [b"expired", b"old", b"new"]
+        }
+        now = time.time()
+        os.utime(paths[b"expired"], (now, now - cache.ttl - 1))
+        os.utime(paths[b"old"], (now, now - 10))
+        cache.max_disk_bytes = paths[b"new"].stat().st_size
+
+        cache.sweep()
+
+        assert [content for content, path in paths.items() if path.exists()] == [b"new"]
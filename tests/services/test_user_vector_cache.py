@@ -0,0 +1,145 @@
+from unittest.mock import MagicMock, patch
+
+import cv2
+import numpy as np
+import pytest
+
+from app.services.user_vector_cache import UserVectorCache, UserWorkingSet
+from app.services.vector_store import VECTOR_SIZE
+from app.shared.perceptual_hash import dhash
+from app.shared.utils import apply_mask
+
+TEST_USER: str = "test_user"
+
+
+def _vectors(n: int, seed: int = 0) -> list[list[float]]:
+    return np.random.default_rng(seed).normal(size=(n, VECTOR_SIZE)).tolist()
+
+
+def _store(vectors: list[list[float]]) -> MagicMock:
+    store = MagicMock()
+    store.fetch_user_vectors.return_value = (
+        [f"id-{i}" for i in range(len(vectors))],
+        [{"user_id": TEST_USER, "name": f"{i}.jpg"} for i in range(len(vectors))],
+        vectors,
+    )
+    return store
+
+
+def _cap(seed: int) -> np.ndarray:
+    # A smooth random image, like a photo, so the neighbouring pixels are correlated
+    noise = np.random.default_rng(seed).integers(0, 256, (12, 12, 3), dtype=np.uint8)
+    return cv2.resize(noise, (240, 240), interpolation=cv2.INTER_CUBIC)
+
+
+def _rephotographed(image: np.ndarray) -> np.ndarray:
+    smaller = cv2.resize(image, (180, 180), interpolation=cv2.INTER_AREA)
+    brighter = cv2.convertScaleAbs(smaller, alpha=1.05, beta=6)
+    return cv2.imdecode(cv2.imencode(".jpg", brighter, [cv2.IMWRITE_JPEG_QUALITY, 70])[1], 1)
+
+
+def _cache(max_bytes: int = 10**9) -> UserVectorCache:
+    cache = UserVectorCache()
+    cache._initialize()
+    cache.enabled = True
+    cache.max_bytes = max_bytes
+    return cache
+
+
+class TestUserVectorCache:
+    def test_query_loads_user_once(self):
+        vectors = _vectors(20)
+        store = _store(vectors)
+        cache = _cache()
+
+        with patch("app.services.user_vector_cache.get_vector_store", return_value=store):
+            first = cache.query_many(TEST_USER, vectors[:2])
+            second = cache.query_many(TEST_USER, vectors[5:6])
+
+        assert [matches[0]["metadata"]["name"] for matches in first] == ["0.jpg", "1.jpg"]
+        assert second[0][0]["id"] == "id-5"
+        assert second[0][0]["score"] == pytest.approx(1.0)
+        assert store.fetch_user_vectors.call_count == 1
+        store.query_many_with_metadata.assert_not_called()
+
+    def test_save_and_remove_update_cached_user(self):
+        vectors = _vectors(5)
+        new_vector = _vectors(1, seed=1)[0]
+        cache = _cache()
+
+        with patch("app.services.user_vector_cache.get_vector_store", return_value=_store(vectors)):
+            cache.query_many(TEST_USER, vectors[:1])
+            cache.upsert(TEST_USER, "new", new_vector, {"user_id": TEST_USER, "name": "new.jpg"})
+            assert cache.query_many(TEST_USER, [new_vector])[0][0]["id"] == "new"
+
+            cache.remove(TEST_USER, name="new.jpg")
+            assert "new" not in [m["id"] for m in cache.query_many(TEST_USER, [new_vector])[0]]
+
+    def test_queries_search_outside_the_lock(self):
+        vectors = _vectors(5)
+        cache = _cache()
+        query = UserWorkingSet.query
+
+        def unlocked_query(working_set: UserWorkingSet, queries: np.ndarray) -> list[list[dict]]:
+            assert not cache._lock._is_owned()
+            return query(working_set, queries)
+
+        with (
+            patch("app.services.user_vector_cache.get_vector_store", return_value=_store(vectors)),
+            patch.object(UserWorkingSet, "query", unlocked_query),
+        ):
+            cache.query_many(TEST_USER, vectors[:1])
+            searched = cache._entries[TEST_USER]
+            cache.upsert(TEST_USER, "new", vectors[0], {"user_id": TEST_USER, "name": "new.jpg"})
+
+        # The set being searched is replaced, not modified
+        assert len(searched.ids) == len(vectors)
+        assert len(cache._entries[TEST_USER].ids) == len(vectors) + 1
+
+    def test_failed_load_is_tried_again(self):
+        vectors = _vectors(5)
+        store = _store(vectors)
+        fetched = store.fetch_user_vectors.return_value
+        store.fetch_user_vectors.side_effect = [ConnectionError("Pinecone is down"), fetched]
+        cache = _cache()
+
+        with patch("app.services.user_vector_cache.get_vector_store", return_value=store):
+            with pytest.raises(ConnectionError):
+                cache.query_many(TEST_USER, vectors[:1])
+            assert cache._loading == {}
+            assert cache.query_many(TEST_USER, vectors[:1])[0][0]["id"] == "id-0"
+
+    def test_least_recently_used_user_is_evicted(self):
+        vectors = _vectors(10)
+        # The float32 vector, the uint64 hash and its flag of every image
+        one_user_bytes = len(vectors) * (VECTOR_SIZE * 4 + 8 + 1)
+        cache = _cache(max_bytes=2 * one_user_bytes)
+
+        with patch("app.services.user_vector_cache.get_vector_store", return_value=_store(vectors)):
+            for user_id in ["a", "b", "a", "c"]:
+                cache.query_many(user_id, vectors[:1])
+
+        assert list(cache._entries) == ["a", "c"]
+        assert cache.nbytes <= cache.max_bytes
+
+    def test_near_duplicate_is_found_by_hash(self):
+        vectors = _vectors(3)
+        store = _store(vectors)
+        caps = [apply_mask(_cap(seed)) for seed in range(3)]
+        _, metadata, _ = store.fetch_user_vectors.return_value
+        for cap_metadata, cap in zip(metadata[:2], caps[:2], strict=True):
+            cap_metadata["dhash"] = dhash(cap)
+        cache = _cache()
+
+        with patch("app.services.user_vector_cache.get_vector_store", return_value=store):
+            queries = [dhash(apply_mask(_rephotographed(_cap(1)))), dhash(caps[2])]
+            matches, missing = cache.find_near_duplicates(TEST_USER, queries)
+            # The matches of the stored vector, as if the image had been embedded
+            assert [match["metadata"]["name"] for match in matches] == ["1.jpg", "0.jpg", "2.jpg"]
+            assert matches[0]["score"] == pytest.approx(1.0)
+            assert matches[1:] == cache.query_many(TEST_USER, [vectors[1]])[0][1:]
+            # The third image has no hash, it was saved before them
+            assert missing is None
+
+            cache.remove(TEST_USER, name="1.jpg")
+            assert cache.find_near_duplicates(TEST_USER, [dhash(caps[1])]) == [None]
@@ -0,0 +1,49 @@
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+from app.services import warm_up
+from app.services.warm_up import WarmUp
+
+
+def _warm_up() -> WarmUp:
+    instance = WarmUp()
+    instance._initialize()
+    return instance
+
+
+class TestWarmUp:
+    @pytest.mark.asyncio
+    async def test_ready_after_warm_up(self, monkeypatch: pytest.MonkeyPatch):
+        monkeypatch.setattr(warm_up.settings, "initialize_model", False)
+        instance = _warm_up()
+
+        with (
+            patch("app.services.warm_up.run_on_image", AsyncMock()) as run_on_image,
+            patch("app.services.firebase_container.FirebaseContainer", MagicMock()),
+            patch("app.services.vector_store.get_vector_store", MagicMock()) as get_store,
+        ):
+            assert not instance.ready
+            await instance.run()
+
+        assert instance.get_status()["ready"]
+        run_on_image.assert_awaited_once()
+        get_store.assert_called_once()
+
+    @pytest.mark.asyncio
+    async def test_not_ready_when_a_dependency_fails(self, monkeypatch: pytest.MonkeyPatch):
+        monkeypatch.setattr(warm_up.settings, "initialize_model", False)
+        instance = _warm_up()
+
+        with (
+            patch("app.services.warm_up.run_on_image", AsyncMock()),
+            patch(
+                "app.services.firebase_container.FirebaseContainer",
+                MagicMock(side_effect=ValueError("Invalid JSON for firebase_credentials")),
+            ),
+            patch("app.services.vector_store.get_vector_store", MagicMock()),
+        ):
+            await instance.run()
+
+        assert not instance.ready
+        assert "Invalid JSON" in instance.get_status()["error"]